@@ -0,0 +1,325 @@
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+import topk
+from db import connect_db, db_file
+
+# Buffered writer for the activity tables (search, viewedProduct).
+# Product views and searches are the most frequent writes in the app, and
+# committing each one on its own costs an fsync per click. Rows are instead
+# kept in a bounded buffer and written with executemany in one transaction.
+#
+# Durability modes (COMMERCE_ACTIVITY_MODE or configure()):
+#   sync    - insert and commit every event immediately (old behaviour)
+#   batched - buffer events, flush on size/time threshold or session end
+#   async   - like batched, but a background thread does the writes on its
+#             own connection so the customer never waits for the commit
+
+MODES = ("sync", "batched", "async")
+
+DEFAULT_MODE = os.environ.get("COMMERCE_ACTIVITY_MODE", "batched")
+DEFAULT_MAX_ROWS = int(os.environ.get("COMMERCE_ACTIVITY_MAX_ROWS", "100"))
+DEFAULT_MAX_DELAY = float(os.environ.get("COMMERCE_ACTIVITY_MAX_DELAY", "5"))
+
+# async writer: attempts per batch, first retry delay (doubling), and how
+# often blocked callers check that the writer is still alive (seconds)
+WRITE_ATTEMPTS = 3
+RETRY_DELAY = 0.1
+WAIT_STEP = 0.5
+
+INSERT_SQL = {
+    "search": "INSERT INTO search(cid, sessionNo, ts, query) VALUES(?,?,?,?)",
+    "viewedProduct": "INSERT INTO viewedProduct(cid, sessionNo, ts, pid) VALUES(?,?,?,?)",
+}
+
+
+# Writes a batch of (table, row) events in a single transaction, with the
+# view counters of the batch (topk.add_views). Returns how many events were
+# dropped because their row was rejected (e.g. an unknown session).
+def write_events(conn, events):
+    by_table = {}
+    for table, row in events:
+        by_table.setdefault(table, []).append(row)
+    try:
+        for table, rows in by_table.items():
+            conn.executemany(INSERT_SQL[table], rows)
+        topk.add_views(conn, by_table.get("viewedProduct", []))
+        conn.commit()
+        return 0
+    except sqlite3.IntegrityError:
+        # one bad row (e.g. an unknown session) must not cost the whole batch
+        conn.rollback()
+        views = []
+        dropped = 0
+        for table, rows in by_table.items():
+            for row in rows:
+                try:
+                    conn.execute(INSERT_SQL[table], row)
+                except sqlite3.IntegrityError as e:
+                    if not dropped:
+                        sys.stderr.write(f"activity log: {table} row {row!r} rejected ({e})\n")
+                    dropped += 1
+                    continue
+                if table == "viewedProduct":
+                    views.append(row)
+        topk.add_views(conn, views)
+        conn.commit()
+        if dropped:
+            sys.stderr.write(f"activity log: {dropped} of {len(events)} events dropped\n")
+        return dropped
+
+
+class ActivityLog:
+
+    def __init__(self, mode=DEFAULT_MODE, max_rows=DEFAULT_MAX_ROWS, max_delay=DEFAULT_MAX_DELAY):
+        if mode not in MODES:
+            raise ValueError(f"unknown activity log mode {mode!r}, expected one of {MODES}")
+        self.mode = mode
+        self.max_rows = max(1, max_rows)
+        self.max_delay = max_delay
+        self._buffer = []
+        self._first_at = None
+        self._lock = threading.Lock()
+        # async mode state
+        self._queue = None
+        self._worker = None
+        self._path = None
+        # held by the writer while it commits a batch
+        self._write_lock = threading.Lock()
+        self.errors = 0
+        self.last_error = None
+        # events dropped because the database rejected their row
+        self.dropped = 0
+
+    # Queues one event; `table` is "search" or "viewedProduct"
+    def record(self, conn, table, row):
+        if self.mode == "sync":
+            self._write_now(conn, [(table, row)])
+            return
+        if self.mode == "async" and not self._start_worker(conn):
+            # in-memory databases cannot be opened from another thread
+            self.mode = "batched"
+        with self._lock:
+            if not self._buffer:
+                self._first_at = time.monotonic()
+            self._buffer.append((table, row))
+            full = len(self._buffer) >= self.max_rows
+            stale = time.monotonic() - self._first_at >= self.max_delay
+        if full or stale:
+            self._flush_buffer(conn)
+
+    # Takes the buffered events out under the lock
+    def _drain(self):
+        with self._lock:
+            events = self._buffer
+            self._buffer = []
+            self._first_at = None
+        return events
+
+    # Puts drained events back in front of the buffer (a failed write)
+    def _rebuffer(self, events):
+        with self._lock:
+            self._buffer[:0] = events
+            if self._first_at is None:
+                self._first_at = time.monotonic()
+
+    # Writes events on the caller's connection. A failure (e.g. "database is
+    # locked" past the busy timeout) is reported and the events go back into
+    # the buffer for the next flush: logging a view must not fail the page.
+    def _write_now(self, conn, events):
+        if conn is None:
+            self._rebuffer(events)
+            return
+        try:
+            self.dropped += write_events(conn, events)
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.rollback()
+            self.errors += 1
+            self.last_error = e
+            sys.stderr.write(f"activity log: {len(events)} events not written ({e}), kept for the next flush\n")
+            self._rebuffer(events)
+
+    def _flush_buffer(self, conn):
+        events = self._drain()
+        if not events:
+            return
+        if self.mode == "async" and self._worker_alive(conn):
+            self._put(conn, events)
+        else:
+            self._write_now(conn, events)
+
+    # Hands a batch to the writer; the queue is bounded, so this blocks
+    # (back-pressure) while the writer falls behind, but not on a dead writer
+    def _put(self, conn, events):
+        while True:
+            try:
+                self._queue.put(events, timeout=WAIT_STEP)
+                return
+            except queue.Full:
+                if not self._worker_alive(conn):
+                    self._write_now(conn, events)
+                    return
+
+    # True if the background writer runs. If it died, the batches still
+    # queued for it are written on conn and the log falls back to batched mode.
+    def _worker_alive(self, conn):
+        if self._worker is None:
+            return False
+        if self._worker.is_alive():
+            return True
+        sys.stderr.write(f"activity log: background writer stopped ({self.last_error!r}), writing synchronously\n")
+        orphaned = []
+        while True:
+            try:
+                events = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if events is not None:
+                orphaned.extend(events)
+        self._worker = None
+        self._queue = None
+        self.mode = "batched"
+        if orphaned:
+            self._write_now(conn, orphaned)
+        return False
+
+    # Waits until the writer has taken and written every queued batch
+    def _wait_idle(self, conn):
+        q = self._queue
+        with q.all_tasks_done:
+            while q.unfinished_tasks and self._worker.is_alive():
+                q.all_tasks_done.wait(WAIT_STEP)
+        # a batch the writer is writing on its own (time threshold)
+        with self._write_lock:
+            pass
+        self._worker_alive(conn)
+
+    # Writes everything buffered so far and waits until it is on disk
+    def flush(self, conn):
+        self._flush_buffer(conn)
+        if self._queue is not None:
+            self._wait_idle(conn)
+            # put back by the writer after its retries failed
+            if conn is not None and self._buffer:
+                self._write_now(conn, self._drain())
+
+    # Flushes and stops the background writer (if any). Without a conn,
+    # events buffered in batched mode stay in the buffer (see configure()).
+    def close(self, conn=None):
+        self.flush(conn)
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join()
+            self._worker = None
+            self._queue = None
+        # written by neither (a failed write was put back); if this fails
+        # too they stay buffered, and pending() says so
+        if conn is not None and self._buffer:
+            self._write_now(conn, self._drain())
+
+    def pending(self):
+        with self._lock:
+            return len(self._buffer)
+
+    def _start_worker(self, conn):
+        if self._worker is not None:
+            return True
+        path = db_file(conn)
+        if not path:
+            return False
+        self._path = path
+        self._queue = queue.Queue(maxsize=8)
+        self._worker = threading.Thread(target=self._run_worker, name="activity-log", daemon=True)
+        self._worker.start()
+        return True
+
+    # Writes one batch on the writer's connection. A failure (e.g. "database
+    # is locked" past the busy timeout) is retried with a backoff; after the
+    # last attempt the events go back into the buffer for the next flush.
+    def _write_batch(self, conn, events):
+        for attempt in range(WRITE_ATTEMPTS):
+            try:
+                self.dropped += write_events(conn, events)
+                return
+            except sqlite3.Error as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                self.last_error = e
+                time.sleep(RETRY_DELAY * 2 ** attempt)
+            except BaseException:
+                # the writer dies; whoever flushes next writes the batch
+                self._rebuffer(events)
+                raise
+        self.errors += 1
+        sys.stderr.write(f"activity log: {len(events)} events not written ({self.last_error}), kept for the next flush\n")
+        self._rebuffer(events)
+
+    def _run_worker(self):
+        try:
+            conn = connect_db(self._path)
+        except sqlite3.Error as e:
+            self.last_error = e
+            return
+        try:
+            while True:
+                try:
+                    events = self._queue.get(timeout=self.max_delay)
+                except queue.Empty:
+                    # time threshold: write whatever sat in the buffer too long.
+                    # The buffer is drained under the lock, so record() never
+                    # waits for this commit; flush() waits on _write_lock.
+                    with self._write_lock:
+                        events = self._drain()
+                        if events:
+                            self._write_batch(conn, events)
+                    continue
+                try:
+                    if events is None:
+                        return
+                    with self._write_lock:
+                        self._write_batch(conn, events)
+                finally:
+                    self._queue.task_done()
+        except BaseException as e:
+            self.last_error = e
+            raise
+        finally:
+            conn.close()
+
+
+# Process-wide log used by customer.py / sessions.py
+_log = ActivityLog()
+
+
+# Replaces the process-wide log with one using the given settings. The
+# events buffered by the old log are written first, on conn (or by its
+# background writer); with neither, buffered events raise instead of being
+# dropped.
+def configure(mode=DEFAULT_MODE, max_rows=DEFAULT_MAX_ROWS, max_delay=DEFAULT_MAX_DELAY, conn=None):
+    global _log
+    _log.close(conn)
+    if _log.pending():
+        raise RuntimeError(f"{_log.pending()} activity events are still buffered; pass conn to write them")
+    _log = ActivityLog(mode, max_rows, max_delay)
+    return _log
+
+
+def get_log():
+    return _log
+
+
+def record(conn, table, row):
+    _log.record(conn, table, row)
+
+
+def flush(conn):
+    _log.flush(conn)
+
+
+def close(conn=None):
+    _log.close(conn)
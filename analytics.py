@@ -0,0 +1,101 @@
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+
+import rollups
+
+# Programmatic sales analytics.
+# Every function returns SalesSummary objects instead of printing, for any
+# [start, end) date range ("YYYY-MM-DD" strings, end exclusive, end=None for
+# no upper bound). All metrics of a summary come from one scan of the
+# range's orders (or from the daily rollups), and the grouped variants return
+# every group from a single GROUP BY query, e.g. a month of daily reports in
+# one call. sales.weekly_sales_report only renders what this returns.
+
+GROUPINGS = ("day", "category", "cohort")
+
+_OPEN_END = "9999-12-31"
+
+
+@dataclass
+class SalesSummary:
+    start: str
+    end: str
+    orders: int = 0
+    products: int = 0
+    customers: int = 0
+    revenue: float = 0.0
+
+    @property
+    def avg_per_customer(self):
+        return self.revenue / self.customers if self.customers else 0.0
+
+    def as_dict(self):
+        data = asdict(self)
+        data["avg_per_customer"] = self.avg_per_customer
+        return data
+
+
+def days_ago(days, today=None):
+    today = today or datetime.now()
+    return (today - timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+# Totals over [start, end): distinct orders, products, customers and revenue.
+# source="rollups" reads the daily rollup tables kept by checkout;
+# source="raw" computes everything in one pass over orders/orderlines.
+def sales_summary(conn, start, end=None, source="rollups"):
+    if source == "rollups":
+        totals = rollups.summary(conn, start, end)
+        return SalesSummary(start, end, totals["orders"], totals["products"], totals["customers"], totals["revenue"] or 0.0)
+    if source != "raw":
+        raise ValueError(f"unknown source {source!r}, expected 'rollups' or 'raw'")
+    row = conn.execute(
+        """
+        SELECT COUNT(DISTINCT o.ono), COUNT(DISTINCT ol.pid), COUNT(DISTINCT o.cid),
+               COALESCE(SUM(ol.qty * ol.uprice), 0)
+        FROM orders o LEFT JOIN orderlines ol ON ol.ono = o.ono
+        WHERE o.odate >= ? AND o.odate < ?
+        """,
+        (start, end or _OPEN_END),
+    ).fetchone()
+    return SalesSummary(start, end, row[0], row[1], row[2], row[3])
+
+
+# The report shown in the sales menu: the last `days` days up to now
+def recent_sales(conn, days=7):
+    return sales_summary(conn, days_ago(days))
+
+
+# One SalesSummary per group for [start, end), from a single query:
+#   day      - per order date
+#   category - per product category (orders/customers that bought in it)
+#   cohort   - per customer cohort, the month ("YYYY-MM") of their first order
+# Returns a dict {group key: SalesSummary} ordered by key.
+def sales_summary_by(conn, start, end=None, group="day"):
+    params = [start, end or _OPEN_END]
+    if group == "day":
+        key_sql = "o.odate"
+        join_sql = "LEFT JOIN orderlines ol ON ol.ono = o.ono"
+    elif group == "category":
+        key_sql = "p.category"
+        join_sql = "JOIN orderlines ol ON ol.ono = o.ono JOIN products p ON p.pid = ol.pid"
+    elif group == "cohort":
+        key_sql = "f.cohort"
+        join_sql = """
+            LEFT JOIN orderlines ol ON ol.ono = o.ono
+            JOIN (SELECT cid, substr(MIN(odate), 1, 7) AS cohort FROM orders GROUP BY cid) f ON f.cid = o.cid
+        """
+    else:
+        raise ValueError(f"unknown grouping {group!r}, expected one of {GROUPINGS}")
+    rows = conn.execute(
+        f"""
+        SELECT {key_sql} AS grp, COUNT(DISTINCT o.ono), COUNT(DISTINCT ol.pid), COUNT(DISTINCT o.cid),
+               COALESCE(SUM(ol.qty * ol.uprice), 0)
+        FROM orders o {join_sql}
+        WHERE o.odate >= ? AND o.odate < ?
+        GROUP BY grp
+        ORDER BY grp
+        """,
+        params,
+    ).fetchall()
+    return {row[0]: SalesSummary(start, end, row[1], row[2], row[3], row[4]) for row in rows}
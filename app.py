@@ -1,5 +1,11 @@
+import argparse
+import json
 import sys
-from db import connect_db, init_db
+
+import activity
+import services
+from db import connect_db, init_db, PROFILES, DEFAULT_PROFILE
+from migrations import migrate, print_step
 from auth import login, signup
 from sessions import start_customer_session, end_customer_session
 from customer import customer_menu as _customer_menu
@@ -22,15 +28,61 @@ def customer_menu(conn, cid):
     finally:
         end_customer_session(conn, cid, session_no)
 
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Store CLI")
+    parser.add_argument("db_path", nargs="?", default=None, help="existing database file (default: local ecommerce.db)")
+    parser.add_argument(
+        "--profile",
+        choices=sorted(PROFILES),
+        default=None,
+        help=f"connection profile (default: $COMMERCE_DB_PROFILE or {DEFAULT_PROFILE})",
+    )
+    parser.add_argument(
+        "--script",
+        action="store_true",
+        help="read JSONL commands from stdin and write JSONL results to stdout instead of showing menus",
+    )
+    return parser.parse_args(argv)
+
+
+# Scripted mode: one JSON command per input line, e.g.
+#   {"id": 1, "op": "login", "user": "1", "password": "sales"}
+#   {"id": 2, "op": "search", "cid": 10001, "session_no": 1, "keywords": "widget"}
+# and one JSON response per output line, in order (see services.dispatch
+# and services.OPERATIONS for the operations and their arguments).
+def run_script(conn, infile, outfile):
+    for line in infile:
+        if not line.strip():
+            continue
+        try:
+            command = json.loads(line)
+        except ValueError as e:
+            response = {"ok": False, "error": "ValidationError", "message": f"bad JSON: {e}"}
+        else:
+            response = services.dispatch(conn, command)
+        outfile.write(json.dumps(response, default=str) + "\n")
+        outfile.flush()
+
+
 def run():
-    if len(sys.argv) > 1:
-        db_path = sys.argv[1] 
-    else:
-        db_path = None
-    conn = connect_db(db_path)
-    # Only initialize schema when no DB path is provided.
+    args = parse_args(sys.argv[1:])
+    db_path = args.db_path
+    conn = connect_db(db_path, profile=args.profile)
+    # Only seed demo data when no DB path is provided.
     if db_path is None:
         init_db(conn)
+    else:
+        # existing databases get any pending schema migrations, data is kept
+        # (reported on the console, but not into a script's JSONL output)
+        migrate(conn, report=None if args.script else print_step)
+    if args.script:
+        try:
+            run_script(conn, sys.stdin, sys.stdout)
+        finally:
+            # buffered activity events are written even if the script fails
+            activity.close(conn)
+            conn.close()
+        return
     while True:
         choice = main_menu()
         if choice == "1":
@@ -48,6 +100,7 @@ def run():
             break
         else:
             print("Invalid choice.")
+    activity.close(conn)
     conn.close()
 
 if __name__ == "__main__":
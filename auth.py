@@ -1,21 +1,13 @@
-import sqlite3
-from datetime import datetime
 from getpass import getpass
-import hashlib
+
+import services
+from ids import next_id
 
 
 def generate_new_uid(conn):
-    cur = conn.cursor()
-    # Generate a new unique numeric user id 
-    cur.execute("SELECT MAX(uid) FROM users")
-    row = cur.fetchone()
-    
-    if row and row[0] is not None:
-        new_uid = row[0] + 1
-    else:
-        new_uid = 10001
-    
-    return new_uid
+    # Generate a new unique numeric user id from the shared users sequence,
+    # so concurrent signups in different processes never get the same uid
+    return next_id(conn, "users")
 
 
 def login(conn):
@@ -23,50 +15,15 @@ def login(conn):
     
     user_input = input("User ID or email address: ").strip()
     pwd = getpass("Enter your password: ")
-    cur = conn.cursor()
 
-    # Try login by numeric uid first
-    uid_row = None
+    # a uid (all digits) or an email address (see services.find_account)
     try:
-        uid_val = int(user_input)
-        cur.execute("SELECT uid, role, pwd FROM users WHERE uid = ?", (uid_val,))
-        uid_row = cur.fetchone()
-    except ValueError:
-        uid_row = None
-
-    if uid_row is not None:
-        stored_pwd = uid_row[2]
-        pwd_bytes = pwd.encode("utf-8")
-        pwd_hash = hashlib.sha256(pwd_bytes)
-        pwd_hex = pwd_hash.hexdigest()
-        if pwd_hex == stored_pwd:
-            uid = uid_row[0]
-            role = uid_row[1]
-            return uid, role
-
-    # Try logging in with email instead
-    cur.execute(
-        """
-        SELECT u.uid, u.role, u.pwd
-        FROM users u 
-        JOIN customers c ON u.uid = c.cid
-        WHERE lower(c.email) = lower(?)
-        """,
-        (user_input,),
-    )
-    email_row = cur.fetchone()
-    if email_row is not None:
-        pwd_bytes = pwd.encode("utf-8")
-        pwd_hash = hashlib.sha256(pwd_bytes)
-        pwd_hex = pwd_hash.hexdigest()
-        if pwd_hex == email_row[2]:
-            uid = email_row[0]
-            role = email_row[1]
-            return uid, role
-
-    # Login failed 
-    print("Invalid login credentials. Please try again.")
-    return None, None
+        user = services.login(conn, user_input, pwd)
+    except services.AuthError:
+        # Login failed 
+        print("Invalid login credentials. Please try again.")
+        return None, None
+    return user["uid"], user["role"]
 
 
 def signup(conn):
@@ -90,31 +47,15 @@ def signup(conn):
         break
     
     pwd = getpass("Password: ")
-    cur = conn.cursor()
-    # Ensure the provided email is not already in use 
-    email_param = (email,)
-    cur.execute("SELECT 1 FROM customers WHERE email = ?", email_param)
-    existing_email = cur.fetchone()
-    
-    if existing_email is not None:
+    # the email must not be in use yet (case-insensitive, like login); the
+    # new uid comes from the shared users sequence
+    try:
+        uid = services.signup(conn, name, email, pwd)
+    except services.DuplicateEmailError:
         print("Already exisiting email address")
         return None
-    # Generate a unique user ID 
-    uid = generate_new_uid(conn)
-    try:
-        # Insert into users first with role automatically set to 'customer'
-        # then insert into customers with the same id 
-        pwd_bytes = pwd.encode("utf-8")
-        pwd_hash = hashlib.sha256(pwd_bytes)
-        hashed_pwd = pwd_hash.hexdigest()
-        user_insert_params = (uid, hashed_pwd, "customer")
-        cur.execute("INSERT INTO users(uid, pwd, role) VALUES(?,?,?)", user_insert_params)
-        customer_insert_params = (uid, name, email)
-        cur.execute("INSERT INTO customers(cid, name, email) VALUES(?,?,?)", customer_insert_params)
-        conn.commit()
-        print(f"Registered. Your User ID is {uid}.")
-        return uid
-    except sqlite3.IntegrityError as e:
-        conn.rollback()
-        print("Registration failed:", e)
-        return None
\ No newline at end of file
+    except services.ServiceError as e:
+        print(e)
+        return None
+    print(f"Registered. Your User ID is {uid}.")
+    return uid
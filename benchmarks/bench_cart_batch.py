@@ -0,0 +1,111 @@
+# Filling a large cart: one add_to_cart per line against one
+# add_items_to_cart call (the reorder path) for carts of 10 and 200 lines.
+#
+#   python3 benchmarks/bench_cart_batch.py [profile] [rounds]
+#
+# profile is a db.PROFILES name (default oltp; "legacy" shows what the
+# per-line commits cost with a full fsync each). Modes:
+#   per line, commit - the add_to_cart from before carts.py: cache lookup,
+#                      SELECT of the cart line, UPDATE/INSERT, commit
+#   per line         - services.add_to_cart with every change written at
+#                      once (COMMERCE_CART_MAX_DELAY=0)
+#   batch            - services.add_items_to_cart: one stock read, one
+#                      transaction of upserts
+# Each round fills a fresh session's cart; the best round is printed.
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import carts
+import product_cache
+import services
+from bench_search import fill_catalog
+from checkout import InsufficientStockError
+from db import PROFILES, connect_db, init_db
+from sessions import end_customer_session, start_customer_session
+
+NUM_PRODUCTS = 20_000
+CART_SIZES = (10, 200)
+
+
+# services.add_to_cart before the in-memory carts
+def add_with_commit(conn, cid, session_no, pid, qty):
+    row = product_cache.get_product(conn, pid)
+    existing = conn.execute(
+        "SELECT qty FROM cart WHERE cid = ? AND sessionNo = ? AND pid = ?", (cid, session_no, pid)
+    ).fetchone()
+    new_qty = qty + (existing[0] if existing else 0)
+    if new_qty > row["stock_count"]:
+        raise InsufficientStockError(pid)
+    if existing:
+        conn.execute("UPDATE cart SET qty = ? WHERE cid = ? AND sessionNo = ? AND pid = ?", (new_qty, cid, session_no, pid))
+    else:
+        conn.execute("INSERT INTO cart(cid, sessionNo, pid, qty) VALUES(?,?,?,?)", (cid, session_no, pid, qty))
+    conn.commit()
+
+
+def fill_per_line_commit(conn, cid, session_no, lines):
+    for pid, qty in lines:
+        add_with_commit(conn, cid, session_no, pid, qty)
+
+
+def fill_per_line(conn, cid, session_no, lines):
+    for pid, qty in lines:
+        services.add_to_cart(conn, cid, session_no, pid, qty)
+
+
+def fill_batch(conn, cid, session_no, lines):
+    services.add_items_to_cart(conn, cid, session_no, [[pid, qty] for pid, qty in lines])
+
+
+MODES = {
+    "per line, commit": fill_per_line_commit,
+    "per line": fill_per_line,
+    "batch": fill_batch,
+}
+
+
+def main():
+    profile = sys.argv[1] if len(sys.argv) > 1 else "oltp"
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    if profile not in PROFILES:
+        raise SystemExit(f"unknown profile {profile!r}, expected one of {sorted(PROFILES)}")
+    carts.configure(max_delay=0)
+    rng = random.Random(11)
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = connect_db(os.path.join(tmp, "bench.db"), profile=profile)
+        init_db(conn)
+        conn.execute("DELETE FROM products")
+        conn.commit()
+        fill_catalog(conn, NUM_PRODUCTS)
+        conn.execute("UPDATE products SET stock_count = 1000000")
+        conn.execute("INSERT INTO users(uid, pwd, role) VALUES(2, '', 'customer')")
+        conn.execute("INSERT INTO customers(cid, name, email) VALUES(2, 'bench', 'bench@example.com')")
+        conn.commit()
+
+        best = {(mode, size): float("inf") for mode in MODES for size in CART_SIZES}
+        for _ in range(rounds):
+            for size in CART_SIZES:
+                lines = [(pid, rng.randint(1, 5)) for pid in rng.sample(range(1, NUM_PRODUCTS + 1), size)]
+                # modes take turns on the same lines, each in a new session
+                for mode, fill in MODES.items():
+                    session_no = start_customer_session(conn, 2)
+                    start = time.perf_counter()
+                    fill(conn, 2, session_no, lines)
+                    best[mode, size] = min(best[mode, size], time.perf_counter() - start)
+                    end_customer_session(conn, 2, session_no)
+        conn.close()
+
+    print(f"profile {profile}, best of {rounds} rounds, ms per cart\n")
+    print("{:<18}".format("mode") + "".join("{:>14}".format(f"{size} lines") for size in CART_SIZES))
+    print("-" * (18 + 14 * len(CART_SIZES)))
+    for mode in MODES:
+        print("{:<18}".format(mode) + "".join("{:>14.2f}".format(best[mode, size] * 1000) for size in CART_SIZES))
+
+
+if __name__ == "__main__":
+    main()
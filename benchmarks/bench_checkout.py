@@ -0,0 +1,93 @@
+# Multi-process checkout stress test.
+#
+#   python3 benchmarks/bench_checkout.py [workers] [orders_per_worker] [hot_stock]
+#
+# Starts `workers` processes (default 8) against one database file. Each
+# signs up a customer, opens a session and repeatedly adds a product to the
+# cart and checks out, and the run reports throughput in orders/second.
+# Afterwards it verifies that every checkout produced exactly one order with
+# a unique order number.
+#
+# With hot_stock, every worker buys the same SKU (pid 1), which only has
+# hot_stock units: exactly that many orders may succeed and the stock must
+# end at zero, never below.
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from auth import generate_new_uid
+from customer import add_to_cart, place_order
+from db import connect_db, init_db
+from sessions import end_customer_session, start_customer_session
+
+
+def worker(db_path, orders, hot, results):
+    conn = connect_db(db_path)
+    cid = generate_new_uid(conn)
+    conn.execute("INSERT INTO users(uid, pwd, role) VALUES(?, '', 'customer')", (cid,))
+    conn.execute("INSERT INTO customers(cid, name, email) VALUES(?,?,?)", (cid, f"bench {cid}", f"{cid}@example.com"))
+    conn.commit()
+    session_no = start_customer_session(conn, cid)
+    # the CLI functions print their outcome; keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(orders):
+            add_to_cart(conn, cid, session_no, 1 if hot else 1 + i % 6, 1)
+            place_order(conn, cid, session_no, f"{cid} bench street")
+    end_customer_session(conn, cid, session_no)
+    conn.close()
+    results.put(cid)
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    orders = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    hot_stock = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "checkout.db")
+        conn = connect_db(db_path)
+        init_db(conn)
+        conn.execute("UPDATE products SET stock_count = 1000000")
+        if hot_stock is not None:
+            conn.execute("UPDATE products SET stock_count = ? WHERE pid = 1", (hot_stock,))
+        conn.commit()
+
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=worker, args=(db_path, orders, hot_stock is not None, results)) for _ in range(workers)]
+        start = time.perf_counter()
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        elapsed = time.perf_counter() - start
+        cids = [results.get() for p in procs if p.exitcode == 0]
+
+        placed = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+        distinct = conn.execute("SELECT COUNT(DISTINCT ono) FROM orders").fetchone()[0]
+        lines = conn.execute("SELECT COUNT(*) FROM orderlines").fetchone()[0]
+        hot_left = conn.execute("SELECT stock_count FROM products WHERE pid = 1").fetchone()[0]
+        conn.close()
+
+    expected = workers * orders
+    if hot_stock is not None:
+        expected = min(expected, hot_stock)
+    print(f"workers         : {workers} ({len(cids)} finished, {len(set(cids))} distinct uids)")
+    print(f"expected orders : {expected}")
+    print(f"orders placed   : {placed} ({distinct} distinct order numbers, {lines} lines)")
+    print(f"elapsed         : {elapsed:.2f}s ({placed / elapsed:.0f} orders/s)")
+    oversold = False
+    if hot_stock is not None:
+        print(f"hot SKU stock   : {hot_stock} -> {hot_left}")
+        oversold = hot_left != hot_stock - placed or hot_left < 0
+    if len(set(cids)) != workers or placed != expected or distinct != placed or oversold:
+        print("FAIL")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# Bulk-inserts activity events through the activity log writer and checks
+# that none are lost to key conflicts.
+#
+#   python3 benchmarks/bench_events.py [num_events] [batch_size]
+#
+# Every event in a batch carries the same one-second timestamp, which used
+# to be a primary-key collision. Exits non-zero if any event is missing or
+# the insert rate is below 100k events/second.
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from activity import write_events
+from db import connect_db, init_db
+
+TARGET_RATE = 100_000
+
+
+def main():
+    num_events = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = connect_db(os.path.join(tmp, "events.db"))
+        init_db(conn)
+        conn.execute("INSERT INTO users(uid, pwd, role) VALUES(2, '', 'customer')")
+        conn.execute("INSERT INTO customers(cid, name, email) VALUES(2, 'bench', 'bench@example.com')")
+        conn.execute("INSERT INTO sessions(cid, sessionNo, start_time) VALUES(2, 1, '2024-01-01')")
+        conn.commit()
+
+        start = time.perf_counter()
+        written = 0
+        while written < num_events:
+            n = min(batch_size, num_events - written)
+            ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            events = []
+            for i in range(n):
+                if i % 4:
+                    events.append(("viewedProduct", (2, 1, ts, 1 + i % 6)))
+                else:
+                    events.append(("search", (2, 1, ts, "widget")))
+            write_events(conn, events)
+            written += n
+        elapsed = time.perf_counter() - start
+
+        stored = conn.execute("SELECT COUNT(*) FROM viewedProduct").fetchone()[0]
+        stored += conn.execute("SELECT COUNT(*) FROM search").fetchone()[0]
+        conn.close()
+
+    rate = num_events / elapsed
+    print(f"events written : {num_events}")
+    print(f"events stored  : {stored}")
+    print(f"elapsed        : {elapsed:.2f}s")
+    print(f"rate           : {rate:,.0f} events/s")
+    if stored != num_events:
+        print(f"FAIL: {num_events - stored} events lost")
+        sys.exit(1)
+    if rate < TARGET_RATE:
+        print(f"FAIL: below {TARGET_RATE:,} events/s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
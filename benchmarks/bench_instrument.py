@@ -0,0 +1,96 @@
+# Measures what the statement instrumentation (instrument.py) costs on the
+# hot read paths: point lookups by pid and keyword searches.
+#
+#   python3 benchmarks/bench_instrument.py [num_products] [rounds]
+#
+# The same workloads run in three modes on one database:
+#   plain - no instrumentation calls at all
+#   off   - every operation wrapped in instrument.operation(), instrumentation disabled
+#   on    - instrumentation enabled (instrumented connection, histograms)
+# and the best time per operation of each is printed.
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import instrument
+from bench_search import QUERIES, fill_catalog
+from db import connect_db, init_db
+from search_index import keyword_filter
+
+LOOKUP_SQL = "SELECT pid, name, category, price, stock_count, descr FROM products WHERE pid = ?"
+
+
+def search_workload(conn, rounds, tagged):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for keywords in QUERIES:
+            if tagged:
+                with instrument.operation("search"):
+                    where_sql, params = keyword_filter(conn, keywords)
+                    conn.execute(f"SELECT pid, name FROM products WHERE {where_sql} ORDER BY pid LIMIT 5", params).fetchall()
+            else:
+                where_sql, params = keyword_filter(conn, keywords)
+                conn.execute(f"SELECT pid, name FROM products WHERE {where_sql} ORDER BY pid LIMIT 5", params).fetchall()
+    return (time.perf_counter() - start) / (rounds * len(QUERIES))
+
+
+def lookup_workload(conn, num_products, count, tagged):
+    rng = random.Random(3)
+    pids = [rng.randint(1, num_products) for _ in range(count)]
+    start = time.perf_counter()
+    for pid in pids:
+        if tagged:
+            with instrument.operation("view"):
+                conn.execute(LOOKUP_SQL, (pid,)).fetchone()
+        else:
+            conn.execute(LOOKUP_SQL, (pid,)).fetchone()
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    num_products = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    modes = ("plain", "off", "on")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        conn = connect_db(path)
+        init_db(conn)
+        conn.execute("DELETE FROM products")
+        conn.commit()
+        fill_catalog(conn, num_products)
+        conn.close()
+
+        # modes take turns and the best round counts, so they see the same
+        # (warm) page cache and as little scheduling noise as possible
+        results = {mode: [float("inf"), float("inf")] for mode in modes}
+        for _ in range(rounds):
+            for mode in modes:
+                if mode == "on":
+                    instrument.enable()
+                conn = connect_db(path)
+                best = results[mode]
+                search_workload(conn, 1, mode != "plain")  # prepares the statements
+                best[0] = min(best[0], lookup_workload(conn, num_products, 2000, mode != "plain"))
+                best[1] = min(best[1], search_workload(conn, 5, mode != "plain"))
+                conn.close()
+                instrument.disable()
+
+    print(f"{num_products} products, best of {rounds} rounds\n")
+    print("{:<8} {:>14} {:>10} {:>14} {:>10}".format("mode", "lookup (us)", "overhead", "search (us)", "overhead"))
+    print("-" * 60)
+    for mode, (lookup, search) in results.items():
+        print("{:<8} {:>14.2f} {:>9.1%} {:>14.1f} {:>9.1%}".format(
+            mode, lookup * 1e6, lookup / results["plain"][0] - 1, search * 1e6, search / results["plain"][1] - 1,
+        ))
+    statements = instrument.snapshot()["statements"]
+    print(f"\n{len(statements)} statements recorded while on, e.g.:")
+    for stat in statements[:3]:
+        print(f"  {stat['operation']:<8} {stat['count']:>7}x  p50 <= {stat['p50_ms']:.3f} ms  {stat['statement'][:60]}")
+
+
+if __name__ == "__main__":
+    main()
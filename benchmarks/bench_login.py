@@ -0,0 +1,161 @@
+# Login latency with many customers: the old account lookup (uid, then on
+# a miss a JOIN on lower(email) = lower(?)) against the single statement on
+# the stored email_norm column (services.find_account).
+#
+#   python3 benchmarks/bench_login.py [db_path] [customers] [lookups]
+#
+# db_path (default: a temporary file) is filled with `customers` accounts
+# (default 10,000,000) if it has none yet, and kept for later runs. It has
+# both the old expression index on lower(email) and the email_norm index,
+# so both lookups run on the same file. Identifiers are drawn from:
+#   uid         - a customer id
+#   email       - the address as stored
+#   mixed case  - the address with the domain uppercased
+#   unknown     - an address nobody has
+#   unknown uid - a number that is no uid (two statements before)
+# and the average lookup time of each is printed, plus the old email lookup
+# with no usable index (the schema before migration 5), followed by a full
+# login (lookup plus one password hash) per path.
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import passwords
+import services
+from db import connect_db
+from migrations import migrate
+
+FIRST_CID = 10001
+BATCH = 100_000
+ROUNDS = 5
+OLD_EMAIL_INDEX = "create index if not exists idx_customers_email on customers(lower(email))"
+
+UNINDEXED_SQL = """
+    SELECT u.uid, u.role, u.pwd FROM users u JOIN customers c NOT INDEXED ON u.uid = c.cid
+    WHERE lower(c.email) = lower(?)
+    """
+
+
+# The lookup before email_norm: an all-digit miss runs a second statement
+def old_find_account(conn, user):
+    user = str(user).strip()
+    if user.isdigit():
+        row = conn.execute("SELECT uid, role, pwd FROM users WHERE uid = ?", (int(user),)).fetchone()
+        if row is not None:
+            return {"uid": row["uid"], "role": row["role"], "pwd": row["pwd"]}
+    row = conn.execute(
+        """
+        SELECT u.uid, u.role, u.pwd
+        FROM users u
+        JOIN customers c ON u.uid = c.cid
+        WHERE lower(c.email) = lower(?)
+        """,
+        (user,),
+    ).fetchone()
+    if row is None:
+        return None
+    return {"uid": row["uid"], "role": row["role"], "pwd": row["pwd"]}
+
+
+def fill(conn, customers):
+    encoded = passwords.hash_password("password")
+    start = time.perf_counter()
+    for low in range(FIRST_CID, FIRST_CID + customers, BATCH):
+        cids = range(low, min(low + BATCH, FIRST_CID + customers))
+        conn.executemany("INSERT INTO users(uid, pwd, role) VALUES(?, ?, 'customer')", ((cid, encoded) for cid in cids))
+        conn.executemany(
+            "INSERT INTO customers(cid, name, email, email_norm) VALUES(?,?,?,?)",
+            ((cid, f"Customer {cid}", f"customer{cid}@example.com", f"customer{cid}@example.com") for cid in cids),
+        )
+        conn.commit()
+    conn.execute(OLD_EMAIL_INDEX)
+    conn.execute("ANALYZE")
+    conn.commit()
+    print(f"{customers:,} customers loaded in {time.perf_counter() - start:.0f}s")
+
+
+def identifiers(customers, count):
+    rng = random.Random(5)
+    cids = [rng.randrange(FIRST_CID, FIRST_CID + customers) for _ in range(count)]
+    return {
+        "uid": [str(cid) for cid in cids],
+        "email": [f"customer{cid}@example.com" for cid in cids],
+        "mixed case": [f"customer{cid}@EXAMPLE.com" for cid in cids],
+        "unknown": [f"nobody{cid}@example.com" for cid in cids],
+        "unknown uid": [str(cid + customers) for cid in cids],
+    }
+
+
+def time_lookups(conn, find, users):
+    find(conn, users[0])
+    start = time.perf_counter()
+    for user in users:
+        find(conn, user)
+    return (time.perf_counter() - start) / len(users)
+
+
+def time_login(conn, find, users):
+    start = time.perf_counter()
+    for user in users:
+        passwords.clear_cache()
+        account = find(conn, user)
+        passwords.verify_password("password", account and account["pwd"])
+    return (time.perf_counter() - start) / len(users)
+
+
+def main():
+    tmp = None
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+    else:
+        tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(tmp.name, "login.db")
+    customers = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000_000
+    count = int(sys.argv[3]) if len(sys.argv) > 3 else 20_000
+
+    conn = connect_db(path, profile="bulk-load")
+    migrate(conn)
+    existing = conn.execute("SELECT COUNT(*) FROM customers").fetchone()[0]
+    if existing == 0:
+        fill(conn, customers)
+    else:
+        customers = existing
+        conn.execute(OLD_EMAIL_INDEX)
+    conn.close()
+
+    conn = connect_db(path)
+    users = identifiers(customers, count)
+    paths = {"before": old_find_account, "after": services.find_account}
+    print(f"\n{customers:,} customers, {count:,} lookups each, best of {ROUNDS} rounds\n")
+    print("{:<12} {:>14} {:>14} {:>9}".format("identifier", "before (us)", "after (us)", "speedup"))
+    print("-" * 52)
+    for kind, sample in users.items():
+        # the paths take turns, so both see the same page cache and noise
+        best = {name: float("inf") for name in paths}
+        for _ in range(ROUNDS):
+            for name, find in paths.items():
+                best[name] = min(best[name], time_lookups(conn, find, sample))
+        print("{:<12} {:>14.2f} {:>14.2f} {:>8.2f}x".format(
+            kind, best["before"] * 1e6, best["after"] * 1e6, best["before"] / best["after"]))
+
+    # the original schema had no index usable by lower(c.email) = lower(?)
+    start = time.perf_counter()
+    for user in users["unknown"][:3]:
+        conn.execute(UNINDEXED_SQL, (user,)).fetchone()
+    print("{:<12} {:>14.0f}   (no index on lower(email), as before migration 5)".format(
+        "unindexed", (time.perf_counter() - start) / 3 * 1e6))
+
+    print(f"\nfull login by email (lookup + {passwords.get_hasher().algorithm} verify):")
+    for name, find in paths.items():
+        print(f"  {name:<7} {time_login(conn, find, users['mixed case'][:20]) * 1000:.1f} ms")
+    conn.close()
+    if tmp is not None:
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
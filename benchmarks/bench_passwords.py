@@ -0,0 +1,72 @@
+# Measures password hashing (passwords.py) for every algorithm and cost:
+# the time per hash, logins per second on one thread, and logins per second
+# through the hashing pool used by the server. Also times a login answered
+# from the verification cache and one that verifies an old SHA-256 hash.
+#
+#   python3 benchmarks/bench_passwords.py [hashes] [workers]
+#
+# workers defaults to COMMERCE_HASH_WORKERS / the CPU count; the pool can
+# only beat one thread when there are CPUs to spare.
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import passwords
+
+
+def per_hash(stored, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        passwords._check("correct horse", stored)
+    return (time.perf_counter() - start) / count
+
+
+def pool_throughput(stored, count, workers):
+    with ThreadPoolExecutor(workers) as pool:
+        start = time.perf_counter()
+        list(pool.map(lambda _: passwords._check("correct horse", stored), range(count)))
+        return count / (time.perf_counter() - start)
+
+
+def cached_verify(stored, count):
+    passwords.clear_cache()
+    passwords.verify_password("correct horse", stored)
+    start = time.perf_counter()
+    for _ in range(count):
+        passwords.verify_password("correct horse", stored)
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else passwords.HASH_WORKERS
+
+    print(f"{count} hashes per setting, pool of {workers} threads, {os.cpu_count()} CPUs\n")
+    print("{:<15} {:<8} {:>10} {:>14} {:>14} {:>14}".format(
+        "algorithm", "cost", "ms/hash", "logins/s (1)", f"logins/s ({workers})", "cached (us)"))
+    print("-" * 80)
+    for algorithm, costs in passwords.COSTS.items():
+        for cost in costs:
+            passwords.configure(algorithm, cost)
+            stored = passwords.hash_password("correct horse")
+            seconds = per_hash(stored, count)
+            print("{:<15} {:<8} {:>10.1f} {:>14.1f} {:>14.1f} {:>14.2f}".format(
+                algorithm, cost, seconds * 1000, 1 / seconds, pool_throughput(stored, count * workers, workers),
+                cached_verify(stored, 10_000) * 1e6,
+            ))
+
+    passwords.configure()
+    legacy = hashlib.sha256(b"correct horse").hexdigest()
+    start = time.perf_counter()
+    passwords.verify_password("correct horse", legacy)
+    rehashed = passwords.hash_password("correct horse") if passwords.needs_rehash(legacy) else legacy
+    print(f"\nold SHA-256 login incl. rehash to {rehashed.split('$')[0]}: "
+          f"{(time.perf_counter() - start) * 1000:.1f} ms (once per account)")
+
+
+if __name__ == "__main__":
+    main()
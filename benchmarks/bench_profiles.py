@@ -0,0 +1,88 @@
+# Runs the search, checkout and report workloads under every connection
+# profile in db.PROFILES and prints the time each one takes.
+#
+#   python3 benchmarks/bench_profiles.py [num_products] [num_orders]
+#
+# Each profile gets its own fresh database file so earlier runs don't warm
+# the page cache for later ones.
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bench_search import QUERIES, fill_catalog
+from checkout import checkout
+from db import PROFILES, connect_db, init_db
+from sales import top_products, weekly_sales_report
+from search_index import keyword_filter
+from sessions import start_customer_session
+
+
+def load(conn, num_products):
+    conn.execute("DELETE FROM products")
+    conn.commit()
+    fill_catalog(conn, num_products)
+    conn.execute("INSERT INTO users(uid, pwd, role) VALUES(2, '', 'customer')")
+    conn.execute("INSERT INTO customers(cid, name, email) VALUES(2, 'bench', 'bench@example.com')")
+    conn.execute("UPDATE products SET stock_count = 1000000 WHERE pid <= 100")
+    conn.commit()
+
+
+def search_workload(conn, rounds=5):
+    for _ in range(rounds):
+        for keywords in QUERIES:
+            where_sql, params = keyword_filter(conn, keywords)
+            conn.execute(f"SELECT pid, name, category, price, stock_count FROM products WHERE {where_sql} ORDER BY pid LIMIT 5", params).fetchall()
+
+
+def checkout_workload(conn, num_orders):
+    session_no = start_customer_session(conn, 2)
+    for i in range(num_orders):
+        conn.executemany(
+            "INSERT INTO cart(cid, sessionNo, pid, qty) VALUES(2, ?, ?, 1)",
+            [(session_no, 1 + (i + k) % 100) for k in range(3)],
+        )
+        conn.commit()
+        checkout(conn, 2, session_no, "1 bench street")
+
+
+def report_workload(conn, rounds=20):
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(rounds):
+            weekly_sales_report(conn)
+            top_products(conn)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    num_products = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    num_orders = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    print("{:<10} {:>10} {:>10} {:>12} {:>12} {:>10}".format(
+        "profile", "load (s)", "search (s)", "checkout (s)", "orders/s", "report (s)"
+    ))
+    print("-" * 70)
+    for profile in PROFILES:
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = connect_db(os.path.join(tmp, "profile.db"), profile=profile)
+            init_db(conn)
+            load_time = timed(load, conn, num_products)
+            search_time = timed(search_workload, conn)
+            checkout_time = timed(checkout_workload, conn, num_orders)
+            report_time = timed(report_workload, conn)
+            conn.close()
+        print("{:<10} {:>10.2f} {:>10.2f} {:>12.2f} {:>12.0f} {:>10.2f}".format(
+            profile, load_time, search_time, checkout_time, num_orders / checkout_time, report_time
+        ))
+
+
+if __name__ == "__main__":
+    main()
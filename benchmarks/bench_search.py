@@ -0,0 +1,95 @@
+# Compares product search through the products_fts index against the old
+# lower(name) LIKE '%kw%' scan.
+#
+#   python3 benchmarks/bench_search.py [num_products] [db_path]
+#
+# Builds (or reuses) a catalog of num_products rows (default 1,000,000) and
+# times the same keyword sets through both paths, checking they agree.
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from db import connect_db, init_db
+from search_index import keyword_filter, rebuild_search_index
+
+WORDS = [
+    "widget", "gizmo", "gadget", "thing", "cable", "charger", "lamp", "desk",
+    "chair", "mouse", "keyboard", "monitor", "stand", "bottle", "mug", "pen",
+    "notebook", "backpack", "speaker", "headphones", "battery", "adapter",
+    "router", "camera", "tripod", "blender", "kettle", "toaster", "pillow",
+    "blanket", "towel", "hammer", "wrench", "drill", "saw", "glue", "tape",
+]
+ADJECTIVES = [
+    "basic", "improved", "handy", "heavy-duty", "small", "large", "compact",
+    "wireless", "portable", "premium", "classic", "eco", "smart", "mini",
+]
+CATEGORIES = ["gadgets", "tools", "misc", "home", "office", "outdoor", "kitchen"]
+
+QUERIES = [
+    ["widget"],
+    ["wireless", "speaker"],
+    ["heavy-duty", "drill"],
+    ["eco", "kettle", "mini"],
+    ["notebook"],
+    ["zzz-no-match"],
+    ["mug", "ab"],
+]
+
+
+def fill_catalog(conn, num_products, seed=42):
+    rng = random.Random(seed)
+    batch = []
+    for pid in range(1, num_products + 1):
+        adj = rng.choice(ADJECTIVES)
+        noun = rng.choice(WORDS)
+        name = f"{adj} {noun} {pid}"
+        descr = f"{adj} {noun} with {rng.choice(WORDS)} and {rng.choice(WORDS)}"
+        batch.append((pid, name, rng.choice(CATEGORIES), round(rng.uniform(1, 500), 2), rng.randint(0, 200), descr))
+        if len(batch) == 50000:
+            conn.executemany("INSERT INTO products(pid, name, category, price, stock_count, descr) VALUES(?,?,?,?,?,?)", batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT INTO products(pid, name, category, price, stock_count, descr) VALUES(?,?,?,?,?,?)", batch)
+    conn.commit()
+
+
+def run_query(conn, keywords, use_index):
+    where_sql, params = keyword_filter(conn, keywords, use_index=use_index)
+    start = time.perf_counter()
+    rows = conn.execute(f"SELECT pid FROM products WHERE {where_sql} ORDER BY pid", params).fetchall()
+    return time.perf_counter() - start, [r[0] for r in rows]
+
+
+def main():
+    num_products = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    db_path = sys.argv[2] if len(sys.argv) > 2 else f"bench_search_{num_products}.db"
+    conn = connect_db(db_path)
+    have = conn.execute("SELECT count(*) FROM sqlite_master WHERE name = 'products'").fetchone()[0]
+    if not have or conn.execute("SELECT count(*) FROM products").fetchone()[0] != num_products:
+        init_db(conn)
+        conn.execute("DELETE FROM products")
+        conn.commit()
+        t0 = time.perf_counter()
+        fill_catalog(conn, num_products)
+        print(f"loaded {num_products} products in {time.perf_counter() - t0:.1f}s")
+        rebuild_search_index(conn)
+
+    print("\n{:<28} {:>8} {:>12} {:>12} {:>8}".format("keywords", "rows", "LIKE (ms)", "FTS (ms)", "speedup"))
+    print("-" * 72)
+    for keywords in QUERIES:
+        like_time, like_pids = run_query(conn, keywords, use_index=False)
+        fts_time, fts_pids = run_query(conn, keywords, use_index=True)
+        if like_pids != fts_pids:
+            print(f"MISMATCH for {keywords}: LIKE {len(like_pids)} rows, FTS {len(fts_pids)} rows")
+        speedup = like_time / fts_time if fts_time else float("inf")
+        print("{:<28} {:>8} {:>12.1f} {:>12.1f} {:>7.1f}x".format(
+            " ".join(keywords)[:28], len(fts_pids), like_time * 1000, fts_time * 1000, speedup
+        ))
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
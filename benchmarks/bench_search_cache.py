@@ -0,0 +1,108 @@
+# Replays recorded searches through the search result cache (search_cache.py)
+# and without it, and reports the hit rate and the latency of both paths.
+#
+#   python3 benchmarks/bench_search_cache.py [db_path] [num_searches]
+#
+# With a db_path, the queries recorded in its `search` table are replayed in
+# timestamp order. Without one (or if it has no recorded searches), a
+# catalog of 100,000 products and a skewed search log of num_searches
+# (default 20,000) queries over a few hundred keyword combinations is
+# generated first. Each replayed query is answered by the uncached pid query
+# and by the cache, and the results are checked to agree.
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import search_cache
+from bench_search import ADJECTIVES, WORDS, fill_catalog
+from db import connect_db, init_db
+from search_index import keyword_filter, rebuild_search_index
+
+NUM_PRODUCTS = 100_000
+NUM_COMBINATIONS = 300
+
+
+# Writes a search log where a few keyword sets dominate (Zipf-like weights)
+def fill_search_log(conn, num_searches, seed=11):
+    rng = random.Random(seed)
+    combos = []
+    while len(combos) < NUM_COMBINATIONS:
+        words = [rng.choice(WORDS)]
+        if rng.random() < 0.6:
+            words.insert(0, rng.choice(ADJECTIVES))
+        if rng.random() < 0.2:
+            words.append(rng.choice(WORDS))
+        # recorded queries keep the user's casing and word order
+        if rng.random() < 0.3:
+            words = [w.capitalize() for w in reversed(words)]
+        combos.append(" ".join(words))
+    weights = [1 / rank for rank in range(1, len(combos) + 1)]
+    conn.execute("PRAGMA foreign_keys = OFF")
+    conn.executemany(
+        "INSERT INTO search(cid, sessionNo, ts, query) VALUES(2, 1, ?, ?)",
+        [(f"2024-01-01 00:00:{i % 60:02d}", query) for i, query in enumerate(rng.choices(combos, weights, k=num_searches))],
+    )
+    conn.commit()
+
+
+def uncached_pids(conn, keywords, max_pids):
+    where_sql, params = keyword_filter(conn, keywords)
+    rows = conn.execute(
+        f"SELECT pid FROM products WHERE {where_sql} ORDER BY pid LIMIT ?", params + [max_pids + 1]
+    ).fetchall()
+    return None if len(rows) > max_pids else [r[0] for r in rows]
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def main():
+    db_path = sys.argv[1] if len(sys.argv) > 1 else "bench_search_cache.db"
+    num_searches = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    conn = connect_db(db_path)
+    init_db(conn)
+    if conn.execute("SELECT COUNT(*) FROM search").fetchone()[0] == 0:
+        conn.execute("DELETE FROM products")
+        conn.commit()
+        fill_catalog(conn, NUM_PRODUCTS)
+        rebuild_search_index(conn)
+        fill_search_log(conn, num_searches)
+        print(f"generated {NUM_PRODUCTS} products and {num_searches} searches")
+    queries = [r[0].lower().split() for r in conn.execute("SELECT query FROM search ORDER BY ts, eid")]
+    queries = [q for q in queries if q]
+
+    cache = search_cache.configure()
+    plain_times = []
+    cached_times = []
+    for keywords in queries:
+        t0 = time.perf_counter()
+        expected = uncached_pids(conn, keywords, cache.max_pids)
+        t1 = time.perf_counter()
+        got = cache.search_pids(conn, keywords)
+        t2 = time.perf_counter()
+        if got != expected:
+            print(f"MISMATCH for {keywords}")
+            sys.exit(1)
+        plain_times.append(t1 - t0)
+        cached_times.append(t2 - t1)
+
+    stats = cache.stats()
+    print(f"\nreplayed {len(queries)} searches, {len({search_cache.normalize(q) for q in queries})} distinct keyword sets")
+    print(f"hit rate {stats['hit_rate']:.1%} ({stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions)")
+    print("\n{:<10} {:>10} {:>10} {:>10} {:>10}".format("path", "total (s)", "mean (ms)", "p50 (ms)", "p99 (ms)"))
+    print("-" * 54)
+    for name, times in (("uncached", plain_times), ("cached", cached_times)):
+        print("{:<10} {:>10.2f} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+            name, sum(times), sum(times) / len(times) * 1000, percentile(times, 0.5) * 1000, percentile(times, 0.99) * 1000
+        ))
+    print(f"\nspeedup {sum(plain_times) / sum(cached_times):.1f}x")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+# End-to-end benchmark of the store operations on a generated data set,
+# with machine-readable results for tracking regressions between versions.
+#
+#   python3 benchmarks/bench_suite.py db_path [--scale small] [--iterations 1.0]
+#                                     [--out bench_results.jsonl] [--label NAME]
+#
+# If db_path doesn't exist it is generated first with datagen.py (--scale,
+# --seed). Then each operation runs on its own, one request at a time, with
+# requests drawn from the data set's distributions (Zipfian products,
+# customers and search keywords):
+#   login, customer_search, product_view, add_to_cart, place_order,
+#   customer_orders, weekly_sales_report, top_products
+# and its throughput, p50/p99/max latency, errors and the peak RSS of the
+# process so far are printed. The run is appended as one JSON line to --out,
+# and compared with the previous run on the same data set in that file.
+# --iterations scales the number of requests per operation.
+#
+# The benchmark writes to the database (sessions, carts, orders, events),
+# so later runs see a slightly bigger data set; regenerate it for exact
+# comparisons.
+import argparse
+import json
+import os
+import platform
+import resource
+import sqlite3
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import activity
+import datagen
+import passwords
+import services
+from checkout import CheckoutError
+from db import connect_db
+from migrations import migrate
+
+# operation -> requests per run at --iterations 1
+REQUESTS = {
+    "login": 300,
+    "customer_search": 2000,
+    "product_view": 3000,
+    "add_to_cart": 1000,
+    "place_order": 500,
+    "customer_orders": 1000,
+    "weekly_sales_report": 50,
+    "top_products": 100,
+}
+WARMUP = 10
+
+
+class Workload:
+    def __init__(self, conn, seed):
+        self.conn = conn
+        self.rng = datagen.stream(seed, "benchmark")
+        first, last = conn.execute("SELECT MIN(cid), MAX(cid) FROM customers").fetchone()
+        num_products = conn.execute("SELECT MAX(pid) FROM products").fetchone()[0]
+        if first != datagen.FIRST_CID or not num_products:
+            raise SystemExit("the database was not made by datagen.py")
+        self.products = datagen.popularity("products", num_products, seed)
+        self.customers = datagen.popularity("customers", last - first + 1, seed)
+        self.queries, self.query_zipf = datagen.search_queries(seed)
+        # customer -> the session this benchmark opened for them
+        self.sessions = {}
+
+    def customer(self):
+        cid = self.customers.sample(self.rng)[0]
+        if cid not in self.sessions:
+            self.sessions[cid] = services.start_session(self.conn, cid)
+        return cid, self.sessions[cid]
+
+    # datagen gives every customer the same password hash, so the login
+    # cache (passwords.py) is emptied first to time a full verification
+    def prepare_login(self):
+        passwords.clear_cache()
+        return self.customers.sample(self.rng)
+
+    def login(self, cid):
+        services.login(self.conn, f"customer{cid}@example.com", datagen.CUSTOMER_PASSWORD)
+
+    def customer_search(self):
+        cid, session_no = self.customer()
+        services.search(self.conn, cid, session_no, self.queries[self.query_zipf.sample(self.rng)[0]])
+
+    def product_view(self):
+        cid, session_no = self.customer()
+        services.get_product(self.conn, cid, session_no, self.products.sample(self.rng)[0])
+
+    def add_to_cart(self):
+        cid, session_no = self.customer()
+        services.add_to_cart(self.conn, cid, session_no, self.products.sample(self.rng)[0], 1)
+
+    # a cart of 1-3 popular products is filled (not timed), then checked out
+    def prepare_place_order(self):
+        cid, session_no = self.customer()
+        for pid in self.products.sample(self.rng, self.rng.randint(1, 3)):
+            try:
+                services.add_to_cart(self.conn, cid, session_no, pid, 1)
+            except (services.ServiceError, CheckoutError):
+                pass
+        return cid, session_no
+
+    def place_order(self, cid, session_no):
+        services.checkout(self.conn, cid, session_no, "1 Benchmark Rd")
+
+    def customer_orders(self):
+        services.list_orders(self.conn, self.customers.sample(self.rng)[0])
+
+    def weekly_sales_report(self):
+        services.sales_report(self.conn)
+
+    def top_products(self):
+        services.top_products(self.conn, "orders")
+        services.top_products(self.conn, "views")
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))] if samples else 0.0
+
+
+def peak_rss_kb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_operation(workload, name, count):
+    run = getattr(workload, name)
+    prepare = getattr(workload, f"prepare_{name}", None)
+    samples = []
+    errors = {}
+    for i in range(WARMUP + count):
+        args = prepare() if prepare else ()
+        start = time.perf_counter()
+        try:
+            run(*args)
+        except (services.ServiceError, CheckoutError, sqlite3.Error) as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            if workload.conn.in_transaction:
+                workload.conn.rollback()
+        if i >= WARMUP:
+            samples.append(time.perf_counter() - start)
+    total = sum(samples)
+    return {
+        "requests": count,
+        "seconds": total,
+        "throughput": count / total if total else 0.0,
+        "p50_ms": percentile(samples, 0.5) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+        "max_ms": max(samples) * 1000 if samples else 0.0,
+        "errors": errors,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+
+def dataset(conn):
+    counts = {}
+    for table in ("products", "customers", "orders"):
+        counts[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    for table in ("viewedProduct", "search"):
+        counts[table] = conn.execute(f"SELECT COALESCE(MAX(eid), 0) FROM {table}").fetchone()[0]
+    return counts
+
+
+def version():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# The last earlier result in `path` for the same data set sizes, if any
+def previous_result(path, data):
+    if not os.path.exists(path):
+        return None
+    previous = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if {k: result.get("dataset", {}).get(k) for k in ("products", "customers")} == \
+                    {k: data[k] for k in ("products", "customers")}:
+                previous = result
+    return previous
+
+
+def report(result, previous):
+    print(f"\n{result['label']} on {result['dataset']['products']:,} products, "
+          f"{result['dataset']['customers']:,} customers, {result['dataset']['viewedProduct']:,} views"
+          + (f" (vs {previous['label']})" if previous else ""))
+    print("\n{:<20} {:>9} {:>9} {:>9} {:>9} {:>11}  {}".format(
+        "operation", "req/s", "p50 (ms)", "p99 (ms)", "max (ms)", "RSS (MiB)", "change p50" if previous else ""))
+    print("-" * 84)
+    for name, op in result["operations"].items():
+        change = ""
+        if previous and name in previous["operations"] and previous["operations"][name]["p50_ms"]:
+            change = f"{op['p50_ms'] / previous['operations'][name]['p50_ms'] - 1:+.0%}"
+        errors = ", ".join(f"{k} {v}" for k, v in op["errors"].items())
+        print("{:<20} {:>9,.0f} {:>9.3f} {:>9.3f} {:>9.2f} {:>11.1f}  {}{}".format(
+            name, op["throughput"], op["p50_ms"], op["p99_ms"], op["max_ms"], op["peak_rss_kb"] / 1024,
+            change, f"  errors: {errors}" if errors else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end store benchmark")
+    parser.add_argument("db_path", help="data set made by datagen.py (generated if missing)")
+    parser.add_argument("--scale", choices=sorted(datagen.SCALES), default="small", help="size when generating")
+    parser.add_argument("--seed", type=int, default=1, help="data set seed (must match the generated one)")
+    parser.add_argument("--iterations", type=float, default=1.0, help="scales the requests per operation")
+    parser.add_argument("--only", nargs="*", choices=list(REQUESTS), help="run only these operations")
+    parser.add_argument("--out", default="bench_results.jsonl", help="results file (one JSON line per run)")
+    parser.add_argument("--label", default=None, help="name of this run (default: git describe)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db_path):
+        conn = connect_db(args.db_path, profile="bulk-load")
+        migrate(conn)
+        print(f"generating {args.scale} data set into {args.db_path}")
+        datagen.generate(conn, datagen.SCALES[args.scale], args.seed, report=datagen.print_step)
+        conn.close()
+
+    conn = connect_db(args.db_path)
+    migrate(conn)
+    workload = Workload(conn, args.seed)
+    data = dataset(conn)
+    operations = {}
+    for name, count in REQUESTS.items():
+        if args.only and name not in args.only:
+            continue
+        operations[name] = run_operation(workload, name, max(1, int(count * args.iterations)))
+        print(f"{name}: {operations[name]['throughput']:,.0f} req/s", flush=True)
+    for cid, session_no in workload.sessions.items():
+        services.end_session(conn, cid, session_no)
+    activity.close(conn)
+    conn.close()
+
+    result = {
+        "label": args.label or version(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "dataset": dict(data, seed=args.seed),
+        "operations": operations,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+    previous = previous_result(args.out, data)
+    with open(args.out, "a", encoding="utf-8") as f:
+        f.write(json.dumps(result) + "\n")
+    report(result, previous)
+    print(f"\nresults appended to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# Load generator for server.py: many concurrent customer sessions over TCP,
+# with p50/p99 latency per operation.
+#
+#   python3 benchmarks/loadgen.py [--sessions 500] [--ops 40] [--host H --port P]
+#
+# Without --port it builds a database with a generated catalog (--products,
+# default 10,000; reused if it already exists), starts `server.py` on a
+# free port as a child process and stops it at the end. Every session signs
+# up a fresh customer, starts a session and then runs --ops operations from
+# a mix of searches (skewed keywords), product views, cart changes, order
+# history reads and checkouts, one at a time like an interactive user.
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bench_search import ADJECTIVES, WORDS, fill_catalog
+
+# operation -> weight in the per-session mix
+MIX = {
+    "search": 40,
+    "get_product": 30,
+    "add_to_cart": 15,
+    "get_cart": 8,
+    "list_orders": 4,
+    "checkout": 3,
+}
+
+
+class Client:
+    def __init__(self, reader, writer, stats):
+        self.reader = reader
+        self.writer = writer
+        self.stats = stats
+
+    async def call(self, op, **args):
+        command = dict(args, op=op)
+        start = time.perf_counter()
+        self.writer.write((json.dumps(command) + "\n").encode("utf-8"))
+        await self.writer.drain()
+        line = await self.reader.readline()
+        elapsed = time.perf_counter() - start
+        if not line:
+            raise ConnectionError("server closed the connection")
+        response = json.loads(line)
+        samples, errors = self.stats.setdefault(op, ([], {}))
+        samples.append(elapsed)
+        if not response.get("ok"):
+            errors[response.get("error")] = errors.get(response.get("error"), 0) + 1
+        return response
+
+
+async def run_session(host, port, index, run_id, ops, num_products, stats, rng):
+    reader, writer = await asyncio.open_connection(host, port, limit=1 << 20)
+    client = Client(reader, writer, stats)
+    try:
+        signup = await client.call(
+            "signup", name=f"load {index}", email=f"load{run_id}_{index}@example.com", password="pw"
+        )
+        if not signup.get("ok"):
+            return
+        cid = signup["result"]
+        session_no = (await client.call("start_session", cid=cid))["result"]
+        ops_names = list(MIX)
+        weights = list(MIX.values())
+        seen = []
+        for _ in range(ops):
+            op = rng.choices(ops_names, weights)[0]
+            if op == "search":
+                # a few keyword sets dominate, like the recorded search traffic
+                words = [WORDS[min(int(rng.paretovariate(1.1)) - 1, len(WORDS) - 1)]]
+                if rng.random() < 0.4:
+                    words.insert(0, ADJECTIVES[min(int(rng.paretovariate(1.1)) - 1, len(ADJECTIVES) - 1)])
+                response = await client.call("search", cid=cid, session_no=session_no, keywords=" ".join(words))
+                if response.get("ok"):
+                    seen = [p["pid"] for p in response["result"]] or seen
+            elif op == "get_product":
+                pid = rng.choice(seen) if seen else rng.randint(1, num_products)
+                await client.call("get_product", cid=cid, session_no=session_no, pid=pid)
+            elif op == "add_to_cart":
+                pid = rng.choice(seen) if seen else rng.randint(1, num_products)
+                await client.call("add_to_cart", cid=cid, session_no=session_no, pid=pid, qty=1)
+            elif op == "get_cart":
+                await client.call("get_cart", cid=cid, session_no=session_no)
+            elif op == "list_orders":
+                await client.call("list_orders", cid=cid)
+            else:
+                await client.call("checkout", cid=cid, session_no=session_no, address="somewhere")
+        await client.call("end_session", cid=cid, session_no=session_no)
+    finally:
+        writer.close()
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def report(stats, seconds, sessions):
+    total = sum(len(samples) for samples, _ in stats.values())
+    print(f"\n{sessions} sessions, {total} requests in {seconds:.1f}s ({total / seconds:,.0f} req/s)")
+    print("\n{:<16} {:>8} {:>10} {:>10} {:>10}  {}".format("operation", "count", "p50 (ms)", "p99 (ms)", "max (ms)", "errors"))
+    print("-" * 72)
+    for op in sorted(stats):
+        samples, errors = stats[op]
+        print("{:<16} {:>8} {:>10.2f} {:>10.2f} {:>10.2f}  {}".format(
+            op, len(samples), percentile(samples, 0.5) * 1000, percentile(samples, 0.99) * 1000,
+            max(samples) * 1000, ", ".join(f"{k} {v}" for k, v in sorted(errors.items())) or "-",
+        ))
+
+
+# Builds the benchmark database once and starts server.py on a free port
+def start_server(db_path, num_products, readers):
+    from db import connect_db, init_db
+    from search_index import rebuild_search_index
+
+    conn = connect_db(db_path)
+    init_db(conn)
+    if conn.execute("SELECT COUNT(*) FROM products").fetchone()[0] < num_products:
+        conn.execute("DELETE FROM products")
+        conn.commit()
+        fill_catalog(conn, num_products)
+        rebuild_search_index(conn)
+    conn.close()
+    server_py = os.path.join(os.path.dirname(__file__), "..", "server.py")
+    proc = subprocess.Popen(
+        [sys.executable, server_py, db_path, "--port", "0", "--readers", str(readers)],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    line = proc.stdout.readline()
+    if not line.startswith("listening on "):
+        proc.kill()
+        raise RuntimeError(f"server did not start: {line!r}")
+    host, port = line.split()[-1].rsplit(":", 1)
+    return proc, host, int(port)
+
+
+async def main_async(args, host, port):
+    stats = {}
+    run_id = int(time.time() * 1000)
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    results = await asyncio.gather(*[
+        run_session(host, port, i, run_id, args.ops, args.products, stats, random.Random(rng.random()))
+        for i in range(args.sessions)
+    ], return_exceptions=True)
+    seconds = time.perf_counter() - start
+    failed = [r for r in results if isinstance(r, Exception)]
+    if failed:
+        print(f"{len(failed)} sessions failed, first: {failed[0]!r}")
+    report(stats, seconds, args.sessions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for server.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None, help="existing server (default: start one)")
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--ops", type=int, default=40, help="operations per session")
+    parser.add_argument("--products", type=int, default=10_000)
+    parser.add_argument("--readers", type=int, default=4, help="reader connections of the started server")
+    parser.add_argument("--db", default="loadgen.db", help="database of the started server")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    proc = None
+    host, port = args.host, args.port
+    if port is None:
+        proc, host, port = start_server(args.db, args.products, args.readers)
+    try:
+        asyncio.run(main_async(args, host, port))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
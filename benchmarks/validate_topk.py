@@ -0,0 +1,115 @@
+# Validates the top-K engine (topk.py) against the original GROUP BY query
+# on randomized data, and times both.
+#
+#   python3 benchmarks/validate_topk.py [rounds] [num_views]
+#
+# Each round builds a fresh in-memory database, inserts random orders,
+# order lines (including repeated pids inside one order) through plain
+# INSERTs so the counter trigger fires and views through the activity
+# writer, then compares the top-N with ties for several N, all-time and for
+# a time window. Exits 1 on a mismatch.
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import activity
+import topk
+from db import connect_db, init_db
+
+ORIGINAL_SQL = {
+    "orders": """
+        SELECT ol.pid, p.name, COUNT(DISTINCT ol.ono) AS cnt
+        FROM orderlines ol JOIN products p ON ol.pid=p.pid
+        JOIN orders o ON o.ono = ol.ono
+        WHERE o.odate >= ?
+        GROUP BY ol.pid
+        ORDER BY cnt DESC, ol.pid ASC
+    """,
+    "views": """
+        SELECT v.pid, p.name, COUNT(*) AS cnt
+        FROM viewedProduct v JOIN products p ON v.pid=p.pid
+        WHERE substr(v.ts, 1, 10) >= ?
+        GROUP BY v.pid
+        ORDER BY cnt DESC, v.pid ASC
+    """,
+}
+
+
+# The report's original logic: fetch everything, keep rows tied with the n-th
+def original_top(conn, metric, n, since):
+    all_rows = conn.execute(ORIGINAL_SQL[metric], (since or "",)).fetchall()
+    if len(all_rows) > n:
+        threshold = all_rows[n - 1]["cnt"]
+        all_rows = [r for r in all_rows if r["cnt"] >= threshold]
+    return [(r["pid"], r["name"], r["cnt"]) for r in all_rows]
+
+
+def fill(conn, rng, num_products, num_orders, num_views):
+    # events for pids missing from the catalog are allowed on purpose, so the
+    # JOIN with products matters
+    conn.execute("PRAGMA foreign_keys = OFF")
+    conn.executemany(
+        "INSERT OR IGNORE INTO products(pid, name, category, price, stock_count, descr) VALUES(?,?,?,?,?,?)",
+        [(pid, f"product {pid}", "misc", 1.0, 10, "") for pid in range(7, num_products + 1)],
+    )
+    conn.execute("INSERT INTO users(uid, pwd, role) VALUES(2, '', 'customer')")
+    conn.execute("INSERT INTO customers(cid, name, email) VALUES(2, 'x', 'x@example.com')")
+    conn.execute("INSERT INTO sessions(cid, sessionNo, start_time) VALUES(2, 1, '2024-01-01')")
+    # small pid range + skew so there are plenty of ties
+    pick = lambda: min(int(rng.paretovariate(1.2)), num_products + 5)
+    for ono in range(1, num_orders + 1):
+        day = f"2024-01-{rng.randint(1, 28):02d}"
+        conn.execute("INSERT INTO orders(ono, cid, sessionNo, odate, shipping_address) VALUES(?, 2, 1, ?, '')", (ono, day))
+        conn.executemany(
+            "INSERT INTO orderlines(ono, lineNo, pid, qty, uprice) VALUES(?,?,?,1,1.0)",
+            [(ono, line_no, pick()) for line_no in range(1, rng.randint(1, 5) + 1)],
+        )
+    activity.write_events(
+        conn,
+        [("viewedProduct", (2, 1, f"2024-01-{rng.randint(1, 28):02d} 12:00:00", pick())) for _ in range(num_views)],
+    )
+    conn.execute("DELETE FROM products WHERE pid IN (3, 11)")
+    conn.commit()
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    num_views = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    rng = random.Random(1234)
+    mismatches = 0
+    engine_time = original_time = 0.0
+    for _ in range(rounds):
+        conn = connect_db(":memory:")
+        init_db(conn)
+        fill(conn, rng, rng.randint(10, 60), rng.randint(50, 500), num_views)
+        for metric in topk.METRICS:
+            for n in (1, 2, 3, 5, 10):
+                for since in (None, "2024-01-15"):
+                    t0 = time.perf_counter()
+                    want = original_top(conn, metric, n, since)
+                    t1 = time.perf_counter()
+                    got = topk.top_products(conn, metric, n, since)
+                    t2 = time.perf_counter()
+                    original_time += t1 - t0
+                    engine_time += t2 - t1
+                    if got != want:
+                        mismatches += 1
+                        print(f"MISMATCH metric={metric} n={n} since={since}\n  engine:   {got}\n  original: {want}")
+        # rebuilding from the raw tables must give the same counters as the writers
+        before = conn.execute("SELECT * FROM product_daily_counts ORDER BY day, pid").fetchall()
+        topk.rebuild(conn)
+        after = conn.execute("SELECT * FROM product_daily_counts ORDER BY day, pid").fetchall()
+        if [tuple(r) for r in before] != [tuple(r) for r in after]:
+            mismatches += 1
+            print("MISMATCH maintained counters differ from rebuild()")
+        conn.close()
+    print(f"{rounds} rounds, {mismatches} mismatches")
+    print(f"original query: {original_time * 1000:.1f} ms total, engine: {engine_time * 1000:.1f} ms total")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+import os
+import socket
+import threading
+import time
+
+import product_cache
+from checkout import InsufficientStockError
+
+# Session carts kept in memory with write-behind persistence.
+# Every cart change used to be its own SELECT + UPDATE/INSERT + commit, and
+# the cart screen re-read the cart table on every redraw. A session's cart
+# now lives in a small Cart object: changes are checked against the product
+# cache and applied in memory, and the lines changed since the last write
+# are persisted together (upserts and deletes in one transaction) when
+#   - the oldest unwritten change is older than max_delay (checked on every
+#     cart call; the server also runs flush_stale() on a timer),
+#   - the session checks out (the checkout engine reads the cart table), or
+#   - the session ends (end_customer_session).
+# A crash loses at most the last max_delay seconds of cart changes; the
+# persisted cart of a session whose process died before it ended is carried
+# over into the customer's next session (see CartStore.recover).
+#
+# Carts are shared by every connection of the process (the server's readers
+# and writer), so all access goes through one lock.
+#
+#   COMMERCE_CART_MAX_DELAY   seconds a change may stay unwritten (default 5,
+#                             0 = write every change at once)
+
+DEFAULT_MAX_DELAY = float(os.environ.get("COMMERCE_CART_MAX_DELAY", "5"))
+
+# clean carts not used for this long are dropped from memory (flush_stale)
+MAX_IDLE = 3600
+
+UPSERT_SQL = """
+    INSERT INTO cart(cid, sessionNo, pid, qty) VALUES(?,?,?,?)
+    ON CONFLICT(cid, sessionNo, pid) DO UPDATE SET qty = excluded.qty
+    """
+DELETE_SQL = "DELETE FROM cart WHERE cid = ? AND sessionNo = ? AND pid = ?"
+LOAD_SQL = "SELECT pid, qty FROM cart WHERE cid = ? AND sessionNo = ?"
+
+# recover(): the customer's latest earlier session that never ended, closing
+# it, and moving its cart lines
+UNFINISHED_SESSION_SQL = """
+    SELECT sessionNo, owner FROM sessions
+    WHERE cid = ? AND sessionNo < ? AND end_time IS NULL
+    ORDER BY sessionNo DESC LIMIT 1
+    """
+CLOSE_SESSION_SQL = "UPDATE sessions SET end_time = start_time WHERE cid = ? AND sessionNo = ? AND end_time IS NULL"
+MOVE_CART_SQL = "UPDATE cart SET sessionNo = ? WHERE cid = ? AND sessionNo = ?"
+
+
+# sessions.owner of the sessions this process starts
+def session_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+# True only if the process that owned a session is known to have exited: it
+# ran on this host and its pid is gone. Sessions from another host or from
+# before owners were recorded (None) may still be running.
+def _owner_gone(owner):
+    if owner is None or os.name != "posix":
+        return False
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit() or int(pid) == os.getpid():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+class CartError(Exception):
+    pass
+
+
+class NotInCartError(CartError):
+    def __init__(self, pid):
+        super().__init__(f"Product {pid} is not in the cart.")
+        self.pid = pid
+
+
+class UnknownProductError(CartError):
+    def __init__(self, pid):
+        super().__init__(f"Product {pid} does not exist.")
+        self.pid = pid
+
+
+class Cart:
+    __slots__ = ("cid", "session_no", "lines", "dirty", "changed_at", "used_at")
+
+    def __init__(self, cid, session_no, lines):
+        self.cid = cid
+        self.session_no = session_no
+        # pid -> qty
+        self.lines = lines
+        # pids changed since the last write (a pid missing from lines is deleted)
+        self.dirty = set()
+        self.changed_at = None
+        self.used_at = time.monotonic()
+
+    def _changed(self, pid):
+        if not self.dirty:
+            self.changed_at = time.monotonic()
+        self.dirty.add(pid)
+
+    def set(self, pid, qty):
+        self.lines[pid] = qty
+        self._changed(pid)
+
+    def remove(self, pid):
+        if self.lines.pop(pid, None) is None:
+            raise NotInCartError(pid)
+        self._changed(pid)
+
+    def clear(self):
+        self.lines.clear()
+        self.dirty.clear()
+        self.changed_at = None
+
+    # (pid, qty) sorted by pid
+    def items(self):
+        return sorted(self.lines.items())
+
+    # Takes the pending changes: ([(cid, sessionNo, pid, qty)], [(cid, sessionNo, pid)])
+    def _take_changes(self):
+        upserts = []
+        deletes = []
+        for pid in self.dirty:
+            qty = self.lines.get(pid)
+            if qty is None:
+                deletes.append((self.cid, self.session_no, pid))
+            else:
+                upserts.append((self.cid, self.session_no, pid, qty))
+        self.dirty = set()
+        self.changed_at = None
+        return upserts, deletes
+
+
+class CartStore:
+    def __init__(self, max_delay=DEFAULT_MAX_DELAY):
+        self.max_delay = max_delay
+        self.loads = 0
+        self.writes = 0
+        self.rows_written = 0
+        self._carts = {}
+        # (cid, sessionNo) of the sessions started and not yet ended here;
+        # unlike _carts, never evicted
+        self._open = set()
+        self._lock = threading.Lock()
+
+    # Returns the session's cart, read from the cart table the first time
+    def _cart(self, conn, cid, session_no):
+        key = (cid, session_no)
+        with self._lock:
+            cart = self._carts.get(key)
+        if cart is None:
+            rows = conn.execute(LOAD_SQL, (cid, session_no)).fetchall()
+            with self._lock:
+                cart = self._carts.setdefault(key, Cart(cid, session_no, {row[0]: row[1] for row in rows}))
+                self.loads += 1
+        cart.used_at = time.monotonic()
+        return cart
+
+    # Adds qty of pid and returns the new cart quantity
+    def add(self, conn, cid, session_no, pid, qty):
+        cart = self._cart(conn, cid, session_no)
+        row = product_cache.get_product(conn, pid)
+        if row is None:
+            raise UnknownProductError(pid)
+        with self._lock:
+            new_qty = cart.lines.get(pid, 0) + qty
+            if new_qty > row["stock_count"]:
+                raise InsufficientStockError(pid)
+            cart.set(pid, new_qty)
+        self._write_if_due(conn, cart)
+        return new_qty
+
+    # Sets the quantity of a pid already in the cart
+    def update(self, conn, cid, session_no, pid, qty):
+        cart = self._cart(conn, cid, session_no)
+        row = product_cache.get_product(conn, pid)
+        if row is None:
+            raise UnknownProductError(pid)
+        with self._lock:
+            if pid not in cart.lines:
+                raise NotInCartError(pid)
+            if qty > row["stock_count"]:
+                raise InsufficientStockError(pid)
+            cart.set(pid, qty)
+        self._write_if_due(conn, cart)
+        return qty
+
+    # Adds many (pid, qty) lines at once (repeated pids add up). The stock of
+    # every pid comes from one product cache read, i.e. at most one query,
+    # and the changed lines are written right away in one transaction. A line
+    # for an unknown product or beyond the stock raises and leaves the cart
+    # unchanged, unless partial: then it is skipped. Returns
+    # ([(pid, new cart qty)], [skipped CartError / InsufficientStockError]).
+    def add_many(self, conn, cid, session_no, items, partial=False):
+        cart = self._cart(conn, cid, session_no)
+        wanted = {}
+        for pid, qty in items:
+            wanted[pid] = wanted.get(pid, 0) + qty
+        products = product_cache.get_products(conn, list(wanted))
+        added = []
+        skipped = []
+        with self._lock:
+            for pid, qty in wanted.items():
+                row = products.get(pid)
+                new_qty = cart.lines.get(pid, 0) + qty
+                if row is None:
+                    error = UnknownProductError(pid)
+                elif new_qty > row["stock_count"]:
+                    error = InsufficientStockError(pid)
+                else:
+                    added.append((pid, new_qty))
+                    continue
+                if not partial:
+                    raise error
+                skipped.append(error)
+            for pid, new_qty in added:
+                cart.set(pid, new_qty)
+        self._write(conn, [cart])
+        return added, skipped
+
+    def remove(self, conn, cid, session_no, pid):
+        cart = self._cart(conn, cid, session_no)
+        with self._lock:
+            cart.remove(pid)
+        self._write_if_due(conn, cart)
+
+    # [(pid, qty)] sorted by pid
+    def lines(self, conn, cid, session_no):
+        cart = self._cart(conn, cid, session_no)
+        with self._lock:
+            return cart.items()
+
+    def _write_if_due(self, conn, cart):
+        if cart.changed_at is not None and time.monotonic() - cart.changed_at >= self.max_delay:
+            self._write(conn, [cart])
+
+    # Persists the pending changes of carts in one transaction. Must not be
+    # called with a transaction open on conn (it commits or rolls back).
+    def _write(self, conn, carts):
+        if conn.in_transaction:
+            raise RuntimeError("cart writes need a connection with no open transaction")
+        with self._lock:
+            changes = [(cart, cart._take_changes()) for cart in carts if cart.dirty]
+        if not changes:
+            return
+        try:
+            for cart, (upserts, deletes) in changes:
+                conn.executemany(UPSERT_SQL, upserts)
+                conn.executemany(DELETE_SQL, deletes)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            # still unwritten: mark the lines dirty again
+            with self._lock:
+                for cart, (upserts, deletes) in changes:
+                    for row in upserts + deletes:
+                        cart._changed(row[2])
+            raise
+        self.writes += 1
+        self.rows_written += sum(len(u) + len(d) for _, (u, d) in changes)
+
+    # Writes the session's pending cart changes (before checkout)
+    def flush(self, conn, cid, session_no):
+        with self._lock:
+            cart = self._carts.get((cid, session_no))
+        if cart is not None:
+            self._write(conn, [cart])
+
+    # Forgets the lines of a checked-out cart (the checkout deleted the rows)
+    def checked_out(self, cid, session_no):
+        with self._lock:
+            cart = self._carts.get((cid, session_no))
+            if cart is not None:
+                cart.clear()
+
+    # Registers a session started by this process and carries over the
+    # cart of its crashed predecessor (see recover)
+    def start(self, conn, cid, session_no):
+        with self._lock:
+            self._open.add((cid, session_no))
+        return self.recover(conn, cid, session_no)
+
+    # Writes the session's cart and drops it from memory (session end)
+    def close(self, conn, cid, session_no):
+        self.flush(conn, cid, session_no)
+        with self._lock:
+            self._carts.pop((cid, session_no), None)
+            self._open.discard((cid, session_no))
+
+    # Writes every cart whose oldest change is older than max_delay (or all
+    # of them, everything=True) and drops carts idle for MAX_IDLE
+    def flush_stale(self, conn, everything=False):
+        now = time.monotonic()
+        with self._lock:
+            carts = list(self._carts.values())
+        due = [c for c in carts if c.changed_at is not None and (everything or now - c.changed_at >= self.max_delay)]
+        self._write(conn, due)
+        with self._lock:
+            for key, cart in list(self._carts.items()):
+                if not cart.dirty and now - cart.used_at >= MAX_IDLE:
+                    del self._carts[key]
+
+    # Moves the persisted cart of the customer's last session into
+    # session_no, if that session never ended and the process that ran it is
+    # known to be gone (see _owner_gone; a session still open here or in any
+    # other live process keeps its cart). The old session is closed. Returns
+    # the number of cart lines carried over.
+    def recover(self, conn, cid, session_no):
+        row = conn.execute(UNFINISHED_SESSION_SQL, (cid, session_no)).fetchone()
+        if row is None:
+            return 0
+        old = row[0]
+        with self._lock:
+            if (cid, old) in self._open:
+                return 0
+        if not _owner_gone(row[1]):
+            return 0
+        if conn.in_transaction:
+            raise RuntimeError("recover() needs a connection with no open transaction")
+        moved = 0
+        # another login of the customer may have recovered it meanwhile
+        cur = conn.execute(CLOSE_SESSION_SQL, (cid, old))
+        if cur.rowcount:
+            cur = conn.execute(MOVE_CART_SQL, (session_no, cid, old))
+            moved = cur.rowcount
+        conn.commit()
+        return moved
+
+    def stats(self):
+        with self._lock:
+            dirty = sum(1 for cart in self._carts.values() if cart.dirty)
+            return {
+                "carts": len(self._carts), "open": len(self._open), "dirty": dirty, "loads": self.loads,
+                "writes": self.writes, "rows_written": self.rows_written,
+            }
+
+
+# Process-wide store used by services.py / sessions.py
+_store = CartStore()
+
+
+# Replaces the process-wide store with one using the given settings
+def configure(max_delay=DEFAULT_MAX_DELAY):
+    global _store
+    _store = CartStore(max_delay)
+    return _store
+
+
+def get_store():
+    return _store
+
+
+def add(conn, cid, session_no, pid, qty):
+    return _store.add(conn, cid, session_no, pid, qty)
+
+
+def update(conn, cid, session_no, pid, qty):
+    return _store.update(conn, cid, session_no, pid, qty)
+
+
+def add_many(conn, cid, session_no, items, partial=False):
+    return _store.add_many(conn, cid, session_no, items, partial)
+
+
+def remove(conn, cid, session_no, pid):
+    _store.remove(conn, cid, session_no, pid)
+
+
+def lines(conn, cid, session_no):
+    return _store.lines(conn, cid, session_no)
+
+
+def flush(conn, cid, session_no):
+    _store.flush(conn, cid, session_no)
+
+
+def checked_out(cid, session_no):
+    _store.checked_out(cid, session_no)
+
+
+def close(conn, cid, session_no):
+    _store.close(conn, cid, session_no)
+
+
+def flush_stale(conn, everything=False):
+    _store.flush_stale(conn, everything)
+
+
+def start(conn, cid, session_no):
+    return _store.start(conn, cid, session_no)
+
+
+def recover(conn, cid, session_no):
+    return _store.recover(conn, cid, session_no)
+
+
+def stats():
+    return _store.stats()
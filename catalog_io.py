@@ -0,0 +1,435 @@
+import argparse
+import csv
+import json
+import math
+import sqlite3
+import sys
+import time
+
+import product_cache
+from migrations import drop_schema_objects, ensure_schema_objects, migrate
+
+# Streaming bulk import/export of the products table (CSV or JSONL).
+#
+#   python3 catalog_io.py import products.csv [db_path] [--batch-size N]
+#   python3 catalog_io.py export products.jsonl [db_path]
+#   python3 catalog_io.py export - --format csv [db_path] > products.csv
+#   python3 catalog_io.py update changes.csv [db_path] [--batch-size N]
+#
+# Files have the products columns pid, name, category, price, stock_count,
+# descr (a CSV header row, or one JSON object per line). Rows are parsed and
+# validated one at a time and upserted by pid in executemany batches, one
+# transaction per batch, on a bulk-load connection. Invalid rows are
+# reported with their line number and skipped. In a large import the per-row
+# work on products is deferred: secondary indexes on products and the
+# full-text/catalog-version triggers are dropped once it is large enough and
+# put back once at the end (the full-text index is rebuilt in one pass),
+# see import_products. The export walks
+# the table in pid order with fetchmany, so neither direction ever holds
+# the whole catalog in memory.
+#
+# update applies price changes and stock deltas to existing products (see
+# update_products); it is also available from the sales menu.
+
+COLUMNS = ("pid", "name", "category", "price", "stock_count", "descr")
+FORMATS = ("csv", "jsonl")
+
+DEFAULT_BATCH_SIZE = 50000
+DEFAULT_UPDATE_BATCH_SIZE = 10000
+MAX_REPORTED_ERRORS = 20
+
+UPSERT_SQL = """
+    INSERT INTO products(pid, name, category, price, stock_count, descr) VALUES(?,?,?,?,?,?)
+    ON CONFLICT(pid) DO UPDATE SET
+        name = excluded.name,
+        category = excluded.category,
+        price = excluded.price,
+        stock_count = excluded.stock_count,
+        descr = excluded.descr
+"""
+
+# imports of at least this many rows defer the per-row trigger work on
+# products to one pass at the end (smaller ones keep the triggers)
+DEFER_MAINTENANCE_ROWS = 10000
+
+PRODUCTS_TABLES = ("products",)
+
+
+class ImportStats:
+    def __init__(self):
+        self.read = 0
+        self.loaded = 0
+        self.invalid = 0
+        self.errors = []
+        # time spent loading rows, and rebuilding what was deferred afterwards
+        self.seconds = 0.0
+        self.index_seconds = 0.0
+
+    @property
+    def rows_per_sec(self):
+        return self.loaded / self.seconds if self.seconds else 0.0
+
+    def reject(self, line_no, reason):
+        self.invalid += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line_no, reason))
+
+
+class UpdateStats(ImportStats):
+    def __init__(self):
+        super().__init__()
+        self.missing = 0
+        self.missing_pids = []
+
+    def report_missing(self, pid):
+        self.missing += 1
+        if len(self.missing_pids) < MAX_REPORTED_ERRORS:
+            self.missing_pids.append(pid)
+
+
+def format_of(path, fmt=None):
+    if fmt:
+        return fmt
+    for name in FORMATS:
+        if path.lower().endswith("." + name):
+            return name
+    raise ValueError(f"cannot tell the format of {path!r}, use --format {'/'.join(FORMATS)}")
+
+
+# Yields (line number, dict of raw values) from a CSV or JSONL stream;
+# a malformed line yields (line number, error message) instead of a dict
+def read_records(stream, fmt):
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line_no, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_no, f"bad JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield line_no, "expected a JSON object"
+                continue
+            yield line_no, record
+
+
+# Checks and converts one record to a products row tuple.
+# Raises ValueError with a short reason when the record is invalid.
+def validate_record(record):
+    missing = [c for c in ("pid", "name", "price", "stock_count") if record.get(c) in (None, "")]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    try:
+        pid = int(record["pid"])
+    except (TypeError, ValueError):
+        raise ValueError(f"pid {record['pid']!r} is not an integer")
+    if pid <= 0:
+        raise ValueError(f"pid {pid} must be positive")
+    try:
+        price = float(record["price"])
+    except (TypeError, ValueError):
+        raise ValueError(f"price {record['price']!r} is not a number")
+    if not math.isfinite(price):
+        raise ValueError(f"price {price} is not a finite number")
+    if not price > 0:
+        raise ValueError(f"price {price} must be positive")
+    try:
+        stock = int(record["stock_count"])
+    except (TypeError, ValueError):
+        raise ValueError(f"stock_count {record['stock_count']!r} is not an integer")
+    if stock < 0:
+        raise ValueError(f"stock_count {stock} cannot be negative")
+    return (pid, str(record["name"]), str(record.get("category") or ""), price, stock, str(record.get("descr") or ""))
+
+
+# Checks and converts one update record to (pid, price or None, stock delta or None)
+def validate_update(record):
+    if record.get("pid") in (None, ""):
+        raise ValueError("missing pid")
+    try:
+        pid = int(record["pid"])
+    except (TypeError, ValueError):
+        raise ValueError(f"pid {record['pid']!r} is not an integer")
+    price = record.get("price")
+    delta = record.get("stock_delta")
+    if price in (None, "") and delta in (None, ""):
+        raise ValueError("nothing to update (no price or stock_delta)")
+    if price in (None, ""):
+        price = None
+    else:
+        try:
+            price = float(price)
+        except (TypeError, ValueError):
+            raise ValueError(f"price {price!r} is not a number")
+        if not math.isfinite(price):
+            raise ValueError(f"price {price} is not a finite number")
+        if not price > 0:
+            raise ValueError(f"price {price} must be positive")
+    if delta in (None, ""):
+        delta = None
+    else:
+        try:
+            delta = int(delta)
+        except (TypeError, ValueError):
+            raise ValueError(f"stock_delta {delta!r} is not an integer")
+    return pid, price, delta
+
+
+# Upserts every valid record of `stream` into products, committing each
+# batch (so the write lock and the WAL never span the whole file). Once the
+# import reaches DEFER_MAINTENANCE_ROWS rows, the per-row work on products
+# (the migrations.SCHEMA_OBJECTS triggers and indexes) is dropped, recorded
+# in deferred_maintenance and committed before the batch is written, and put
+# back at the end, rebuilding the full-text index once. If the import fails
+# the committed batches stay and the objects are put back right away; if the
+# process dies, the next migrate() puts them back from that record.
+# report(stats) is called after every batch. Must not be called with a
+# transaction open on conn.
+def import_products(conn, stream, fmt, batch_size=DEFAULT_BATCH_SIZE, report=None):
+    if conn.in_transaction:
+        raise RuntimeError("import_products() needs a connection with no open transaction")
+    stats = ImportStats()
+    start = time.perf_counter()
+    deferred = False
+    try:
+        batch = []
+        for line_no, record in read_records(stream, fmt):
+            stats.read += 1
+            if isinstance(record, str):
+                stats.reject(line_no, record)
+                continue
+            try:
+                batch.append(validate_record(record))
+            except ValueError as e:
+                stats.reject(line_no, str(e))
+                continue
+            if len(batch) >= batch_size:
+                deferred = _write_batch(conn, batch, deferred, stats, start, report)
+                batch = []
+        if batch:
+            deferred = _write_batch(conn, batch, deferred, stats, start, report)
+        stats.seconds = time.perf_counter() - start
+        if deferred:
+            ensure_schema_objects(conn, PRODUCTS_TABLES)
+            conn.commit()
+    except BaseException:
+        conn.rollback()
+        if deferred:
+            _restore_schema_objects(conn)
+        raise
+    finally:
+        product_cache.invalidate()
+    stats.index_seconds = time.perf_counter() - start - stats.seconds
+    return stats
+
+
+# Writes and commits one batch; returns whether the products maintenance is
+# deferred
+def _write_batch(conn, batch, deferred, stats, start, report):
+    if not deferred and stats.loaded + len(batch) >= DEFER_MAINTENANCE_ROWS:
+        drop_schema_objects(conn, PRODUCTS_TABLES)
+        conn.commit()
+        deferred = True
+    try:
+        conn.execute("BEGIN")
+        conn.executemany(UPSERT_SQL, batch)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    stats.loaded += len(batch)
+    stats.seconds = time.perf_counter() - start
+    if report:
+        report(stats)
+    return deferred
+
+
+# Puts back what a failed import dropped. If that fails too, the
+# deferred_maintenance record stays for the next migrate().
+def _restore_schema_objects(conn):
+    try:
+        ensure_schema_objects(conn, PRODUCTS_TABLES)
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"could not restore the products triggers and indexes ({e}); the next start does", file=sys.stderr)
+
+
+# Applies (pid, price, stock_delta) records from `stream` to existing
+# products, batch_size records per IMMEDIATE transaction. Within a batch the
+# current stock of the touched pids is read under the write lock, deltas are
+# applied in file order (repeated pids accumulate, the last price wins) and
+# the final values are written with executemany. Unknown pids, malformed
+# records and deltas that would take stock below zero are reported in the
+# returned UpdateStats and skipped; the rest of the batch still applies.
+# The product cache is invalidated once per batch for the pids it changed.
+# report(stats) is called after every committed batch. Must not be called
+# with a transaction open on conn.
+def update_products(conn, stream, fmt, batch_size=DEFAULT_UPDATE_BATCH_SIZE, report=None):
+    if conn.in_transaction:
+        raise RuntimeError("update_products() needs a connection with no open transaction")
+    stats = UpdateStats()
+    start = time.perf_counter()
+    batch = []
+    for line_no, record in read_records(stream, fmt):
+        stats.read += 1
+        if isinstance(record, str):
+            stats.reject(line_no, record)
+            continue
+        try:
+            batch.append((line_no,) + validate_update(record))
+        except ValueError as e:
+            stats.reject(line_no, str(e))
+            continue
+        if len(batch) >= batch_size:
+            _apply_updates(conn, batch, stats, start, report)
+            batch = []
+    if batch:
+        _apply_updates(conn, batch, stats, start, report)
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def _apply_updates(conn, batch, stats, start, report):
+    pids = sorted({pid for _, pid, _, _ in batch})
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        stock = {}
+        for i in range(0, len(pids), 500):
+            chunk = pids[i:i + 500]
+            for row in conn.execute(
+                f"SELECT pid, stock_count FROM products WHERE pid IN ({','.join('?' * len(chunk))})", chunk
+            ):
+                stock[row["pid"]] = row["stock_count"]
+        prices = {}
+        new_stock = {}
+        for line_no, pid, price, delta in batch:
+            if pid not in stock:
+                stats.report_missing(pid)
+                continue
+            if delta is not None:
+                current = new_stock.get(pid, stock[pid])
+                if current + delta < 0:
+                    stats.reject(line_no, f"stock_delta {delta} would take pid {pid} below zero (stock {current})")
+                    continue
+                new_stock[pid] = current + delta
+            if price is not None:
+                prices[pid] = price
+            stats.loaded += 1
+        conn.executemany("UPDATE products SET price = ? WHERE pid = ?", [(v, pid) for pid, v in prices.items()])
+        conn.executemany("UPDATE products SET stock_count = ? WHERE pid = ?", [(v, pid) for pid, v in new_stock.items()])
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    product_cache.invalidate(set(prices) | set(new_stock))
+    stats.seconds = time.perf_counter() - start
+    if report:
+        report(stats)
+
+
+# Writes every product in pid order to `stream`; returns the number of rows
+def export_products(conn, stream, fmt, batch_size=DEFAULT_BATCH_SIZE):
+    cur = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM products ORDER BY pid")
+    writer = None
+    if fmt == "csv":
+        writer = csv.writer(stream)
+        writer.writerow(COLUMNS)
+    count = 0
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            if writer:
+                writer.writerow(tuple(row))
+            else:
+                stream.write(json.dumps(dict(zip(COLUMNS, tuple(row)))) + "\n")
+        count += len(rows)
+    return count
+
+
+def print_progress(stats):
+    print(f"  {stats.loaded} rows loaded ({stats.rows_per_sec:,.0f} rows/s)", file=sys.stderr)
+
+
+# Prints what an update_products run did, including the skipped records
+def print_update_summary(stats, file=None):
+    file = file or sys.stdout
+    for line_no, reason in sorted(stats.errors):
+        print(f"line {line_no}: {reason}", file=file)
+    if stats.missing_pids:
+        more = " ..." if stats.missing > len(stats.missing_pids) else ""
+        print(f"unknown pids: {', '.join(str(pid) for pid in stats.missing_pids)}{more}", file=file)
+    print(
+        f"applied {stats.loaded} of {stats.read} updates in {stats.seconds:.1f}s "
+        f"({stats.rows_per_sec:,.0f} rows/s), {stats.missing} unknown pids, {stats.invalid} invalid",
+        file=file,
+    )
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Bulk product import/export/update")
+    parser.add_argument("command", choices=("import", "export", "update"))
+    parser.add_argument("file", help="CSV or JSONL file, - for stdin/stdout")
+    parser.add_argument("db_path", nargs="?", default=None, help="database file (default: local ecommerce.db)")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="file format (default: from the file extension)")
+    parser.add_argument("--batch-size", type=int, default=None, help="rows per batch (import) / transaction (update)")
+    return parser.parse_intermixed_args(argv)
+
+
+def main():
+    from db import connect_db
+
+    args = parse_args(sys.argv[1:])
+    try:
+        fmt = format_of(args.file, args.format or ("csv" if args.file == "-" else None))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+    # updates run against the live catalog, so they keep the normal profile
+    conn = connect_db(args.db_path, profile=None if args.command == "update" else "bulk-load")
+    migrate(conn)
+    if args.command == "update":
+        stream = sys.stdin if args.file == "-" else open(args.file, newline="", encoding="utf-8")
+        try:
+            stats = update_products(conn, stream, fmt, args.batch_size or DEFAULT_UPDATE_BATCH_SIZE)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        print_update_summary(stats, sys.stderr)
+    elif args.command == "import":
+        stream = sys.stdin if args.file == "-" else open(args.file, newline="", encoding="utf-8")
+        try:
+            stats = import_products(conn, stream, fmt, args.batch_size or DEFAULT_BATCH_SIZE, report=print_progress)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        for line_no, reason in stats.errors:
+            print(f"line {line_no}: {reason}", file=sys.stderr)
+        print(
+            f"imported {stats.loaded} of {stats.read} rows in {stats.seconds:.1f}s "
+            f"({stats.rows_per_sec:,.0f} rows/s), {stats.invalid} invalid; "
+            f"indexes rebuilt in {stats.index_seconds:.1f}s",
+            file=sys.stderr,
+        )
+    else:
+        stream = sys.stdout if args.file == "-" else open(args.file, "w", newline="", encoding="utf-8")
+        start = time.perf_counter()
+        try:
+            count = export_products(conn, stream, fmt, args.batch_size or DEFAULT_BATCH_SIZE)
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        seconds = time.perf_counter() - start
+        print(f"exported {count} rows in {seconds:.1f}s ({count / seconds if seconds else 0:,.0f} rows/s)", file=sys.stderr)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
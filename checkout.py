@@ -0,0 +1,119 @@
+import random
+import sqlite3
+import time
+from datetime import datetime
+
+import product_cache
+import rollups
+from ids import next_id
+
+# Checkout engine: turns a session's cart into an order atomically.
+# The whole checkout runs under BEGIN IMMEDIATE, so the stock it checks is
+# the stock it decrements, and every decrement is conditional
+# (stock_count >= qty) as a second guard against overselling. Orderlines and
+# stock updates are written with executemany. If another process holds the
+# write lock, the checkout is retried with exponential backoff.
+
+MAX_ATTEMPTS = 8
+BASE_BACKOFF = 0.01
+
+CART_SQL = """
+    SELECT c.pid, c.qty, p.price, p.stock_count
+    FROM cart c JOIN products p ON c.pid = p.pid
+    WHERE c.cid = ? AND c.sessionNo = ?
+    ORDER BY c.pid
+    """
+DECREMENT_SQL = "UPDATE products SET stock_count = stock_count - ? WHERE pid = ? AND stock_count >= ?"
+ORDER_SQL = "INSERT INTO orders(ono, cid, sessionNo, odate, shipping_address) VALUES(?,?,?,?,?)"
+ORDERLINE_SQL = "INSERT INTO orderlines(ono, lineNo, pid, qty, uprice) VALUES(?,?,?,?,?)"
+EMPTY_CART_SQL = "DELETE FROM cart WHERE cid = ? AND sessionNo = ?"
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCartError(CheckoutError):
+    def __init__(self):
+        super().__init__("Cart is empty.")
+
+
+class InsufficientStockError(CheckoutError):
+    def __init__(self, pid):
+        super().__init__(f"Insufficient stock for PID {pid}.")
+        self.pid = pid
+
+
+class DatabaseBusyError(CheckoutError):
+    pass
+
+
+# SQLITE_BUSY / SQLITE_LOCKED surface as OperationalError with these messages
+def _is_busy(error):
+    msg = str(error).lower()
+    return "locked" in msg or "busy" in msg
+
+
+# Runs one checkout attempt inside an IMMEDIATE transaction
+def _checkout_once(conn, cid, session_no, address, ono):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        items = conn.execute(CART_SQL, (cid, session_no)).fetchall()
+        if not items:
+            raise EmptyCartError()
+        # we hold the write lock, so this read is the current stock
+        for it in items:
+            if it["qty"] > it["stock_count"]:
+                raise InsufficientStockError(it["pid"])
+
+        cur = conn.cursor()
+        cur.executemany(DECREMENT_SQL, [(it["qty"], it["pid"], it["qty"]) for it in items])
+        if cur.rowcount != len(items):
+            # cannot happen under the write lock, but never oversell if it does
+            raise CheckoutError("Stock changed during checkout.")
+
+        odate = datetime.now().strftime("%Y-%m-%d")
+        cur.execute(ORDER_SQL, (ono, cid, session_no, odate, address))
+        lines = [
+            (ono, line_no, it["pid"], it["qty"], it["price"])
+            for line_no, it in enumerate(items, start=1)
+        ]
+        cur.executemany(ORDERLINE_SQL, lines)
+        # keep the daily sales rollup in step with the order
+        rollups.apply_order(conn, odate, cid, [(it["pid"], it["qty"], it["price"]) for it in items])
+        cur.execute(EMPTY_CART_SQL, (cid, session_no))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    total = sum(it["qty"] * it["price"] for it in items)
+    return total, [it["pid"] for it in items]
+
+
+# Places an order for everything in the session's cart.
+# Returns (ono, total); raises EmptyCartError, InsufficientStockError, or
+# DatabaseBusyError when the write lock could not be taken after retries.
+# Must not be called with a transaction open on conn.
+def checkout(conn, cid, session_no, address, max_attempts=MAX_ATTEMPTS):
+    if conn.in_transaction:
+        raise RuntimeError("checkout() needs a connection with no open transaction")
+    ono = None
+    for attempt in range(max_attempts):
+        try:
+            if ono is None:
+                ono = next_id(conn, "orders")
+            total, pids = _checkout_once(conn, cid, session_no, address, ono)
+            # the stock of these products just changed
+            product_cache.invalidate(pids)
+            return ono, total
+        except InsufficientStockError as e:
+            # whatever stock the customer was shown for it is out of date
+            product_cache.invalidate([e.pid])
+            raise
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e):
+                raise
+            if attempt == max_attempts - 1:
+                raise DatabaseBusyError(f"Database busy, checkout not placed ({e}).")
+            # exponential backoff with jitter so retries don't line up
+            time.sleep(BASE_BACKOFF * (2 ** attempt) * (0.5 + random.random()))
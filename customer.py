@@ -1,90 +1,62 @@
-from datetime import datetime
-
-# Records a search query in the database
-def record_search(conn, cid, session_no, query):
-    now_dt = datetime.now()
-    timestamp = now_dt.strftime("%Y-%m-%d %H:%M:%S")
-    search_insert_params = (cid, session_no, timestamp, query)
-    conn.execute(
-        "INSERT INTO search(cid, sessionNo, ts, query) VALUES(?,?,?,?)",
-        search_insert_params
-    )
-    conn.commit()
+import sqlite3
 
+import carts
+import instrument
+import services
+from checkout import CheckoutError, EmptyCartError, InsufficientStockError
+from pager import KeysetPager, SeekPager
 
-# Records a product view in the database
-def record_view(conn, cid, session_no, pid):
-    now_dt = datetime.now()
-    timestamp = now_dt.strftime("%Y-%m-%d %H:%M:%S")
-    view_insert_params = (cid, session_no, timestamp, pid)
-    conn.execute(
-        "INSERT INTO viewedProduct(cid, sessionNo, ts, pid) VALUES(?,?,?,?)",
-        view_insert_params
-    )
-    conn.commit()
+# products per page of search results
+PAGE_SIZE = 5
 
+# statements of the screens below (their plans are checked by query_plans.py)
+# order history, newest first, keyset pages over "o.cid = ?"
+ORDERS_SELECT_SQL = """
+    SELECT o.ono, o.odate, o.shipping_address,
+           (SELECT COALESCE(SUM(ol.qty * ol.uprice), 0) FROM orderlines ol WHERE ol.ono = o.ono) AS total
+    FROM orders o
+    """
+ORDERS_KEYS = [("o.odate", "odate"), ("o.ono", "ono")]
+ORDER_HEADER_SQL = "SELECT ono, odate, shipping_address FROM orders WHERE ono = ?"
+ORDER_LINES_SQL = """
+    SELECT ol.lineNo, p.name, p.category, ol.qty, ol.uprice, (ol.qty * ol.uprice) AS line_total
+    FROM orderlines ol JOIN products p ON ol.pid = p.pid
+    WHERE ol.ono = ?
+    ORDER BY ol.lineNo
+    """
 
 # Searches for products in the database based on a keyword
 def customer_search(conn, cid, session_no):
     
     # get keywords (space-separated) from the user
     raw = input("==> Keywords (space-separated): ").strip()
-    if not raw:
-        print("Empty keyword.")
-        return
-    keywords = raw.lower().split()
-    # record the original search string
-    record_search(conn, cid, session_no, raw)
-    
-    # Build AND semantics across keywords (case-insensitive)
-    # Single keyword: match in name OR description
-    # Multiple keywords: require each keyword to appear in either name OR description
-    params = []
-    if len(keywords) == 1:
-        like_kw = f"%{keywords[0]}%"
-        where_sql = "(lower(name) LIKE ? OR lower(descr) LIKE ?)"
-        params = [like_kw, like_kw]
-    else:
-        parts = []
-        for kw in keywords:
-            like_kw = f"%{kw}%"
-            parts.append("(lower(name) LIKE ? OR lower(descr) LIKE ?)")
-            params.extend([like_kw, like_kw])
-        where_sql = " AND ".join(parts)
-    sql = f"""
-        SELECT pid, name, category, price, stock_count
-        FROM products
-        WHERE {where_sql}
-        ORDER BY pid
-    """
-    cur = conn.cursor()
-    cur.execute(sql, tuple(params))
     
-    # get the results from the database
-    results = cur.fetchall()
+    # Every keyword must appear in the name or description (case-insensitive);
+    # services.search records the search and reads one page at a time from
+    # the search and product caches
+    fetch = lambda after, limit: services.search(conn, cid, session_no, raw, after, limit, record=False)
+    try:
+        first_page = services.search(conn, cid, session_no, raw, limit=PAGE_SIZE)
+    except services.ValidationError as e:
+        print(e)
+        return
+    pager = SeekPager(fetch, key=lambda r: r["pid"], first_page=first_page, page_size=PAGE_SIZE)
+    page_items = pager.page
     
     # if no results are found, print an error message and return
-    if not results:
+    if not page_items:
         print("No products found.")
         return
     
     # Pagination =======================================================
     
-    # initialize the page number
-    page = 0
-    
     # Main Loop
     while True:
         
-        # calculate the start and end indices for the current page
-        start = page * 5
-        end = start + 5
-        page_items = results[start:end]
-        
-        # if there are no more results, print an error message and break the loop
-        if not page_items:
-            print("No more results.")
-            break
+        # calculate the display offset for the current page
+        page = pager.page_index
+        start = page * pager.page_size
+        page_items = pager.page
         
         # print the results for the current page
         print(f"\n-- Results Page {page + 1} --\n")
@@ -112,9 +84,12 @@ def customer_search(conn, cid, session_no):
         
         # Handle navigation options
         if selection == "n":
-            page += 1
+            # if there are no more results, print an error message and break the loop
+            if not pager.next_page():
+                print("No more results.")
+                break
         elif selection == "p":
-            page = max(0, page - 1)
+            pager.prev_page()
         elif selection == "b":
             break
         elif selection.isdigit():
@@ -133,22 +108,17 @@ def customer_search(conn, cid, session_no):
 
 # Displays the details of a product and allows the user to add it to the cart
 def product_detail(conn, cid, session_no, pid):
-    cur = conn.cursor()
-    pid_param = (pid,)
-    cur.execute(
-        "SELECT pid, name, category, price, stock_count, descr FROM products WHERE pid = ?",
-        pid_param
-    )
-    
-    # get the product details from the database
-    r = cur.fetchone()
+    # get the product details (from the product cache when possible) and
+    # record the view of the product in the database
+    with instrument.operation("view"):
+        try:
+            r = services.get_product(conn, cid, session_no, pid)
+        except services.NotFoundError:
+            r = None
     if not r:
         print("Product not found.")
         return
     
-    # record the view of the product in the database
-    record_view(conn, cid, session_no, pid)
-    
     # print the product details
     print(
         f"\nPID {r['pid']}\nName: {r['name']}\nCategory: {r['category']}\nPrice: ${r['price']:.2f}\nStock: {r['stock_count']}\nDesc: {r['descr']}"
@@ -166,68 +136,25 @@ def product_detail(conn, cid, session_no, pid):
 
 
 def add_to_cart(conn, cid, session_no, pid, qty):
-    cur = conn.cursor()
-    
-    # get the stock count of the product from the database
-    pid_param_stock = (pid,)
-    cur.execute("SELECT stock_count FROM products WHERE pid = ?", pid_param_stock)
-    
-    # if the product does not exist, print an error message and return
-    row = cur.fetchone()
-    if not row:
+    # stock and existence checks and the cart write live in services.py
+    try:
+        with instrument.operation("add_to_cart"):
+            services.add_to_cart(conn, cid, session_no, pid, qty)
+    except services.NotFoundError:
         print("Product does not exist.")
         return
-    
-    # get the stock count of the product from the database
-    stock = row[0]
-    
-    # get the quantity of the product in the cart from the database
-    cart_check_params = (cid, session_no, pid)
-    cur.execute("SELECT qty FROM cart WHERE cid = ? AND sessionNo = ? AND pid = ?", cart_check_params)
-    
-    # if the product is already in the cart, add the quantity to the existing quantity
-    existing_product = cur.fetchone()
-    new_qty = qty
-    if existing_product:
-        new_qty = existing_product[0] + qty
-    if new_qty > stock:
+    except InsufficientStockError:
         print("Insufficient stock.")
         return
-    if existing_product:
-        # update the quantity of the product already in the cart
-        update_cart_params = (new_qty, cid, session_no, pid)
-        cur.execute(
-            "UPDATE cart SET qty = ? WHERE cid = ? AND sessionNo = ? AND pid = ?",
-            update_cart_params
-        )
-    else:
-        # add the product to the cart if it is not already in the cart
-        insert_cart_params = (cid, session_no, pid, qty)
-        cur.execute(
-            "INSERT INTO cart(cid, sessionNo, pid, qty) VALUES(?,?,?,?)",
-            insert_cart_params
-        )
-    # commit the changes to the database
-    conn.commit()
     print("Product added to cart.")
 
 
-
 # Displays the cart of the user
 def customer_cart(conn, cid, session_no):
     
-    # get the items in the cart from the database
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT c.pid, c.qty, p.name, p.category, p.price, p.stock_count, p.descr
-        FROM cart c JOIN products p ON c.pid = p.pid
-        WHERE c.cid = ? AND c.sessionNo = ?
-        ORDER BY p.pid
-        """,
-        (cid, session_no),
-    )
-    items = cur.fetchall()
+    # get the items in the cart
+    lines = services.cart_lines(conn, cid, session_no)
+    items = services.cart_items(conn, lines)
     
     # if the cart is empty, print message and return to main menu
     if not items:
@@ -237,17 +164,10 @@ def customer_cart(conn, cid, session_no):
     # Main Loop - only runs if cart has items
     while True:
         
-        # Refresh cart items in case they were updated
-        cur.execute(
-            """
-            SELECT c.pid, c.qty, p.name, p.category, p.price, p.stock_count, p.descr
-            FROM cart c JOIN products p ON c.pid = p.pid
-            WHERE c.cid = ? AND c.sessionNo = ?
-            ORDER BY p.pid
-            """,
-            (cid, session_no),
-        )
-        items = cur.fetchall()
+        # the cart lines come from the in-memory cart (carts.py) and are
+        # re-read only after this loop changes them; the product columns (stock
+        # included) come from the cache, which notices writes by other processes
+        items = services.cart_items(conn, lines)
         
         # print the header row
         print("\nThe cart contains the following items:")
@@ -294,22 +214,18 @@ def customer_cart(conn, cid, session_no):
                 print("Quantity must be positive.")
                 continue
             
-            # get the product id and stock count of the item
+            # get the product id of the item
             pid = items[index - 1]["pid"]
-            stock = items[index - 1]["stock_count"]
             
-            # if the new quantity exceeds the available stock, print an error message and continue the loop
-            if new_quantity > stock:
+            # update the quantity of the item in the cart (checked against the stock)
+            try:
+                services.update_cart(conn, cid, session_no, pid, new_quantity)
+            except InsufficientStockError:
                 print("Exceeds available stock.")
                 continue
-            
-            # update the quantity of the item in the cart
-            conn.execute(
-                "UPDATE cart SET qty = ? WHERE cid = ? AND sessionNo = ? AND pid = ?",
-                (new_quantity, cid, session_no, pid),
-            )
-            # commit the changes to the database
-            conn.commit()
+            except services.NotFoundError as e:
+                print(e)
+            lines = services.cart_lines(conn, cid, session_no)
             
         # Handle remove item option
         elif selection == "r":
@@ -326,12 +242,11 @@ def customer_cart(conn, cid, session_no):
             pid = items[index - 1]["pid"]
             
             # delete the item from the cart
-            conn.execute(
-                "DELETE FROM cart WHERE cid = ? AND sessionNo = ? AND pid = ?",
-                (cid, session_no, pid),
-            )
-            # commit the changes to the database
-            conn.commit()
+            try:
+                services.remove_from_cart(conn, cid, session_no, pid)
+            except services.NotFoundError as e:
+                print(e)
+            lines = services.cart_lines(conn, cid, session_no)
             
         # Handle checkout option
         elif selection == "c":
@@ -349,6 +264,7 @@ def customer_cart(conn, cid, session_no):
             # if the user wants to place the order, place the order
             if confirmation == "y":
                 place_order(conn, cid, session_no, address)
+                lines = services.cart_lines(conn, cid, session_no)
                 
         # Handle back option
         elif selection == "b":
@@ -359,106 +275,37 @@ def customer_cart(conn, cid, session_no):
 
 # Places an order in the database
 def place_order(conn, cid, session_no, address):
-    cur = conn.cursor()
-    
-    # get the items in the cart from the database
-    cur.execute(
-        "SELECT c.pid, c.qty, p.price, p.stock_count FROM cart c JOIN products p ON c.pid = p.pid WHERE c.cid = ? AND c.sessionNo = ?",
-        (cid, session_no),
-    )
-    items = cur.fetchall()
-    
-    # if the cart is empty, print an error message and return
-    if not items:
-        print("Cart is empty.")
-        return
-    
-    # check if the quantity of the items in the cart exceeds the available stock
-    for it in items:
-        if it["qty"] > it["stock_count"]:
-            print(f"Insufficient stock for PID {it['pid']}.")
-            return
+    # the checkout engine checks stock, writes the order and empties the cart
+    # in one IMMEDIATE transaction (retrying if another process holds the lock)
     try:
-        # fetch the maximum order number from the database and ensure uniqueness
-        cur.execute("SELECT MAX(ono) FROM orders")
-        row = cur.fetchone()
-        
-        if row and row[0] is not None:
-            ono = row[0] + 1
-        else:
-            ono = 1
-        
-        odate = datetime.now().strftime("%Y-%m-%d")
-        order_insert_params = (ono, cid, session_no, odate, address)
-        cur.execute(
-            "INSERT INTO orders(ono, cid, sessionNo, odate, shipping_address) VALUES(?,?,?,?,?)",
-            order_insert_params,
-        )
-        line_no = 1
-        # calculate the total price of the order
-        total = 0.0
-        # insert the items into the orderlines table
-        for it in items:
-            # get the product id, quantity, and price of the item
-            pid = it["pid"]
-            qty = it["qty"]
-            price = it["price"]
-            total += qty * price
-            # insert the item into the orderlines table
-            cur.execute(
-                "INSERT INTO orderlines(ono, lineNo, pid, qty, uprice) VALUES(?,?,?,?,?)",
-                (ono, line_no, pid, qty, price),
-            )
-            line_no += 1
-            # update the stock count of the product
-            cur.execute(
-                "UPDATE products SET stock_count = stock_count - ? WHERE pid = ?",
-                (qty, pid),
-            )
-        # delete the items from the cart
-        cur.execute("DELETE FROM cart WHERE cid = ? AND sessionNo = ?", (cid, session_no))
-        # commit the changes to the database
-        conn.commit()
-        print(f"Order {ono} placed. Total ${total:.2f}")
-    except Exception as e:
-        # rollback the transaction if an error occurs
-        conn.rollback()
+        with instrument.operation("checkout"):
+            order = services.checkout(conn, cid, session_no, address)
+    except (EmptyCartError, InsufficientStockError, services.ValidationError) as e:
+        print(e)
+        return
+    except (CheckoutError, sqlite3.Error) as e:
         print("Checkout failed:", e)
+        return
+    print(f"Order {order['ono']} placed. Total ${order['total']:.2f}")
 
 
 # Displays the orders of the user
-def customer_orders(conn, cid):
+def customer_orders(conn, cid, session_no):
     
-    # get the orders from the database
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT o.ono, o.odate, o.shipping_address, COALESCE(SUM(ol.qty * ol.uprice), 0) AS total
-        FROM orders o LEFT JOIN orderlines ol ON o.ono = ol.ono
-        WHERE o.cid = ?
-        GROUP BY o.ono
-        ORDER BY o.odate DESC
-        """,
-        (cid,),
-    )
-    orders = cur.fetchall()
+    # get the orders from the database one page at a time, newest first;
+    # the total is summed per shown order instead of for the whole history
+    pager = KeysetPager(conn, ORDERS_SELECT_SQL, "o.cid = ?", (cid,), keys=ORDERS_KEYS, descending=True)
+    page_items = pager.next_page()
     
     # if there are no orders, print an error message and return
-    if not orders:
+    if not page_items:
         print("No orders.")
         return
     
-    # initialize the page number
-    page = 0
-    
     # Main Loop
     while True:
-        start = page * 5
-        end = start + 5
-        page_items = orders[start:end]
-        if not page_items:
-            print("No more.")
-            break
+        page = pager.page_index
+        page_items = pager.page
         print(f"\n== Orders Page {page + 1} ==\n")
         # table header
         print("\n{:<3} {:<6} {:<12} {:<30} {:<10}".format("#", "ONO", "Date", "Address", "Total"))
@@ -480,42 +327,36 @@ def customer_orders(conn, cid):
         
         # Handle navigation options
         if selection == "n":
-            page += 1
+            if not pager.next_page():
+                print("No more.")
+                break
         elif selection == "p":
-            page = max(0, page - 1)
+            pager.prev_page()
         elif selection == "b":
             break
         elif selection.isdigit():
             index = int(selection)
             if 1 <= index <= len(page_items):
-                show_order_details(conn, page_items[index - 1]["ono"])
+                show_order_details(conn, cid, session_no, page_items[index - 1]["ono"])
             else:
                 print("Invalid selection.")
         else:
             print("Invalid input.")
 
 
-# Displays the details of an order
-def show_order_details(conn, ono):
+# Displays the details of an order and offers to put its items in the cart again
+def show_order_details(conn, cid, session_no, ono):
     cur = conn.cursor()
     
     # get the order details from the database
-    cur.execute("SELECT ono, odate, shipping_address FROM orders WHERE ono = ?", (ono,))
+    cur.execute(ORDER_HEADER_SQL, (ono,))
     o = cur.fetchone()
     if not o:
         print("Order not found.")
         return
     
     # get the order lines from the database
-    cur.execute(
-        """
-        SELECT ol.lineNo, p.name, p.category, ol.qty, ol.uprice, (ol.qty * ol.uprice) AS line_total
-        FROM orderlines ol JOIN products p ON ol.pid = p.pid
-        WHERE ol.ono = ?
-        ORDER BY ol.lineNo
-        """,
-        (ono,),
-    )
+    cur.execute(ORDER_LINES_SQL, (ono,))
     lines = cur.fetchall()
     
     # print the order details
@@ -543,6 +384,25 @@ def show_order_details(conn, ono):
     # print the grand total
     print(f"\nGrand total: ${grand:.2f}")
 
+    if lines:
+        ans = input("Reorder these items? [y/N]: ").strip().lower().replace(" ", "")
+        if ans == "y":
+            reorder(conn, cid, session_no, ono)
+
+
+# Adds every line of a past order to the cart in one step; lines that are
+# no longer available (or not in that quantity) are listed and skipped
+def reorder(conn, cid, session_no, ono):
+    try:
+        with instrument.operation("reorder"):
+            result = services.reorder(conn, cid, session_no, ono)
+    except services.NotFoundError as e:
+        print(e)
+        return
+    for skipped in result["skipped"]:
+        print(f"Skipped: {skipped['error']}")
+    print(f"{len(result['added'])} product(s) added to cart.")
+
 
 
 # Displays the customer menu
@@ -550,6 +410,8 @@ def customer_menu(conn, cid, session_no):
     
     # Main Loop
     while True:
+        # cart changes are written behind (carts.py); write the ones that waited long enough
+        carts.flush_stale(conn)
         print(f"\n=== Customer Menu (CID {cid}, Session {session_no}) ===")
         print("1) Search products")
         print("2) View cart")
@@ -558,12 +420,16 @@ def customer_menu(conn, cid, session_no):
         choice = input("Choose: ").strip().replace(" ", "")
         
         # Handle search products option
+        # statements are tagged with the action (not timed: the user is typing)
         if choice == "1":
-            customer_search(conn, cid, session_no)
+            with instrument.operation("search", timed=False):
+                customer_search(conn, cid, session_no)
         elif choice == "2":
-            customer_cart(conn, cid, session_no)
+            with instrument.operation("cart", timed=False):
+                customer_cart(conn, cid, session_no)
         elif choice == "3":
-            customer_orders(conn, cid)
+            with instrument.operation("orders", timed=False):
+                customer_orders(conn, cid, session_no)
         elif choice == "0":
             print("Logging out...")
             break
@@ -0,0 +1,347 @@
+import argparse
+import itertools
+import random
+import sys
+import time
+from array import array
+from datetime import date, timedelta
+
+import passwords
+import rollups
+from db import connect_db
+from migrations import drop_schema_objects, ensure_schema_objects, migrate
+
+# Deterministic synthetic data set for benchmarks at realistic volumes.
+#
+#   python3 datagen.py db_path [--scale small|medium|full] [--seed 1]
+#                      [--products N] [--customers N] [--views N] ...
+#
+# Fills an empty database with products, customers (and their users),
+# sessions, orders with order lines, and product-view and search events.
+# Popularity is Zipfian: a few products get most views and order lines, a
+# few customers most sessions' activity, and a few keyword combinations
+# most searches, as in real store traffic. The same seed, sizes and end
+# date always produce the same rows; each table has its own random stream,
+# so changing one size doesn't reshuffle the others.
+#
+# Events and orders are spread over the `days` days up to --end-date
+# (default today, so the weekly report sees the latest week). Every
+# customer's password is "password"; the sales user is uid 1, password
+# "sales". The schema's indexes and triggers (migrations.SCHEMA_OBJECTS)
+# are dropped during the load and recreated afterwards, together with the
+# search index, the rollups and the top-K counters; an interrupted run
+# gets them back from the next migrate().
+#
+# The benchmark suite (benchmarks/bench_suite.py) draws its requests from
+# the same distributions through popularity() and search_queries().
+
+SCALES = {
+    "small": {"products": 10_000, "customers": 5_000, "views": 200_000, "searches": 100_000, "orders": 20_000},
+    "medium": {"products": 100_000, "customers": 50_000, "views": 2_000_000, "searches": 1_000_000, "orders": 200_000},
+    "full": {"products": 1_000_000, "customers": 500_000, "views": 20_000_000, "searches": 10_000_000, "orders": 2_000_000},
+}
+
+SESSIONS_PER_CUSTOMER = 4
+DAYS = 365
+FIRST_CID = 10001
+CUSTOMER_PASSWORD = "password"
+BATCH = 100_000
+
+# Zipf exponents: how strongly popularity is skewed towards the top items
+PRODUCT_SKEW = 1.0
+CUSTOMER_SKEW = 0.8
+QUERY_SKEW = 1.1
+NUM_QUERIES = 2_000
+
+ADJECTIVES = [
+    "basic", "improved", "handy", "heavy-duty", "small", "large", "compact",
+    "wireless", "portable", "premium", "classic", "eco", "smart", "mini",
+    "rugged", "slim", "deluxe", "foldable", "vintage", "solar",
+]
+NOUNS = [
+    "widget", "gizmo", "gadget", "thing", "cable", "charger", "lamp", "desk",
+    "chair", "mouse", "keyboard", "monitor", "stand", "bottle", "mug", "pen",
+    "notebook", "backpack", "speaker", "headphones", "battery", "adapter",
+    "router", "camera", "tripod", "blender", "kettle", "toaster", "pillow",
+    "blanket", "towel", "hammer", "wrench", "drill", "saw", "glue", "tape",
+    "jacket", "tent", "lantern", "scale", "clock", "shelf", "rug", "fan",
+]
+CATEGORIES = ["gadgets", "tools", "misc", "home", "office", "outdoor", "kitchen", "garden", "sports"]
+STREETS = ["Main St", "Oak Ave", "Pine Rd", "Maple Dr", "Cedar Ln", "Elm St", "Lake Rd", "Hill Ave"]
+
+LOADED_TABLES = ("users", "customers", "products", "sessions", "orders", "orderlines", "viewedProduct", "search")
+
+
+# Random stream of one table: derived from the seed and the table name only
+def stream(seed, name):
+    return random.Random(f"{seed}:{name}")
+
+
+# Zipfian sampler over the ids first..first+n-1. Which id has which rank is
+# a seeded shuffle, so the popular ones are spread over the id range.
+class Zipf:
+    def __init__(self, n, skew, rng, first=1):
+        self.ids = list(range(first, first + n))
+        rng.shuffle(self.ids)
+        self.cum_weights = list(itertools.accumulate(1.0 / rank ** skew for rank in range(1, n + 1)))
+
+    def sample(self, rng, k=1):
+        return rng.choices(self.ids, cum_weights=self.cum_weights, k=k)
+
+
+# The product or customer popularity of a data set ("products"/"customers")
+def popularity(kind, n, seed):
+    if kind == "products":
+        return Zipf(n, PRODUCT_SKEW, stream(seed, "product popularity"))
+    return Zipf(n, CUSTOMER_SKEW, stream(seed, "customer popularity"), first=FIRST_CID)
+
+
+# The keyword combinations customers search for, and a Zipf over them
+def search_queries(seed):
+    rng = stream(seed, "queries")
+    queries = []
+    for _ in range(NUM_QUERIES):
+        words = [rng.choice(NOUNS)]
+        if rng.random() < 0.6:
+            words.insert(0, rng.choice(ADJECTIVES))
+        if rng.random() < 0.15:
+            words.append(rng.choice(NOUNS))
+        queries.append(" ".join(words))
+    return queries, Zipf(len(queries), QUERY_SKEW, rng, first=0)
+
+
+# Raises ValueError unless every loaded table is empty
+def check_empty(conn):
+    for table in LOADED_TABLES:
+        if conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+            raise ValueError(f"the database already has {table}; generate into a new file")
+
+
+# Recreates the dropped triggers and indexes (their repairs rebuild the
+# full-text index and the counters from the rows), then the rollups,
+# sequences and planner statistics
+def _resume_maintenance(conn, report):
+    start = time.perf_counter()
+    ensure_schema_objects(conn)
+    rollups.rebuild(conn)
+    for name, sql in (("orders", "SELECT MAX(ono) + 1 FROM orders"), ("users", "SELECT MAX(uid) + 1 FROM users")):
+        conn.execute(
+            f"""
+            INSERT INTO sequences(name, next_val) VALUES(?, ({sql}))
+            ON CONFLICT(name) DO UPDATE SET next_val = MAX(next_val, excluded.next_val)
+            """,
+            (name,),
+        )
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.commit()
+    report("indexes, search index, rollups, counters", 0, time.perf_counter() - start)
+
+
+# Inserts rows in committed batches of BATCH; returns the number inserted
+def _load(conn, table, sql, rows, report):
+    start = time.perf_counter()
+    loaded = 0
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, BATCH))
+        if not batch:
+            break
+        conn.executemany(sql, batch)
+        conn.commit()
+        loaded += len(batch)
+    report(table, loaded, time.perf_counter() - start)
+    return loaded
+
+
+def _products(n, seed, prices):
+    rng = stream(seed, "products")
+    for pid in range(1, n + 1):
+        adj = rng.choice(ADJECTIVES)
+        noun = rng.choice(NOUNS)
+        price = round(rng.lognormvariate(3.0, 1.0) + 1, 2)
+        prices[pid] = price
+        descr = f"{adj} {noun} with {rng.choice(NOUNS)} and {rng.choice(NOUNS)}"
+        yield pid, f"{adj} {noun} {pid}", rng.choice(CATEGORIES), price, rng.randint(0, 500), descr
+
+
+def _customers(n):
+    for i in range(n):
+        cid = FIRST_CID + i
+        email = f"customer{cid}@example.com"
+        yield cid, f"Customer {cid}", email, email
+
+
+# Session start days (as offsets into the date range), ascending per customer
+def _session_days(customers, days, seed):
+    rng = stream(seed, "sessions")
+    offsets = array("H")
+    for _ in range(customers):
+        offsets.extend(sorted(rng.randrange(days) for _ in range(SESSIONS_PER_CUSTOMER)))
+    return offsets
+
+
+def _sessions(customers, day_names, offsets):
+    for i in range(customers):
+        for s in range(SESSIONS_PER_CUSTOMER):
+            day = day_names[offsets[i * SESSIONS_PER_CUSTOMER + s]]
+            yield FIRST_CID + i, s + 1, day, day
+
+
+# (cid, sessionNo, day) of n activities, customers drawn by popularity
+def _activity(n, customers_zipf, offsets, day_names, rng):
+    done = 0
+    while done < n:
+        k = min(BATCH, n - done)
+        for cid in customers_zipf.sample(rng, k):
+            session = int(rng.random() * SESSIONS_PER_CUSTOMER)
+            yield cid, session + 1, day_names[offsets[(cid - FIRST_CID) * SESSIONS_PER_CUSTOMER + session]]
+        done += k
+
+
+# "HH:MM:SS" of every second of a day
+TIMES = [f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in range(86400)]
+
+
+def _timestamp(day, rng):
+    return day + " " + TIMES[int(rng.random() * 86400)]
+
+
+def _views(n, seed, customers_zipf, products_zipf, offsets, day_names):
+    rng = stream(seed, "views")
+    pids = iter(())
+    for cid, session, day in _activity(n, customers_zipf, offsets, day_names, rng):
+        pid = next(pids, None)
+        if pid is None:
+            pids = iter(products_zipf.sample(rng, BATCH))
+            pid = next(pids)
+        yield cid, session, _timestamp(day, rng), pid
+
+
+def _searches(n, seed, customers_zipf, offsets, day_names):
+    rng = stream(seed, "searches")
+    queries, queries_zipf = search_queries(seed)
+    for cid, session, day in _activity(n, customers_zipf, offsets, day_names, rng):
+        query = queries[queries_zipf.sample(rng)[0]]
+        # recorded queries keep the user's casing
+        if rng.random() < 0.2:
+            query = query.capitalize()
+        yield cid, session, _timestamp(day, rng), query
+
+
+def _orders(n, seed, customers_zipf, products_zipf, offsets, day_names, lines):
+    rng = stream(seed, "orders")
+    ono = 0
+    for cid, session, day in _activity(n, customers_zipf, offsets, day_names, rng):
+        ono += 1
+        address = f"{rng.randint(1, 9999)} {rng.choice(STREETS)}"
+        pids = []
+        for pid in products_zipf.sample(rng, rng.choice((1, 1, 1, 2, 2, 3, 4))):
+            if pid not in pids:
+                pids.append(pid)
+        lines.extend((ono, line_no, pid, rng.choice((1, 1, 1, 2, 3))) for line_no, pid in enumerate(pids, 1))
+        yield ono, cid, session, day, address
+
+
+# Fills the (empty, migrated) database behind conn; raises ValueError if it
+# has rows. sizes has the keys of a SCALES entry. report(table, rows,
+# seconds) is called as each step ends. Returns {table: rows}.
+def generate(conn, sizes, seed=1, days=DAYS, end_date=None, report=None):
+    report = report or (lambda table, rows, seconds: None)
+    end_date = end_date or date.today()
+    day_names = [(end_date - timedelta(days=days - 1 - i)).isoformat() for i in range(days)]
+    check_empty(conn)
+    counts = {}
+    # the per-row work of triggers and indexes is done once at the end
+    drop_schema_objects(conn, LOADED_TABLES)
+    conn.commit()
+    # one hash (with a seeded salt, so the output stays reproducible) is
+    # shared by every customer: a KDF per row would take hours at full scale
+    salts = stream(seed, "passwords")
+    customer_hash = passwords.hash_password(CUSTOMER_PASSWORD, salts.randbytes(passwords.SALT_BYTES))
+    conn.execute(
+        "INSERT OR IGNORE INTO users(uid, pwd, role) VALUES(1, ?, 'sales')",
+        (passwords.hash_password("sales", salts.randbytes(passwords.SALT_BYTES)),),
+    )
+    counts["users"] = _load(
+        conn, "users", "INSERT INTO users(uid, pwd, role) VALUES(?,?,?)",
+        ((FIRST_CID + i, customer_hash, "customer") for i in range(sizes["customers"])), report,
+    )
+    counts["customers"] = _load(
+        conn, "customers", "INSERT INTO customers(cid, name, email, email_norm) VALUES(?,?,?,?)",
+        _customers(sizes["customers"]), report,
+    )
+    prices = array("d", [0.0]) * (sizes["products"] + 1)
+    counts["products"] = _load(
+        conn, "products", "INSERT INTO products(pid, name, category, price, stock_count, descr) VALUES(?,?,?,?,?,?)",
+        _products(sizes["products"], seed, prices), report,
+    )
+    offsets = _session_days(sizes["customers"], days, seed)
+    counts["sessions"] = _load(
+        conn, "sessions", "INSERT INTO sessions(cid, sessionNo, start_time, end_time) VALUES(?,?,?,?)",
+        _sessions(sizes["customers"], day_names, offsets), report,
+    )
+    customers_zipf = popularity("customers", sizes["customers"], seed)
+    products_zipf = popularity("products", sizes["products"], seed)
+    lines = []
+    counts["orders"] = _load(
+        conn, "orders", "INSERT INTO orders(ono, cid, sessionNo, odate, shipping_address) VALUES(?,?,?,?,?)",
+        _orders(sizes["orders"], seed, customers_zipf, products_zipf, offsets, day_names, lines), report,
+    )
+    counts["orderlines"] = _load(
+        conn, "orderlines", "INSERT INTO orderlines(ono, lineNo, pid, qty, uprice) VALUES(?,?,?,?,?)",
+        ((ono, line_no, pid, qty, prices[pid]) for ono, line_no, pid, qty in lines), report,
+    )
+    del lines
+    counts["viewedProduct"] = _load(
+        conn, "viewedProduct", "INSERT INTO viewedProduct(cid, sessionNo, ts, pid) VALUES(?,?,?,?)",
+        _views(sizes["views"], seed, customers_zipf, products_zipf, offsets, day_names), report,
+    )
+    counts["search"] = _load(
+        conn, "search", "INSERT INTO search(cid, sessionNo, ts, query) VALUES(?,?,?,?)",
+        _searches(sizes["searches"], seed, customers_zipf, offsets, day_names), report,
+    )
+    _resume_maintenance(conn, report)
+    return counts
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Generate a synthetic store database")
+    parser.add_argument("db_path", help="new (or empty) database file")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    for key in SCALES["small"]:
+        parser.add_argument(f"--{key}", type=int, default=None, help=f"override the scale's number of {key}")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--days", type=int, default=DAYS, help="days of history")
+    parser.add_argument("--end-date", type=date.fromisoformat, default=None, help="last day of history (default: today)")
+    return parser.parse_args(argv)
+
+
+def print_step(table, rows, seconds):
+    if rows:
+        print(f"{table:<14} {rows:>12,} rows in {seconds:7.1f}s ({rows / max(seconds, 1e-9):>10,.0f} rows/s)", flush=True)
+    else:
+        print(f"{table} rebuilt in {seconds:.1f}s", flush=True)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    sizes = dict(SCALES[args.scale])
+    for key in sizes:
+        if getattr(args, key) is not None:
+            sizes[key] = getattr(args, key)
+    conn = connect_db(args.db_path, profile="bulk-load")
+    migrate(conn)
+    try:
+        check_empty(conn)
+    except ValueError as e:
+        print(f"{args.db_path}: {e}", file=sys.stderr)
+        sys.exit(2)
+    start = time.perf_counter()
+    counts = generate(conn, sizes, args.seed, args.days, args.end_date, report=print_step)
+    conn.close()
+    print(f"done in {time.perf_counter() - start:.1f}s: " + ", ".join(f"{k} {v:,}" for k, v in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
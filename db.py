@@ -1,157 +1,123 @@
 import os
+import pathlib
 import sqlite3
-import hashlib
+
+import instrument
+import passwords
+from migrations import migrate
 
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "ecommerce.db")
 
 
-def connect_db(db_path=None):
+# Named connection profiles: the PRAGMAs applied by connect_db.
+#   oltp      - interactive CLI use: WAL so readers and the writer don't block
+#               each other, NORMAL sync (safe in WAL), modest cache/mmap
+#   reporting - long read queries: bigger cache and mmap, long busy timeout
+#   bulk-load - imports/rebuilds: no fsync per commit, large cache
+#   legacy    - the old settings (rollback journal, FULL sync, defaults)
+# cache_size is negative to mean KiB rather than pages.
+PROFILES = {
+    "oltp": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+    "reporting": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 1024 * 1024 * 1024,
+        "cache_size": -256 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 30000,
+    },
+    "bulk-load": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "mmap_size": 1024 * 1024 * 1024,
+        "cache_size": -512 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 60000,
+    },
+    "legacy": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "mmap_size": 0,
+        "cache_size": -2000,
+        "temp_store": "DEFAULT",
+        "busy_timeout": 5000,
+    },
+}
+
+DEFAULT_PROFILE = os.environ.get("COMMERCE_DB_PROFILE", "oltp")
+
+
+# Applies a named profile's PRAGMAs to an open connection
+def apply_profile(conn, profile):
+    if profile not in PROFILES:
+        raise ValueError(f"unknown connection profile {profile!r}, expected one of {sorted(PROFILES)}")
+    settings = PROFILES[profile]
+    for pragma in ("busy_timeout", "synchronous", "mmap_size", "cache_size", "temp_store"):
+        conn.execute(f"PRAGMA {pragma} = {settings[pragma]}")
+    # journal_mode is a property of the database file (in-memory databases
+    # ignore WAL). Leaving WAL needs exclusive access, so if other connections
+    # have the file open we keep whatever mode it is in.
+    try:
+        conn.execute(f"PRAGMA journal_mode = {settings['journal_mode']}")
+    except sqlite3.OperationalError:
+        pass
+
+
+# read_only opens the file with a mode=ro URI and sets query_only, so the
+# connection can never take a write lock (see pool.py). cached_statements
+# sizes the per-connection prepared statement cache (sqlite3's default: 128).
+def connect_db(db_path=None, profile=None, read_only=False, cached_statements=128, check_same_thread=True):
     path = db_path or DB_PATH
-    conn = sqlite3.connect(path)
+    if read_only:
+        if path == ":memory:":
+            raise ValueError("an in-memory database can't be opened read-only")
+        target = pathlib.Path(os.path.abspath(path)).as_uri() + "?mode=ro"
+    else:
+        target = path
+    # plain sqlite3 connections unless instrumentation is on (instrument.py)
+    conn = sqlite3.connect(
+        target,
+        uri=read_only,
+        cached_statements=cached_statements,
+        check_same_thread=check_same_thread,
+        factory=instrument.connection_factory(),
+    )
     conn.row_factory = sqlite3.Row
     # Enforce foreign key constraints declared in schema
     conn.execute("PRAGMA foreign_keys = ON")
+    apply_profile(conn, profile or DEFAULT_PROFILE)
+    if read_only:
+        conn.execute("PRAGMA query_only = ON")
     return conn
 
 
+# Returns the file behind the main database of conn ("" for in-memory databases)
+def db_file(conn):
+    for row in conn.execute("PRAGMA database_list"):
+        if row[1] == "main":
+            return row[2] or ""
+    return ""
+
+
+# Creates or upgrades the schema (see migrations.py) and seeds the demo data
+# into an empty database. Existing data is never dropped.
 def init_db(conn):
+    migrate(conn)
     cur = conn.cursor()
-    # Drop existing tables to reset schema
-    cur.execute("drop table if exists orderlines")
-    cur.execute("drop table if exists orders")
-    cur.execute("drop table if exists cart")
-    cur.execute("drop table if exists search")
-    cur.execute("drop table if exists viewedProduct")
-    cur.execute("drop table if exists sessions")
-    cur.execute("drop table if exists products")
-    cur.execute("drop table if exists customers")
-    cur.execute("drop table if exists users")
-    # good
-    cur.execute(
-        """
-        create table users (
-            uid		int,
-            pwd		text,
-            role		text,
-            primary key (uid)
-        )
-        """
-    )
-    # good
-    cur.execute(
-        """
-        create table customers (
-            cid		int,
-            name		text, 
-            email		text,
-            primary key (cid),
-            foreign key (cid) references users
-        )
-        """
-    )
-    # good
-    cur.execute(
-        """
-        create table products (
-            pid		int, 
-            name		text, 
-            category	text, 
-            price		float, 
-            stock_count	int, 
-            descr		text,
-            primary key (pid)
-        )
-        """
-    )
-    # probably shud have ono and cid and sessionNo as primary key
-    # and have a foreign key constraint to the orders table
-    # Create sessions before orders to satisfy FKs
-    cur.execute(
-        """
-        create table sessions (
-            cid		int,
-            sessionNo	int, 
-            start_time	datetime, 
-            end_time	datetime,
-            primary key (cid, sessionNo),
-            foreign key (cid) references customers on delete cascade
-        )
-        """
-    )
-    cur.execute(
-        """
-        create table viewedProduct (
-            cid		int, 
-            sessionNo	int, 
-            ts		timestamp, 
-            pid		int,
-            primary key (cid, sessionNo, ts),
-            foreign key (cid, sessionNo) references sessions,
-            foreign key (pid) references products
-        )
-        """
-    )
-    cur.execute(
-        """
-        create table search (
-            cid		int, 
-            sessionNo	int, 
-            ts		timestamp, 
-            query		text,
-            primary key (cid, sessionNo, ts),
-            foreign key (cid, sessionNo) references sessions
-        )
-        """
-    )
-    cur.execute(
-        """
-        create table cart (
-            cid		int, 
-            sessionNo	int, 
-            pid		int,
-            qty		int,
-            primary key (cid, sessionNo, pid),
-            foreign key (cid, sessionNo) references sessions,
-            foreign key (pid) references products
-        )
-        """
-    )
-    cur.execute(
-        """
-        create table orders (
-            ono		int, 
-            cid		int,
-            sessionNo	int,
-            odate		date, 
-            shipping_address text,
-            primary key (ono),
-            foreign key (cid, sessionNo) references sessions
-        )
-        """
-    )
-    cur.execute(
-        """
-        create table orderlines (
-            ono		int, 
-            lineNo	int, 
-            pid		int, 
-            qty		int, 
-            uprice	float, 
-            primary key (ono, lineNo),
-            foreign key (ono) references orders on delete cascade
-        )
-        """
-    )
-    
-    
-    
 
     cur.execute("SELECT COUNT(*) AS c FROM users")
     if cur.fetchone()[0] == 0:
         cur.execute(
             "INSERT INTO users(uid, pwd, role) VALUES(?,?,?)",
-            (1, hashlib.sha256("sales".encode("utf-8")).hexdigest(), "sales"),
+            (1, passwords.hash_password("sales"), "sales"),
         )
 
     cur.execute("SELECT COUNT(*) AS c FROM products")
@@ -170,5 +136,3 @@ def init_db(conn):
         )
 
     conn.commit()
-
-
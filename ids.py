@@ -0,0 +1,65 @@
+import os
+import threading
+
+from db import db_file
+
+# Concurrency-safe id allocation for orders.ono and users.uid.
+# The next free value of each sequence lives in the `sequences` table. A
+# process reserves a whole block of ids in one short BEGIN IMMEDIATE
+# transaction and then hands them out from memory, so concurrent CLI
+# processes never see the same MAX()+1 and only touch the table once per
+# block. Ids left unused in a block when a process exits are skipped.
+
+BLOCK_SIZE = int(os.environ.get("COMMERCE_ID_BLOCK", "10"))
+
+# first value for a sequence that has no row yet, derived from existing data
+SEEDS = {
+    "orders": "SELECT COALESCE(MAX(ono), 0) + 1 FROM orders",
+    "users": "SELECT COALESCE(MAX(uid) + 1, 10001) FROM users",
+}
+
+NEXT_VAL_SQL = "SELECT next_val FROM sequences WHERE name = ?"
+
+# (pid, db file, sequence name) -> [next id, end of block)
+_blocks = {}
+_lock = threading.Lock()
+
+
+# Reserves `size` ids from the sequences table in its own transaction and
+# returns the first one. Must not be called with a transaction open on conn.
+def reserve_block(conn, name, size):
+    if conn.in_transaction:
+        raise RuntimeError("reserve_block() needs a connection with no open transaction")
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            f"INSERT OR IGNORE INTO sequences(name, next_val) VALUES(?, ({SEEDS[name]}))",
+            (name,),
+        )
+        start = conn.execute(NEXT_VAL_SQL, (name,)).fetchone()[0]
+        conn.execute("UPDATE sequences SET next_val = next_val + ? WHERE name = ?", (size, name))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return start
+
+
+# Returns the next id of sequence `name` ("orders" or "users")
+def next_id(conn, name, block_size=BLOCK_SIZE):
+    path = db_file(conn)
+    if not path:
+        # in-memory databases have no name to key a block by (and an id(conn)
+        # can be reused by a later connection): reserve one id at a time
+        return reserve_block(conn, name, 1)
+    # the pid is part of the key so forked children never reuse a parent's block
+    key = (os.getpid(), path, name)
+    with _lock:
+        block = _blocks.get(key)
+        if block is None or block[0] >= block[1]:
+            start = reserve_block(conn, name, block_size)
+            block = [start, start + block_size]
+            _blocks[key] = block
+        value = block[0]
+        block[0] += 1
+    return value
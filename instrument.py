@@ -0,0 +1,438 @@
+import atexit
+import bisect
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+# Per-statement timing for every SQLite connection opened by connect_db.
+#
+# When enabled, connections are created with an instrumented connection
+# class whose cursors time each execute and fetch. Per (operation,
+# statement) it keeps a latency histogram, the call count and the rows
+# returned (or changed, for writes); commits are timed as the "COMMIT"
+# statement, so fsync cost shows up there. The operation is a logical tag
+# (search, view, add_to_cart, checkout, weekly_report, ...) set with
+#   with instrument.operation("checkout"):
+#       ...
+# services.dispatch tags every scripted/server command with its op name, and
+# the CLI menus tag their actions. Statements run outside any operation
+# are counted under "-".
+#
+# Disabled (the default) connect_db opens plain sqlite3 connections and
+# operation() returns a shared no-op, so the only cost is that call.
+#
+#   COMMERCE_INSTRUMENT=1            turn it on (or call enable() before connecting)
+#   COMMERCE_INSTRUMENT_DUMP=path    write the metrics at exit (.prom -> Prometheus text, else JSON)
+#   COMMERCE_SLOW_QUERY_MS=n         log statements taking longer than n ms ...
+#   COMMERCE_SLOW_QUERY_LOG=path     ... as JSON lines with their query plan (default: stderr)
+#
+# Metrics are available on demand via snapshot(), to_json(), to_prometheus()
+# and dump(), from the sales menu ("Query timing statistics") and from the
+# server ({"op": "metrics"}).
+
+# histogram bucket upper bounds, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+NO_OPERATION = "-"
+
+_enabled = os.environ.get("COMMERCE_INSTRUMENT", "") not in ("", "0")
+_slow_seconds = None
+_slow_log = None
+_local = threading.local()
+_lock = threading.Lock()
+# (operation, statement) -> Stat
+_stats = {}
+# operation -> Stat of whole-operation times
+_operations = {}
+# raw sql -> normalized statement text
+_normalized = {}
+MAX_NORMALIZED = 4096
+
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACES = re.compile(r"\s+")
+_EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+class Stat:
+    __slots__ = ("count", "total", "max", "rows", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, seconds, rows=0):
+        self.count += 1
+        self.total += seconds
+        self.rows += rows
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    # Upper bound of the bucket holding the p-th quantile
+    def quantile(self, p):
+        if not self.count:
+            return 0.0
+        target = p * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS + (self.max,), self.buckets):
+            seen += n
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1000,
+            "avg_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "p50_ms": self.quantile(0.5) * 1000,
+            "p99_ms": self.quantile(0.99) * 1000,
+            "max_ms": self.max * 1000,
+            "rows": self.rows,
+            "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], self.buckets)),
+        }
+
+
+def enabled():
+    return _enabled
+
+
+# Turns instrumentation on for connections opened from now on. slow_ms and
+# slow_log set up the slow-query log (slow_log is a path or a file object).
+def enable(slow_ms=None, slow_log=None):
+    global _enabled, _slow_seconds, _slow_log
+    _enabled = True
+    if slow_ms is not None:
+        _slow_seconds = slow_ms / 1000
+        _slow_log = slow_log
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+        _operations.clear()
+
+
+# The sqlite3.connect factory for connect_db
+def connection_factory():
+    return InstrumentedConnection if _enabled else Connection
+
+
+def current_operation():
+    return getattr(_local, "operation", NO_OPERATION)
+
+
+class _Operation:
+    __slots__ = ("name", "timed", "previous", "start")
+
+    def __init__(self, name, timed):
+        self.name = name
+        self.timed = timed
+
+    def __enter__(self):
+        self.previous = current_operation()
+        _local.operation = self.name
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _local.operation = self.previous
+        if self.timed:
+            elapsed = time.perf_counter() - self.start
+            with _lock:
+                stat = _operations.get(self.name)
+                if stat is None:
+                    stat = _operations[self.name] = Stat()
+                stat.add(elapsed)
+
+
+class _NoOperation:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_OPERATION = _NoOperation()
+
+
+# Tags the statements run inside the with block with a logical operation
+# name. timed=False only tags: for CLI actions, whose wall time is mostly
+# the user typing.
+def operation(name, timed=True):
+    if not _enabled:
+        return _NO_OPERATION
+    return _Operation(name, timed)
+
+
+# Collapses whitespace and IN (?,?,...) lists so one statement is one key
+def normalize(sql):
+    text = _normalized.get(sql)
+    if text is None:
+        text = _IN_LIST.sub("(?...)", _SPACES.sub(" ", sql).strip())
+        if len(_normalized) >= MAX_NORMALIZED:
+            _normalized.clear()
+        _normalized[sql] = text
+    return text
+
+
+def record(sql, seconds, rows=0, operation=None):
+    key = (operation or current_operation(), normalize(sql))
+    with _lock:
+        stat = _stats.get(key)
+        if stat is None:
+            stat = _stats[key] = Stat()
+        stat.add(seconds, rows)
+
+
+# ---- slow-query log ----
+
+def _query_plan(conn, sql, params):
+    if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+        return None
+    try:
+        cur = sqlite3.Cursor(conn)
+        rows = cur.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    except sqlite3.Error as e:
+        return [f"(no plan: {e})"]
+    return [row[3] for row in rows]
+
+
+def _log_slow(conn, operation, sql, params, seconds):
+    entry = {
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "operation": operation,
+        "ms": round(seconds * 1000, 3),
+        "sql": normalize(sql),
+        "plan": _query_plan(conn, sql, params),
+    }
+    line = json.dumps(entry) + "\n"
+    with _lock:
+        if _slow_log is None:
+            sys.stderr.write(line)
+        elif isinstance(_slow_log, str):
+            with open(_slow_log, "a", encoding="utf-8") as f:
+                f.write(line)
+        else:
+            _slow_log.write(line)
+            _slow_log.flush()
+
+
+# Times each execution from execute() until its rows are exhausted, the
+# cursor is re-executed, closed or dropped; then records it once under the
+# operation that was current when it started.
+class InstrumentedCursor(sqlite3.Cursor):
+    _sql = None
+    _params = ()
+    _operation = NO_OPERATION
+    _elapsed = 0.0
+    _rows = 0
+
+    def _start(self, sql, parameters):
+        if self._sql is not None:
+            self._finish()
+        self._sql, self._params, self._elapsed, self._rows = sql, parameters, 0.0, 0
+        self._operation = current_operation()
+
+    def _finish(self):
+        sql, self._sql = self._sql, None
+        if sql is None:
+            return
+        record(sql, self._elapsed, self._rows, self._operation)
+        if _slow_seconds is not None and self._elapsed >= _slow_seconds:
+            _log_slow(self.connection, self._operation, sql, self._params, self._elapsed)
+
+    def _executed(self, start):
+        self._elapsed += time.perf_counter() - start
+        if self.description is None:
+            # a write (or BEGIN/COMMIT): done once executed
+            self._rows = max(self.rowcount, 0)
+            self._finish()
+
+    def execute(self, sql, parameters=()):
+        self._start(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._executed(start)
+
+    def executemany(self, sql, seq_of_parameters):
+        # only the first parameter set goes to the slow-query plan
+        seq_of_parameters = iter(seq_of_parameters)
+        first = next(seq_of_parameters, None)
+        self._start(sql, first or ())
+        start = time.perf_counter()
+        try:
+            if first is None:
+                return super().executemany(sql, [])
+            return super().executemany(sql, _chain(first, seq_of_parameters))
+        finally:
+            self._executed(start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        if self._sql is not None:
+            self._elapsed += time.perf_counter() - start
+            if row is None:
+                self._finish()
+            else:
+                self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        if self._sql is not None:
+            self._elapsed += time.perf_counter() - start
+            self._rows += len(rows)
+            if len(rows) < size:
+                self._finish()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        if self._sql is not None:
+            self._elapsed += time.perf_counter() - start
+            self._rows += len(rows)
+            self._finish()
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            if self._sql is not None:
+                self._elapsed += time.perf_counter() - start
+                self._finish()
+            raise
+        if self._sql is not None:
+            self._elapsed += time.perf_counter() - start
+            self._rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+def _chain(first, rest):
+    yield first
+    yield from rest
+
+
+# The connections connect_db opens when instrumentation is off: plain
+# sqlite3 connections, subclassed only so modules can keep per-connection
+# state on them (search_index remembers whether the database has its index)
+class Connection(sqlite3.Connection):
+    pass
+
+
+class InstrumentedConnection(Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # sqlite3's own shortcuts create plain cursors; these time them too
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            record("COMMIT", time.perf_counter() - start)
+
+
+# ---- reporting ----
+
+def snapshot():
+    with _lock:
+        statements = [
+            dict(operation=op, statement=sql, **stat.as_dict()) for (op, sql), stat in _stats.items()
+        ]
+        operations = {name: stat.as_dict() for name, stat in _operations.items()}
+    statements.sort(key=lambda s: s["total_ms"], reverse=True)
+    return {"enabled": _enabled, "operations": operations, "statements": statements}
+
+
+def to_json():
+    return json.dumps(snapshot(), indent=2)
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _histogram(lines, name, labels, stat):
+    cumulative = 0
+    for bound, n in zip([repr(b) for b in BUCKETS] + ["+Inf"], stat.buckets):
+        cumulative += n
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f"{name}_sum{{{labels}}} {stat.total!r}")
+    lines.append(f"{name}_count{{{labels}}} {stat.count}")
+
+
+# Prometheus text exposition format
+def to_prometheus():
+    with _lock:
+        statements = sorted(_stats.items())
+        operations = sorted(_operations.items())
+    lines = [
+        "# HELP commerce_sql_seconds SQLite statement latency (execute and fetch).",
+        "# TYPE commerce_sql_seconds histogram",
+    ]
+    for (op, sql), stat in statements:
+        _histogram(lines, "commerce_sql_seconds", f'operation="{_label(op)}",statement="{_label(sql)}"', stat)
+    lines.append("# HELP commerce_sql_rows_total Rows returned by (or changed by) a statement.")
+    lines.append("# TYPE commerce_sql_rows_total counter")
+    for (op, sql), stat in statements:
+        lines.append(f'commerce_sql_rows_total{{operation="{_label(op)}",statement="{_label(sql)}"}} {stat.rows}')
+    lines.append("# HELP commerce_operation_seconds Latency of a whole logical operation.")
+    lines.append("# TYPE commerce_operation_seconds histogram")
+    for name, stat in operations:
+        _histogram(lines, "commerce_operation_seconds", f'operation="{_label(name)}"', stat)
+    return "\n".join(lines) + "\n"
+
+
+# Writes the metrics to path: Prometheus text for *.prom, JSON otherwise
+def dump(path):
+    text = to_prometheus() if path.endswith(".prom") else to_json()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+if os.environ.get("COMMERCE_SLOW_QUERY_MS"):
+    _slow_seconds = float(os.environ["COMMERCE_SLOW_QUERY_MS"]) / 1000
+    _slow_log = os.environ.get("COMMERCE_SLOW_QUERY_LOG") or None
+
+if _enabled and os.environ.get("COMMERCE_INSTRUMENT_DUMP"):
+    atexit.register(dump, os.environ["COMMERCE_INSTRUMENT_DUMP"])
@@ -0,0 +1,489 @@
+import re
+import time
+
+import product_cache
+import rollups
+import topk
+from search_cache import BUMP_VERSION_SQL, CATALOG_VERSION_TRIGGERS, create_catalog_version
+from search_index import FTS_TABLE, FTS_TRIGGERS, REBUILD_SQL, ensure_search_index
+
+# Versioned, non-destructive schema migrations.
+# PRAGMA user_version records the last migration applied to a database
+# file; migrate() runs only the steps after it, in order, and bumps
+# user_version after each one. Steps must be idempotent (a database
+# created before versioning starts at 0 but may already have some of the
+# objects) and must never drop user data. Large-table backfills go through
+# backfill(), which commits in rowid batches so other connections can keep
+# working while an upgrade runs.
+#
+#   python3 migrations.py [db_path]     # show status and apply pending steps
+
+BACKFILL_BATCH = 50000
+
+# Event tables: eid is an INTEGER PRIMARY KEY (rowid alias) handed out by
+# SQLite in increasing order, so any number of events can share a timestamp
+# and bulk inserts never collide. (The old (cid, sessionNo, ts) key with
+# one-second ts made two views in the same second an IntegrityError.)
+VIEWED_PRODUCT_SQL = """
+        create table {name} (
+            eid		integer primary key,
+            cid		int, 
+            sessionNo	int, 
+            ts		timestamp, 
+            pid		int,
+            foreign key (cid, sessionNo) references sessions,
+            foreign key (pid) references products
+        )
+        """
+
+SEARCH_SQL = """
+        create table {name} (
+            eid		integer primary key,
+            cid		int, 
+            sessionNo	int, 
+            ts		timestamp, 
+            query		text,
+            foreign key (cid, sessionNo) references sessions
+        )
+        """
+
+EVENT_TABLES = [
+    ("viewedProduct", VIEWED_PRODUCT_SQL, "cid, sessionNo, ts, pid"),
+    ("search", SEARCH_SQL, "cid, sessionNo, ts, query"),
+]
+
+
+# Secondary indexes for the hot queries (checked by query_plans.py).
+# The customers email index is created by _add_email_norm, once the column
+# exists.
+INDEXES = [
+    "create index if not exists idx_orders_cid on orders(cid, odate, ono)",
+    "create index if not exists idx_orders_odate on orders(odate, cid)",
+    "create index if not exists idx_orderlines_pid on orderlines(pid, ono)",
+    "create index if not exists idx_viewedproduct_pid on viewedProduct(pid)",
+    "create index if not exists idx_cart_pid on cart(pid)",
+]
+
+# Sequence counters used by ids.py to hand out order numbers and user ids
+SEQUENCES_SQL = """
+        create table if not exists sequences (
+            name		text,
+            next_val	int,
+            primary key (name)
+        )
+        """
+
+
+# Creates the original nine tables (activity tables in their current form)
+def _create_base_schema(conn):
+    cur = conn.cursor()
+    # good
+    cur.execute(
+        """
+        create table if not exists users (
+            uid		int,
+            pwd		text,
+            role		text,
+            primary key (uid)
+        )
+        """
+    )
+    # good
+    cur.execute(
+        """
+        create table if not exists customers (
+            cid		int,
+            name		text, 
+            email		text,
+            primary key (cid),
+            foreign key (cid) references users
+        )
+        """
+    )
+    # good
+    cur.execute(
+        """
+        create table if not exists products (
+            pid		int, 
+            name		text, 
+            category	text, 
+            price		float, 
+            stock_count	int, 
+            descr		text,
+            primary key (pid)
+        )
+        """
+    )
+    # probably shud have ono and cid and sessionNo as primary key
+    # and have a foreign key constraint to the orders table
+    # Create sessions before orders to satisfy FKs
+    cur.execute(
+        """
+        create table if not exists sessions (
+            cid		int,
+            sessionNo	int, 
+            start_time	datetime, 
+            end_time	datetime,
+            primary key (cid, sessionNo),
+            foreign key (cid) references customers on delete cascade
+        )
+        """
+    )
+    # activity tables are append-only event logs keyed by a sequence id
+    cur.execute(VIEWED_PRODUCT_SQL.format(name="viewedProduct").replace("create table", "create table if not exists", 1))
+    cur.execute(SEARCH_SQL.format(name="search").replace("create table", "create table if not exists", 1))
+    cur.execute(
+        """
+        create table if not exists cart (
+            cid		int, 
+            sessionNo	int, 
+            pid		int,
+            qty		int,
+            primary key (cid, sessionNo, pid),
+            foreign key (cid, sessionNo) references sessions,
+            foreign key (pid) references products
+        )
+        """
+    )
+    cur.execute(
+        """
+        create table if not exists orders (
+            ono		int, 
+            cid		int,
+            sessionNo	int,
+            odate		date, 
+            shipping_address text,
+            primary key (ono),
+            foreign key (cid, sessionNo) references sessions
+        )
+        """
+    )
+    cur.execute(
+        """
+        create table if not exists orderlines (
+            ono		int, 
+            lineNo	int, 
+            pid		int, 
+            qty		int, 
+            uprice	float, 
+            primary key (ono, lineNo),
+            foreign key (ono) references orders on delete cascade
+        )
+        """
+    )
+    conn.commit()
+
+
+# Rebuilds viewedProduct/search from the old (cid, sessionNo, ts) primary key
+# to the eid sequence key. Existing rows are copied in timestamp order so the
+# new ids follow the original event order.
+def migrate_event_tables(conn):
+    for table, create_sql, columns in EVENT_TABLES:
+        cols = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        if not cols or "eid" in cols:
+            continue
+        # one transaction, so a crash leaves either the old or the new table
+        conn.commit()
+        conn.execute("BEGIN")
+        try:
+            conn.execute(create_sql.format(name=f"{table}_new"))
+            conn.execute(
+                f"INSERT INTO {table}_new({columns}) SELECT {columns} FROM {table} ORDER BY ts, cid, sessionNo"
+            )
+            conn.execute(f"DROP TABLE {table}")
+            conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+# Creates any missing secondary index. PRAGMA optimize refreshes planner
+# statistics only for tables that need it, so it stays cheap on startup.
+def ensure_indexes(conn):
+    for index_sql in INDEXES:
+        conn.execute(index_sql)
+    conn.commit()
+    conn.execute("PRAGMA optimize")
+
+
+def _create_sequences(conn):
+    conn.execute(SEQUENCES_SQL)
+    conn.commit()
+
+
+# Daily sales rollups, filled from the orders already in the database
+def _create_sales_rollups(conn):
+    rollups.create_rollup_tables(conn)
+    rollups.rebuild(conn)
+
+
+# Per-product order/view counters for top-K reports, filled from existing rows
+def _create_product_counters(conn):
+    topk.create_counters(conn)
+    topk.rebuild(conn)
+
+
+# Runs `UPDATE table SET set_sql WHERE where_sql` in rowid batches of
+# batch_size rows, committing after each batch. where_sql should exclude rows
+# that were already backfilled so an interrupted run can simply be repeated.
+# Returns the number of rows updated.
+def backfill(conn, table, set_sql, where_sql="1", params=(), batch_size=BACKFILL_BATCH):
+    max_rowid = conn.execute(f"SELECT MAX(rowid) FROM {table}").fetchone()[0]
+    if max_rowid is None:
+        return 0
+    updated = 0
+    low = conn.execute(f"SELECT MIN(rowid) FROM {table}").fetchone()[0] - 1
+    while low < max_rowid:
+        high = low + batch_size
+        cur = conn.execute(
+            f"UPDATE {table} SET {set_sql} WHERE rowid > ? AND rowid <= ? AND ({where_sql})",
+            (*params, low, high),
+        )
+        updated += cur.rowcount
+        conn.commit()
+        low = high
+    return updated
+
+
+# Login and signup look customers up by email case-insensitively. The
+# lowercased address is stored in email_norm (set by services.create_customer
+# with services.normalize_email, which folds like lower(trim()), or by the
+# triggers below for rows inserted or changed by other code), so
+# the lookup is a plain indexed equality on one column.
+EMAIL_NORM_INDEX = "create index if not exists idx_customers_email_norm on customers(email_norm)"
+
+EMAIL_NORM_TRIGGERS = [
+    """
+    create trigger if not exists customers_email_norm_insert after insert on customers
+    when new.email_norm is null and new.email is not null
+    begin
+        update customers set email_norm = lower(trim(new.email)) where cid = new.cid;
+    end
+    """,
+    """
+    create trigger if not exists customers_email_norm_update after update of email on customers
+    begin
+        update customers set email_norm = lower(trim(new.email)) where cid = new.cid;
+    end
+    """,
+]
+
+# Adds and backfills customers.email_norm, indexes it and drops the old
+# expression index on lower(email)
+def _add_email_norm(conn):
+    cols = [row[1] for row in conn.execute("PRAGMA table_info(customers)")]
+    if "email_norm" not in cols:
+        conn.execute("ALTER TABLE customers ADD COLUMN email_norm text")
+        conn.commit()
+    backfill(conn, "customers", "email_norm = lower(trim(email))", "email_norm IS NULL AND email IS NOT NULL")
+    conn.execute(EMAIL_NORM_INDEX)
+    for trigger_sql in EMAIL_NORM_TRIGGERS:
+        conn.execute(trigger_sql)
+    conn.execute("DROP INDEX IF EXISTS idx_customers_email")
+    conn.commit()
+    conn.execute("PRAGMA optimize")
+
+
+# Records which process runs a session (carts.recover only takes over the
+# cart of a session whose process is gone). Older sessions have no owner.
+def _add_session_owner(conn):
+    cols = [row[1] for row in conn.execute("PRAGMA table_info(sessions)")]
+    if "owner" not in cols:
+        conn.execute("ALTER TABLE sessions ADD COLUMN owner text")
+    conn.commit()
+
+
+# Tables whose SCHEMA_OBJECTS a bulk load dropped (drop_schema_objects) and
+# that still need them put back and repaired (ensure_schema_objects). The
+# row is committed before the first loaded batch, so a load that dies
+# halfway is finished by the next migrate(), even if something recreated
+# the objects in between.
+DEFERRED_MAINTENANCE_SQL = """
+    create table if not exists deferred_maintenance (
+        tbl		text,
+        since		text,
+        primary key (tbl)
+    )
+    """
+
+
+def _create_deferred_maintenance(conn):
+    conn.execute(DEFERRED_MAINTENANCE_SQL)
+    conn.commit()
+
+
+# (version, description, step) -- append new steps at the end, never renumber
+MIGRATIONS = [
+    (1, "base schema", _create_base_schema),
+    (2, "event tables keyed by eid", migrate_event_tables),
+    (3, "sequences table", _create_sequences),
+    (4, "products full-text index", ensure_search_index),
+    (5, "secondary indexes", ensure_indexes),
+    (6, "daily sales rollups", _create_sales_rollups),
+    (7, "product order/view counters", _create_product_counters),
+    (8, "catalog version counter", create_catalog_version),
+    (9, "normalized customer email", _add_email_norm),
+    (10, "session owner", _add_session_owner),
+    (11, "view counters kept by the activity writer", topk.drop_view_trigger),
+    (12, "deferred maintenance markers", _create_deferred_maintenance),
+    (13, "products version counter", product_cache.create_products_version),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _rebuild_search_index(conn):
+    conn.execute(REBUILD_SQL)
+
+
+def _bump_catalog_version(conn):
+    conn.execute(BUMP_VERSION_SQL)
+
+
+def _bump_products_version(conn):
+    conn.execute(product_cache.BUMP_VERSION_SQL)
+
+
+def _renormalize_emails(conn):
+    conn.execute("UPDATE customers SET email_norm = lower(trim(email)) WHERE email_norm IS NOT lower(trim(email))")
+
+
+_OBJECT_RE = re.compile(r"create\s+(?:index|trigger)\s+if\s+not\s+exists\s+(\w+)\s.*?\bon\s+(\w+)", re.I | re.S)
+
+
+# [(name, table, sql)] of index/trigger statements
+def _objects(statements):
+    return [_OBJECT_RE.search(sql).groups() + (sql,) for sql in statements]
+
+
+def _is_trigger(sql):
+    return sql.lstrip().lower().startswith("create trigger")
+
+
+# Triggers and secondary indexes by the migration that creates them, with
+# what has to be redone when a trigger was missing (rows written meanwhile
+# were not maintained) and the table the group needs, if any. Bulk loads
+# drop some of them for the duration of a load (drop_schema_objects) and
+# put them back with ensure_schema_objects, which migrate() also runs on
+# every start: a load that never finished is repaired by the next start
+# (deferred_maintenance records which tables it left).
+SCHEMA_OBJECTS = [
+    (4, _objects(FTS_TRIGGERS), _rebuild_search_index, FTS_TABLE),
+    (5, _objects(INDEXES), None, None),
+    (7, _objects([sql for sql in topk.COUNTER_TABLES if "index" in sql[:20]] + topk.COUNTER_TRIGGERS),
+     topk.rebuild, None),
+    (8, _objects(CATALOG_VERSION_TRIGGERS), _bump_catalog_version, None),
+    (9, _objects([EMAIL_NORM_INDEX] + EMAIL_NORM_TRIGGERS), _renormalize_emails, None),
+    (13, _objects(product_cache.PRODUCTS_VERSION_TRIGGERS), _bump_products_version, None),
+]
+
+
+# The SCHEMA_OBJECTS groups this database has (optionally only the objects
+# on `tables`): [(objects, repair)]
+def _schema_objects(conn, tables=None):
+    version = schema_version(conn)
+    names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+    groups = []
+    for min_version, objects, repair, needs in SCHEMA_OBJECTS:
+        if version < min_version or (needs is not None and needs not in names):
+            continue
+        objects = [obj for obj in objects if tables is None or obj[1] in tables]
+        if objects:
+            groups.append(([obj + (obj[0] in names,) for obj in objects], repair))
+    return groups
+
+
+# Tables a bulk load left with their SCHEMA_OBJECTS dropped
+def _deferred_tables(conn):
+    if schema_version(conn) < 12:
+        return set()
+    return {row[0] for row in conn.execute("SELECT tbl FROM deferred_maintenance")}
+
+
+# Creates every missing trigger and index of SCHEMA_OBJECTS and redoes what
+# a missing trigger, or a bulk load that dropped it, left undone. Does not
+# commit, so a bulk load can put back what it dropped in its last
+# transaction. Returns the names created.
+def ensure_schema_objects(conn, tables=None):
+    deferred = _deferred_tables(conn)
+    if tables is not None:
+        deferred &= set(tables)
+    created = []
+    for objects, repair in _schema_objects(conn, tables):
+        missing = [(name, sql) for name, table, sql, exists in objects if not exists]
+        for name, sql in missing:
+            conn.execute(sql)
+            created.append(name)
+        if repair is not None and (
+            any(_is_trigger(sql) for _, sql in missing) or any(obj[1] in deferred for obj in objects)
+        ):
+            repair(conn)
+    if deferred:
+        conn.executemany("DELETE FROM deferred_maintenance WHERE tbl = ?", [(tbl,) for tbl in deferred])
+    return created
+
+
+# Drops the SCHEMA_OBJECTS triggers and indexes on `tables` (per-row work a
+# bulk load does once at the end with ensure_schema_objects) and records the
+# tables in deferred_maintenance. Does not commit: commit before loading, so
+# the record is there if the load dies.
+def drop_schema_objects(conn, tables):
+    if schema_version(conn) < 12:
+        raise RuntimeError("drop_schema_objects() needs a migrated database")
+    for objects, repair in _schema_objects(conn, tables):
+        for name, table, sql, exists in objects:
+            if exists:
+                conn.execute(f"DROP {'TRIGGER' if _is_trigger(sql) else 'INDEX'} IF EXISTS {name}")
+    conn.executemany(
+        "INSERT OR IGNORE INTO deferred_maintenance(tbl, since) VALUES(?, datetime('now'))",
+        [(tbl,) for tbl in tables],
+    )
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+# Applies every pending migration and returns [(version, description, seconds)].
+# `report`, if given, is called with each of those tuples as the step finishes.
+def migrate(conn, report=None):
+    applied = []
+    current = schema_version(conn)
+    for version, description, step in MIGRATIONS:
+        if version <= current:
+            continue
+        start = time.perf_counter()
+        step(conn)
+        conn.commit()
+        conn.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+        elapsed = time.perf_counter() - start
+        applied.append((version, description, elapsed))
+        if report is not None:
+            report((version, description, elapsed))
+    # put back what an interrupted bulk load dropped
+    ensure_schema_objects(conn)
+    conn.commit()
+    return applied
+
+
+def print_step(step):
+    version, description, elapsed = step
+    print(f"migration {version} ({description}) applied in {elapsed:.2f}s")
+
+
+def main():
+    import sys
+
+    from db import connect_db
+
+    conn = connect_db(sys.argv[1] if len(sys.argv) > 1 else None)
+    print(f"schema version {schema_version(conn)}, latest {LATEST_VERSION}")
+    if not migrate(conn, report=print_step):
+        print("nothing to do")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
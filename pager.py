@@ -0,0 +1,156 @@
+# Keyset ("seek") pagination over an ordered query.
+# Only the rows of the current page are ever fetched: the next page seeks
+# past the key of the last row shown, the previous page seeks back before the
+# key of the first row shown, so no OFFSET scan and no fetchall() of the
+# whole result set is needed.
+
+
+class KeysetPager:
+
+    # select_sql: "SELECT <columns> FROM <tables>" (no WHERE/ORDER BY)
+    # where_sql, params: the base filter and its bound parameters
+    # keys: list of (sql_expr, row_column) pairs forming a unique sort key,
+    #       e.g. [("pid", "pid")] or [("o.odate", "odate"), ("o.ono", "ono")]
+    # descending: sort every key column descending instead of ascending
+    def __init__(self, conn, select_sql, where_sql, params, keys, descending=False, page_size=5):
+        self.conn = conn
+        self.select_sql = select_sql
+        self.where_sql = where_sql or "1"
+        self.params = list(params)
+        self.keys = list(keys)
+        self.descending = descending
+        self.page_size = page_size
+        self.page = []
+        self.page_index = -1
+        self._count = None
+
+    # (sql, params) of one page query, seeking from `after_key` in the given
+    # direction (query_plans.py checks these)
+    def page_query(self, after_key=None, forward=True):
+        exprs = [expr for expr, _ in self.keys]
+        # walking forward through a descending sort means going "down" the key
+        going_down = self.descending == forward
+        direction = "DESC" if going_down else "ASC"
+        where = f"({self.where_sql})"
+        params = list(self.params)
+        if after_key is not None:
+            op = "<" if going_down else ">"
+            where += " AND ({}) {} ({})".format(", ".join(exprs), op, ", ".join("?" * len(exprs)))
+            params.extend(after_key)
+        order_by = ", ".join(f"{expr} {direction}" for expr in exprs)
+        sql = f"{self.select_sql} WHERE {where} ORDER BY {order_by} LIMIT ?"
+        params.append(self.page_size)
+        return sql, params
+
+    # Runs one page query, seeking from `after_key` in the given direction
+    def _fetch(self, after_key, forward):
+        rows = self.conn.execute(*self.page_query(after_key, forward)).fetchall()
+        if not forward:
+            rows.reverse()
+        return rows
+
+    def _key_of(self, row):
+        return [row[column] for _, column in self.keys]
+
+    # Moves to the next page and returns its rows.
+    # Returns [] (and stays on the current page) when there are no more rows.
+    def next_page(self):
+        after_key = self._key_of(self.page[-1]) if self.page else None
+        rows = self._fetch(after_key, forward=True)
+        if rows:
+            self.page = rows
+            self.page_index += 1
+        return rows
+
+    # Moves to the previous page and returns its rows (stays on the first page)
+    def prev_page(self):
+        if self.page_index <= 0:
+            return self.page
+        rows = self._fetch(self._key_of(self.page[0]), forward=False)
+        if rows:
+            self.page = rows
+            self.page_index -= 1
+        return self.page
+
+    # Total number of matching rows; only computed if somebody asks for it
+    def count(self):
+        if self._count is None:
+            sql = f"SELECT COUNT(*) FROM ({self.select_sql} WHERE {self.where_sql})"
+            self._count = self.conn.execute(sql, self.params).fetchone()[0]
+        return self._count
+
+
+# Pagination over an already known, ordered list of keys (e.g. cached search
+# results). fetch(keys) returns the rows for one page of keys; by default the
+# keys themselves are the rows.
+class ListPager:
+
+    def __init__(self, keys, fetch=None, page_size=5):
+        self.keys = list(keys)
+        self.fetch = fetch or list
+        self.page_size = page_size
+        self.page = []
+        self.page_index = -1
+
+    def _load(self, index):
+        start = index * self.page_size
+        return self.fetch(self.keys[start:start + self.page_size])
+
+    # Moves to the next page and returns its rows.
+    # Returns [] (and stays on the current page) when there are no more rows.
+    def next_page(self):
+        if (self.page_index + 1) * self.page_size >= len(self.keys):
+            return []
+        self.page_index += 1
+        self.page = self._load(self.page_index)
+        return self.page
+
+    # Moves to the previous page and returns its rows (stays on the first page)
+    def prev_page(self):
+        if self.page_index <= 0:
+            return self.page
+        self.page_index -= 1
+        self.page = self._load(self.page_index)
+        return self.page
+
+    def count(self):
+        return len(self.keys)
+
+
+# Pagination through a function returning the page after a key, like
+# services.search(..., after=, limit=). Going back re-fetches from the key
+# the earlier page started after, which is remembered per page. first_page,
+# if given, is the page after `first` that the caller already fetched.
+class SeekPager:
+
+    # fetch(after, limit) returns rows; key(row) is the key to seek past
+    def __init__(self, fetch, key, first=0, first_page=None, page_size=5):
+        self.fetch = fetch
+        self.key = key
+        self.page_size = page_size
+        self.page = []
+        self.page_index = -1
+        self._starts = [first]
+        if first_page:
+            self.page = list(first_page)
+            self.page_index = 0
+
+    # Moves to the next page and returns its rows.
+    # Returns [] (and stays on the current page) when there are no more rows.
+    def next_page(self):
+        after = self.key(self.page[-1]) if self.page else self._starts[0]
+        rows = self.fetch(after, self.page_size)
+        if rows:
+            self.page = rows
+            self.page_index += 1
+            if self.page_index == len(self._starts):
+                self._starts.append(after)
+        return rows
+
+    # Moves to the previous page and returns its rows (stays on the first page)
+    def prev_page(self):
+        if self.page_index <= 0:
+            return self.page
+        self.page_index -= 1
+        self.page = self.fetch(self._starts[self.page_index], self.page_size)
+        return self.page
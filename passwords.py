@@ -0,0 +1,270 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Password hashing: salted, tunable key-derivation functions.
+#
+# Hashes are stored self-describing, as
+#   scrypt$n=16384,r=8,p=1$<salt>$<hash>
+#   pbkdf2_sha256$i=600000$<salt>$<hash>
+# (salt and hash in unpadded base64), so the algorithm and its cost can be
+# changed at any time: old hashes keep verifying with the parameters they
+# were made with, and needs_rehash() tells login to store a new hash in the
+# current format. Hashes without a "$" are the old unsalted SHA-256 hex
+# digests; they still verify, and are replaced on the next successful login.
+#
+# A KDF is slow on purpose, so:
+#   - hash_async()/verify_async() run it on a small thread pool (hashlib's
+#     scrypt and pbkdf2_hmac release the GIL), so a burst of logins queues
+#     there instead of occupying the server's reader and writer threads;
+#   - successful verifications are remembered for a short time, so the same
+#     user logging in again (scripts, retries, reconnects) doesn't pay the
+#     full cost each time. The cache holds only an HMAC of (stored hash,
+#     password) under a random per-process key, never the password, and an
+#     entry stops matching as soon as the stored hash changes.
+#
+#   COMMERCE_PASSWORD_HASHER       scrypt (default) or pbkdf2_sha256
+#   COMMERCE_PASSWORD_COST         low, default or high (see COSTS)
+#   COMMERCE_HASH_WORKERS          hashing threads (default: CPU count)
+#   COMMERCE_LOGIN_CACHE_SIZE      remembered verifications (default 10000, 0 = off)
+#   COMMERCE_LOGIN_CACHE_TTL       seconds one is remembered (default 300)
+
+# cost settings per algorithm; benchmarks/bench_passwords.py measures them
+COSTS = {
+    "scrypt": {
+        "low": {"n": 2 ** 13, "r": 8, "p": 1},
+        "default": {"n": 2 ** 14, "r": 8, "p": 1},
+        "high": {"n": 2 ** 16, "r": 8, "p": 1},
+    },
+    "pbkdf2_sha256": {
+        "low": {"i": 100_000},
+        "default": {"i": 600_000},
+        "high": {"i": 1_200_000},
+    },
+}
+
+DEFAULT_ALGORITHM = os.environ.get("COMMERCE_PASSWORD_HASHER", "scrypt")
+DEFAULT_COST = os.environ.get("COMMERCE_PASSWORD_COST", "default")
+HASH_WORKERS = int(os.environ.get("COMMERCE_HASH_WORKERS", "0")) or os.cpu_count() or 1
+CACHE_SIZE = int(os.environ.get("COMMERCE_LOGIN_CACHE_SIZE", "10000"))
+CACHE_TTL = float(os.environ.get("COMMERCE_LOGIN_CACHE_TTL", "300"))
+
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+
+def _unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+class ScryptHasher:
+    algorithm = "scrypt"
+
+    def __init__(self, n, r, p):
+        self.params = {"n": n, "r": r, "p": p}
+
+    def derive(self, password, salt, params):
+        n, r, p = params["n"], params["r"], params["p"]
+        # scrypt needs about 128 * r * (n + p) bytes; hashlib refuses more than maxmem
+        return hashlib.scrypt(
+            password.encode("utf-8"), salt=salt, n=n, r=r, p=p, maxmem=2 * 128 * r * (n + p), dklen=HASH_BYTES,
+        )
+
+
+class Pbkdf2Hasher:
+    algorithm = "pbkdf2_sha256"
+
+    def __init__(self, i):
+        self.params = {"i": i}
+
+    def derive(self, password, salt, params):
+        return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, params["i"], HASH_BYTES)
+
+
+HASHERS = {
+    "scrypt": ScryptHasher,
+    "pbkdf2_sha256": Pbkdf2Hasher,
+}
+
+
+def make_hasher(algorithm=DEFAULT_ALGORITHM, cost=DEFAULT_COST):
+    if algorithm not in HASHERS:
+        raise ValueError(f"unknown password hasher {algorithm!r}, expected one of {sorted(HASHERS)}")
+    if cost not in COSTS[algorithm]:
+        raise ValueError(f"unknown password cost {cost!r}, expected one of {sorted(COSTS[algorithm])}")
+    return HASHERS[algorithm](**COSTS[algorithm][cost])
+
+
+# ---- the stored format ----
+
+def encode(hasher, params, salt, digest):
+    param_text = ",".join(f"{k}={v}" for k, v in params.items())
+    return f"{hasher.algorithm}${param_text}${_b64(salt)}${_b64(digest)}"
+
+
+# Returns (algorithm, params, salt, digest), or None for an unknown format.
+# Legacy SHA-256 hex digests come back as ("sha256", {}, b"", digest).
+def decode(encoded):
+    if not isinstance(encoded, str):
+        return None
+    parts = encoded.split("$")
+    if len(parts) == 1:
+        try:
+            return ("sha256", {}, b"", bytes.fromhex(encoded)) if len(encoded) == 64 else None
+        except ValueError:
+            return None
+    if len(parts) != 4 or parts[0] not in HASHERS:
+        return None
+    try:
+        params = {k: int(v) for k, v in (item.split("=", 1) for item in parts[1].split(","))}
+        return parts[0], params, _unb64(parts[2]), _unb64(parts[3])
+    except ValueError:
+        return None
+
+
+# ---- hashing and verification ----
+
+_hasher = make_hasher()
+# stands in for a missing account, so "no such user" takes as long as a wrong password
+_dummy_hash = None
+
+
+def configure(algorithm=DEFAULT_ALGORITHM, cost=DEFAULT_COST):
+    global _hasher, _dummy_hash
+    _hasher = make_hasher(algorithm, cost)
+    _dummy_hash = None
+    _cache.clear()
+    return _hasher
+
+
+def get_hasher():
+    return _hasher
+
+
+def hash_password(password, salt=None):
+    salt = secrets.token_bytes(SALT_BYTES) if salt is None else salt
+    return encode(_hasher, _hasher.params, salt, _hasher.derive(password, salt, _hasher.params))
+
+
+def _check(password, encoded):
+    decoded = decode(encoded)
+    if decoded is None:
+        return False
+    algorithm, params, salt, digest = decoded
+    if algorithm == "sha256":
+        actual = hashlib.sha256(password.encode("utf-8")).digest()
+    else:
+        actual = HASHERS[algorithm](**params).derive(password, salt, params)
+    return hmac.compare_digest(actual, digest)
+
+
+# True if password matches the stored hash. encoded=None (no such account)
+# costs the same as a wrong password and returns False.
+def verify_password(password, encoded):
+    if encoded is None:
+        global _dummy_hash
+        if _dummy_hash is None:
+            _dummy_hash = hash_password(secrets.token_hex(8))
+        _check(password, _dummy_hash)
+        return False
+    key = _cache.key(encoded, password)
+    if _cache.hit(key):
+        return True
+    ok = _check(password, encoded)
+    if ok:
+        _cache.add(key)
+    return ok
+
+
+# True if a stored hash is not in the current algorithm and cost
+def needs_rehash(encoded):
+    decoded = decode(encoded)
+    return decoded is None or decoded[0] != _hasher.algorithm or decoded[1] != _hasher.params
+
+
+# ---- verification cache ----
+
+class VerificationCache:
+    def __init__(self, max_entries=CACHE_SIZE, ttl=CACHE_TTL, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._secret = secrets.token_bytes(32)
+        self._expires = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, encoded, password):
+        return hmac.new(self._secret, f"{encoded}\0{password}".encode("utf-8"), hashlib.sha256).digest()
+
+    def hit(self, key):
+        with self._lock:
+            expires = self._expires.get(key)
+            if expires is not None and expires > self.clock():
+                self.hits += 1
+                return True
+            if expires is not None:
+                del self._expires[key]
+            self.misses += 1
+            return False
+
+    def add(self, key):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._expires[key] = self.clock() + self.ttl
+            self._expires.move_to_end(key)
+            while len(self._expires) > self.max_entries:
+                self._expires.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._expires.clear()
+
+    def stats(self):
+        return {"entries": len(self._expires), "hits": self.hits, "misses": self.misses}
+
+
+_cache = VerificationCache()
+
+
+def cache_stats():
+    return _cache.stats()
+
+
+def clear_cache():
+    _cache.clear()
+
+
+# ---- hashing pool ----
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(HASH_WORKERS, thread_name_prefix="hasher")
+        return _executor
+
+
+# Both return a concurrent.futures.Future (asyncio: asyncio.wrap_future)
+def hash_async(password):
+    return _pool().submit(hash_password, password)
+
+
+def verify_async(password, encoded):
+    return _pool().submit(verify_password, password, encoded)
@@ -0,0 +1,320 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from db import connect_db, DB_PATH
+
+# Connection pool: N read-only connections plus one writer fed by a queue.
+#
+# With a single connection for everything, a long report holds the
+# connection (and, outside WAL, a shared lock) while checkouts wait behind
+# it. The pool separates the two:
+#   - readers are opened with a mode=ro URI and PRAGMA query_only, so they
+#     can never take a write lock; under WAL they read a snapshot while the
+#     writer commits. They are opened on demand up to `readers` and handed
+#     out most-recently-used first, so warm page and statement caches get
+#     reused;
+#   - all writes are queued to one writer thread that runs them in order
+#     on the writer connection, so writers never contend for the database
+#     lock (no SQLITE_BUSY between them) and no reader waits on a writer.
+#
+# Every connection keeps its own prepared statement cache (cached_statements,
+# sized to hold every distinct statement of the app so hot queries are never
+# re-prepared). A reader that sat idle for a while is health-checked before
+# it is handed out, and one that failed is replaced; stats() reports
+# checkout wait times and how busy the readers and the writer are.
+#
+#   COMMERCE_POOL_READERS             read-only connections (default 4)
+#   COMMERCE_POOL_CACHED_STATEMENTS   statement cache per connection (default 256)
+#   COMMERCE_POOL_TIMEOUT             seconds to wait for a free reader (default 30)
+
+DEFAULT_READERS = int(os.environ.get("COMMERCE_POOL_READERS", "4"))
+DEFAULT_CACHED_STATEMENTS = int(os.environ.get("COMMERCE_POOL_CACHED_STATEMENTS", "256"))
+DEFAULT_TIMEOUT = float(os.environ.get("COMMERCE_POOL_TIMEOUT", "30"))
+
+# readers idle for longer than this are checked before being handed out
+HEALTH_CHECK_IDLE = 30.0
+
+
+class PoolError(Exception):
+    pass
+
+
+class PoolTimeout(PoolError):
+    pass
+
+
+class PoolClosed(PoolError):
+    pass
+
+
+# Cheap liveness probe; False if the connection can't run a query anymore
+def healthy(conn):
+    try:
+        conn.execute("SELECT 1").fetchone()
+        return True
+    except sqlite3.Error:
+        return False
+
+
+class ConnectionPool:
+    def __init__(self, db_path=None, readers=DEFAULT_READERS, profile=None,
+                 cached_statements=DEFAULT_CACHED_STATEMENTS, timeout=DEFAULT_TIMEOUT, writer=True):
+        self.db_path = db_path or DB_PATH
+        if self.db_path == ":memory:":
+            raise ValueError("a connection pool needs a database file")
+        self.size = max(1, readers)
+        self.profile = profile
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        self.closed = False
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        # idle readers as (conn, time it was returned), most recent last
+        self._idle = []
+        self._opened = 0
+        self._in_use = 0
+        self._started = time.perf_counter()
+        # metrics
+        self.acquires = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+        self.read_busy = 0.0
+        self.health_checks = 0
+        self.replaced = 0
+        self.writes = 0
+        self.write_errors = 0
+        self.write_wait = 0.0
+        self.max_write_wait = 0.0
+        self.write_busy = 0.0
+        self._writes = queue.Queue()
+        self._writer_conn = None
+        self._writer = None
+        if writer:
+            # opened first: it creates the file and WAL, which readers can't
+            self._writer_conn = self._connect(read_only=False)
+            self._writer = threading.Thread(target=self._writer_loop, name="pool-writer", daemon=True)
+            self._writer.start()
+
+    def _connect(self, read_only):
+        return connect_db(
+            self.db_path,
+            profile=self.profile,
+            read_only=read_only,
+            cached_statements=self.cached_statements,
+            check_same_thread=False,
+        )
+
+    # ---- readers ----
+
+    # Borrows a read-only connection for the duration of the with block:
+    #   with pool.reader() as conn:
+    #       conn.execute(...)
+    @contextmanager
+    def reader(self, timeout=None):
+        conn = self._acquire(self.timeout if timeout is None else timeout)
+        start = time.perf_counter()
+        broken = False
+        try:
+            yield conn
+        except sqlite3.Error:
+            # the query failed; make sure the connection itself still works
+            broken = not healthy(conn)
+            raise
+        finally:
+            self._release(conn, time.perf_counter() - start, broken)
+
+    def _acquire(self, timeout):
+        start = time.perf_counter()
+        with self._available:
+            while True:
+                if self.closed:
+                    raise PoolClosed("connection pool is closed")
+                if self._idle:
+                    conn, since = self._idle.pop()
+                    break
+                if self._opened < self.size:
+                    # opened outside the lock below
+                    self._opened += 1
+                    conn = since = None
+                    break
+                remaining = timeout - (time.perf_counter() - start)
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(f"no free reader connection after {timeout:g}s")
+                self._available.wait(remaining)
+            self._in_use += 1
+        try:
+            if conn is None:
+                conn = self._connect(read_only=True)
+            elif time.perf_counter() - since > HEALTH_CHECK_IDLE:
+                self.health_checks += 1
+                if not healthy(conn):
+                    conn = self._replace(conn)
+        except Exception:
+            with self._available:
+                self._in_use -= 1
+                self._opened -= 1
+                self._available.notify()
+            raise
+        waited = time.perf_counter() - start
+        with self._lock:
+            self.acquires += 1
+            self.wait_seconds += waited
+            self.max_wait = max(self.max_wait, waited)
+            if waited > 0.001:
+                self.waits += 1
+        return conn
+
+    def _replace(self, conn):
+        self.replaced += 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        return self._connect(read_only=True)
+
+    def _release(self, conn, busy, broken=False):
+        if broken:
+            try:
+                conn = self._replace(conn)
+            except sqlite3.Error:
+                conn = None
+        elif conn.in_transaction:
+            conn.rollback()
+        with self._available:
+            self._in_use -= 1
+            self.read_busy += busy
+            if conn is None:
+                self._opened -= 1
+            elif self.closed:
+                self._opened -= 1
+                conn.close()
+            else:
+                self._idle.append((conn, time.perf_counter()))
+            self._available.notify()
+
+    # ---- writer ----
+
+    # Queues func(writer connection) and returns a concurrent.futures.Future
+    # for its result; func runs after every write queued before it.
+    # asyncio code can await it with asyncio.wrap_future().
+    def submit(self, func):
+        if self._writer is None:
+            raise PoolError("this pool has no writer connection")
+        future = Future()
+        with self._lock:
+            # under the lock so nothing is queued behind close()'s sentinel
+            if self.closed:
+                raise PoolClosed("connection pool is closed")
+            self._writes.put((func, future, time.perf_counter()))
+        return future
+
+    # Runs func(writer connection) on the writer thread and returns its result
+    def write(self, func, timeout=None):
+        return self.submit(func).result(timeout)
+
+    def _writer_loop(self):
+        conn = self._writer_conn
+        while True:
+            item = self._writes.get()
+            if item is None:
+                break
+            func, future, queued = item
+            start = time.perf_counter()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = func(conn)
+            except Exception as e:
+                self.write_errors += 1
+                try:
+                    if conn.in_transaction:
+                        conn.rollback()
+                except sqlite3.Error:
+                    pass
+                if isinstance(e, sqlite3.Error) and not healthy(conn):
+                    self.replaced += 1
+                    conn.close()
+                    conn = self._writer_conn = self._connect(read_only=False)
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            done = time.perf_counter()
+            self.writes += 1
+            self.write_wait += start - queued
+            self.max_write_wait = max(self.max_write_wait, start - queued)
+            self.write_busy += done - start
+        conn.close()
+
+    # ---- health and metrics ----
+
+    # Probes the writer and every idle reader, replacing readers that fail;
+    # returns {"writer": ok or None, "readers": ok count, "replaced": n}
+    def check(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._in_use += len(idle)
+        replaced = 0
+        for conn, _ in idle:
+            self.health_checks += 1
+            broken = not healthy(conn)
+            replaced += broken
+            self._release(conn, 0.0, broken)
+        writer = None
+        if self._writer is not None and not self.closed:
+            writer = self.write(healthy)
+        return {"writer": writer, "readers": len(idle) - replaced, "replaced": replaced}
+
+    def stats(self):
+        elapsed = max(time.perf_counter() - self._started, 1e-9)
+        acquires = self.acquires
+        writes = self.writes
+        return {
+            "readers": self.size,
+            "readers_open": self._opened,
+            "readers_in_use": self._in_use,
+            "acquires": acquires,
+            "waits": self.waits,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": self.wait_seconds / acquires * 1000 if acquires else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+            "reader_utilization": self.read_busy / (elapsed * self.size),
+            "writes": writes,
+            "write_errors": self.write_errors,
+            "write_queue": self._writes.qsize(),
+            "avg_write_wait_ms": self.write_wait / writes * 1000 if writes else 0.0,
+            "max_write_wait_ms": self.max_write_wait * 1000,
+            "writer_utilization": self.write_busy / elapsed,
+            "health_checks": self.health_checks,
+            "replaced": self.replaced,
+        }
+
+    # Runs the writes already queued, then closes every connection. Readers
+    # that are still borrowed are closed when they come back.
+    def close(self):
+        with self._available:
+            if self.closed:
+                return
+            self.closed = True
+            idle, self._idle = self._idle, []
+            self._opened -= len(idle)
+            self._available.notify_all()
+            if self._writer is not None:
+                self._writes.put(None)
+        for conn, _ in idle:
+            conn.close()
+        if self._writer is not None:
+            self._writer.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,179 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Read-through cache of product rows (pid, name, category, price,
+# stock_count, descr) for the customer and sales screens.
+# Rows are kept in LRU order up to a fixed number of entries. Every entry
+# remembers the products version it was read at: the triggers below bump
+# the version on every insert, delete and update of products (price and
+# stock included) by any connection of any process, and an entry is only
+# used while the version is unchanged. Writes made through this process also
+# drop exactly the rows they touch (sales_product_update, checkout,
+# catalog_io). Commits that don't touch products (carts, activity,
+# sessions) leave the cache alone, so it can be shared by every connection
+# of the process (the server's readers and writer).
+#
+# The version lives in a second row of search_cache's catalog_version table
+# (id 2); the search cache's row (id 1) ignores price and stock changes.
+#
+# Cached stock is only ever used for display and early "insufficient stock"
+# messages; checkout re-reads prices and conditionally decrements stock
+# under its write lock, so a stale entry can never cause an oversell.
+#
+#   COMMERCE_PRODUCT_CACHE_SIZE   maximum number of cached products (0 = off)
+
+DEFAULT_MAX_ENTRIES = int(os.environ.get("COMMERCE_PRODUCT_CACHE_SIZE", "1024"))
+
+PRODUCT_SQL = "SELECT pid, name, category, price, stock_count, descr FROM products WHERE pid IN ({})"
+
+PRODUCTS_VERSION_SQL = "INSERT OR IGNORE INTO catalog_version(id, version) VALUES (2, 0)"
+BUMP_VERSION_SQL = "UPDATE catalog_version SET version = version + 1 WHERE id = 2"
+VERSION_SQL = "SELECT version FROM catalog_version WHERE id = 2"
+
+PRODUCTS_VERSION_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS products_version_ai AFTER INSERT ON products BEGIN
+        UPDATE catalog_version SET version = version + 1 WHERE id = 2;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_version_ad AFTER DELETE ON products BEGIN
+        UPDATE catalog_version SET version = version + 1 WHERE id = 2;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_version_au AFTER UPDATE ON products BEGIN
+        UPDATE catalog_version SET version = version + 1 WHERE id = 2;
+    END
+    """,
+]
+
+
+# Needs the catalog_version table (search_cache.create_catalog_version)
+def create_products_version(conn):
+    for sql in [PRODUCTS_VERSION_SQL] + PRODUCTS_VERSION_TRIGGERS:
+        conn.execute(sql)
+    conn.commit()
+
+
+def products_version(conn):
+    row = conn.execute(VERSION_SQL).fetchone()
+    return row[0] if row is not None else 0
+
+
+class ProductCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # pid -> (products version, row)
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped by every invalidate, so rows read while one happened are
+        # not stored afterwards
+        self._generation = 0
+
+    # Returns the product row for pid, or None if there is no such product
+    def get(self, conn, pid):
+        return self.get_many(conn, [pid]).get(pid)
+
+    # Returns {pid: row} for the pids that exist; the version and the misses
+    # are read outside the lock, so connections in other threads are not
+    # held up. Misses are read in one query and stored with the version read
+    # before it (a write committed in between only makes them stale early).
+    def get_many(self, conn, pids):
+        version = products_version(conn)
+        with self._lock:
+            found = {}
+            missing = []
+            for pid in pids:
+                entry = self._rows.get(pid)
+                if entry is not None and entry[0] == version:
+                    self._rows.move_to_end(pid)
+                    found[pid] = entry[1]
+                    self.hits += 1
+                    continue
+                if entry is not None:
+                    self.stale += 1
+                    del self._rows[pid]
+                missing.append(pid)
+            self.misses += len(missing)
+            generation = self._generation
+        if missing:
+            rows = conn.execute(PRODUCT_SQL.format(",".join("?" * len(missing))), missing).fetchall()
+            with self._lock:
+                store = generation == self._generation
+                for row in rows:
+                    found[row["pid"]] = row
+                    if store:
+                        self._store(row["pid"], (version, row))
+        return found
+
+    def _store(self, pid, entry):
+        if self.max_entries <= 0:
+            return
+        self._rows[pid] = entry
+        self._rows.move_to_end(pid)
+        while len(self._rows) > self.max_entries:
+            self._rows.popitem(last=False)
+            self.evictions += 1
+
+    # Forgets the given pids (all products if pids is None). Call after
+    # committing a write to products on any of this process's connections;
+    # the version bump already makes the entries stale, this frees them.
+    def invalidate(self, pids=None):
+        with self._lock:
+            if pids is None:
+                self._rows.clear()
+            else:
+                for pid in pids:
+                    self._rows.pop(pid, None)
+            self._generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._rows),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stale": self.stale,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+# Module-level cache shared by the CLI screens
+_cache = ProductCache()
+
+
+def configure(max_entries=DEFAULT_MAX_ENTRIES):
+    global _cache
+    _cache = ProductCache(max_entries)
+    return _cache
+
+
+def get_cache():
+    return _cache
+
+
+def get_product(conn, pid):
+    return _cache.get(conn, pid)
+
+
+def get_products(conn, pids):
+    return _cache.get_many(conn, pids)
+
+
+def invalidate(pids=None):
+    _cache.invalidate(pids)
+
+
+def stats():
+    return _cache.stats()
@@ -0,0 +1,166 @@
+import random
+import sys
+
+import activity
+import carts
+import checkout
+import customer
+import ids
+import product_cache
+import rollups
+import search_cache
+import services
+import sessions
+import topk
+from db import connect_db, init_db
+from pager import KeysetPager
+from search_index import keyword_filter
+
+# Query-plan regression check for the hot queries in customer.py, services.py,
+# sales.py (rollups.py, topk.py), checkout.py, ids.py, sessions.py, carts.py,
+# activity.py, product_cache.py and search_cache.py.
+#
+#   python3 query_plans.py [db_path]
+#
+# Runs EXPLAIN QUERY PLAN on every query below and fails (exit status 1) if
+# any of them falls back to a full table scan. Without a db_path it checks a
+# freshly initialized in-memory database filled with a small synthetic data
+# set and ANALYZEd, so the planner sees realistic table sizes.
+#
+# A "SCAN t USING COVERING INDEX" is only accepted for queries marked
+# whole_table (aggregates that must read every row anyway); a bare "SCAN t"
+# is never accepted.
+
+
+# (name, sql, params, whole_table) -- params are representative values. The
+# statements are the ones the modules run (their SQL constants, and the
+# pages KeysetPager builds), so a changed query is checked as it is.
+def hot_queries(conn):
+    search_sql, search_params = keyword_filter(conn, ["widget", "gadget"])
+    orders_pager = KeysetPager(conn, customer.ORDERS_SELECT_SQL, "o.cid = ?", [10001], customer.ORDERS_KEYS, descending=True)
+    queries = [
+        # customer.py
+        ("order history first page", *orders_pager.page_query(), False),
+        ("order history next page", *orders_pager.page_query(["2030-01-01", 1 << 30]), False),
+        ("order header", customer.ORDER_HEADER_SQL, [1], False),
+        ("order lines", customer.ORDER_LINES_SQL, [1], False),
+        # carts.py
+        ("cart load", carts.LOAD_SQL, [10001, 1], False),
+        ("cart line upsert", carts.UPSERT_SQL, [10001, 1, 1, 2], False),
+        ("cart line delete", carts.DELETE_SQL, [10001, 1, 1], False),
+        ("unfinished session", carts.UNFINISHED_SESSION_SQL, [10001, 2], False),
+        ("close unfinished session", carts.CLOSE_SESSION_SQL, [10001, 1], False),
+        ("cart carry-over", carts.MOVE_CART_SQL, [2, 10001, 1], False),
+        # search_cache.py / product_cache.py
+        ("search cache fill", search_cache.PIDS_SQL.format(search_sql), search_params + [1001], False),
+        ("catalog version", search_cache.VERSION_SQL, [], False),
+        ("products version", product_cache.VERSION_SQL, [], False),
+        ("product cache fill", product_cache.PRODUCT_SQL.format("?,?,?"), [1, 2, 3], False),
+        # checkout.py / ids.py / sessions.py / activity.py
+        ("checkout cart read", checkout.CART_SQL, [10001, 1], False),
+        ("checkout stock decrement", checkout.DECREMENT_SQL, [1, 1, 1], False),
+        ("checkout empty cart", checkout.EMPTY_CART_SQL, [10001, 1], False),
+        ("sequence read", ids.NEXT_VAL_SQL, ["orders"], False),
+        ("next session number", sessions.NEXT_SESSION_SQL, [10001], False),
+        ("session end", sessions.END_SESSION_SQL, ["2030-01-01", 10001, 1], False),
+        # services.py (the server and the script mode)
+        ("login by uid", services.ACCOUNT_BY_UID_SQL, [10001], False),
+        ("login by email", services.ACCOUNT_BY_EMAIL_SQL, ["someone@example.com"], False),
+        ("signup email check", services.EMAIL_TAKEN_SQL, ["someone@example.com"], False),
+        ("search page", services.SEARCH_PAGE_SQL.format(search_sql), search_params + [10, 5], False),
+        ("reorder order owner", services.ORDER_OWNER_SQL, [1], False),
+        ("reorder lines", services.ORDER_ITEMS_SQL, [1], False),
+        ("orders page", services.ORDERS_PAGE_SQL.format("o.cid = ? AND (o.odate, o.ono) < (?, ?)"),
+         [10001, "2030-01-01", 1 << 30, 5], False),
+        ("order", services.ORDER_SQL, [1], False),
+        ("order with lines", services.ORDER_LINES_SQL, [1], False),
+        # sales.py (rollups.py / topk.py)
+        ("weekly orders and revenue", rollups.SUMMARY_TOTALS_SQL, ["2030-01-01", "9999-12-31"], False),
+        ("weekly distinct customers", rollups.SUMMARY_CUSTOMERS_SQL, ["2030-01-01", "9999-12-31"], False),
+        ("weekly distinct products", rollups.SUMMARY_PRODUCTS_SQL, ["2030-01-01", "9999-12-31"], False),
+    ]
+    for metric in topk.METRICS:
+        queries.append((f"top products by {metric} (n-th count)", topk.NTH_COUNT_SQL.format(metric=metric), [2], False))
+        queries.append((f"top products by {metric}", topk.TOP_SQL.format(metric=metric), [3], False))
+    for table, sql in activity.INSERT_SQL.items():
+        queries.append((f"{table} event", sql, [10001, 1, "2030-01-01 00:00:00", 1], False))
+    return queries
+
+
+# Returns the plan lines that mean a full scan of a table
+def full_scans(conn, sql, params, whole_table):
+    bad = []
+    for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params):
+        detail = row[3]
+        if not detail.startswith("SCAN "):
+            continue
+        if "VIRTUAL TABLE" in detail:
+            continue
+        if whole_table and "COVERING INDEX" in detail:
+            continue
+        bad.append(detail)
+    return bad
+
+
+# Fills a fresh database with enough rows for the planner to behave like production
+def _fill_sample(conn, seed=7):
+    rng = random.Random(seed)
+    conn.executemany(
+        "INSERT OR IGNORE INTO products(pid, name, category, price, stock_count, descr) VALUES(?,?,?,?,?,?)",
+        [(pid, f"product {pid}", "misc", 1.0, 10, f"sample product {pid}") for pid in range(7, 2001)],
+    )
+    customers = list(range(10001, 10301))
+    conn.executemany("INSERT INTO users(uid, pwd, role) VALUES(?, '', 'customer')", [(c,) for c in customers])
+    conn.executemany(
+        "INSERT INTO customers(cid, name, email, email_norm) VALUES(?,?,?,?)",
+        [(c, f"customer {c}", f"c{c}@example.com", f"c{c}@example.com") for c in customers],
+    )
+    conn.executemany("INSERT INTO sessions(cid, sessionNo, start_time) VALUES(?, 1, '2024-01-01')", [(c,) for c in customers])
+    orders = []
+    lines = []
+    for ono in range(1, 5001):
+        cid = rng.choice(customers)
+        orders.append((ono, cid, 1, f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}", "somewhere"))
+        for line_no in range(1, rng.randint(1, 4) + 1):
+            lines.append((ono, line_no, rng.randint(1, 2000), 1, 1.0))
+    conn.executemany("INSERT INTO orders(ono, cid, sessionNo, odate, shipping_address) VALUES(?,?,?,?,?)", orders)
+    conn.executemany("INSERT INTO orderlines(ono, lineNo, pid, qty, uprice) VALUES(?,?,?,?,?)", lines)
+    conn.executemany(
+        "INSERT INTO viewedProduct(cid, sessionNo, ts, pid) VALUES(?, 1, '2024-01-01 00:00:00', ?)",
+        [(rng.choice(customers), rng.randint(1, 2000)) for _ in range(10000)],
+    )
+    conn.commit()
+    rollups.rebuild(conn)
+    topk.rebuild(conn)
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+# Returns a list of (query name, offending plan lines)
+def check_query_plans(conn):
+    failures = []
+    for name, sql, params, whole_table in hot_queries(conn):
+        bad = full_scans(conn, sql, params, whole_table)
+        if bad:
+            failures.append((name, bad))
+    return failures
+
+
+def main():
+    if len(sys.argv) > 1:
+        conn = connect_db(sys.argv[1])
+    else:
+        conn = connect_db(":memory:")
+        init_db(conn)
+        _fill_sample(conn)
+    failures = check_query_plans(conn)
+    total = len(hot_queries(conn))
+    for name, bad in failures:
+        print(f"FULL SCAN  {name}: {'; '.join(bad)}")
+    print(f"{total - len(failures)}/{total} hot queries use an index")
+    conn.close()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import sys
+
+# Daily sales rollups for the weekly report.
+# Checkout adds each order to the rollup of its day in the same transaction
+# that writes the order, so the weekly report reads one row per day instead
+# of rescanning orders joined to orderlines. Distinct customers and products
+# are kept as exact per-day sets (one row per day and cid/pid), so a
+# distinct count over any range of days stays exact.
+#
+#   python3 rollups.py rebuild [db_path]   # recompute from orders/orderlines
+#   python3 rollups.py check [db_path]     # compare rollups with the raw tables
+
+ROLLUP_TABLES = [
+    """
+    create table if not exists daily_sales (
+        day		date,
+        orders		int,
+        revenue		float,
+        primary key (day)
+    )
+    """,
+    """
+    create table if not exists daily_sales_customers (
+        day		date,
+        cid		int,
+        primary key (day, cid)
+    )
+    """,
+    """
+    create table if not exists daily_sales_products (
+        day		date,
+        pid		int,
+        primary key (day, pid)
+    )
+    """,
+]
+
+
+def create_rollup_tables(conn):
+    for table_sql in ROLLUP_TABLES:
+        conn.execute(table_sql)
+    conn.commit()
+
+
+# Adds one order to its day's rollup. Runs inside the caller's transaction
+# (the checkout), so the rollup commits or rolls back together with the order.
+# lines: iterable of (pid, qty, uprice)
+def apply_order(conn, day, cid, lines):
+    lines = list(lines)
+    revenue = sum(qty * uprice for _, qty, uprice in lines)
+    conn.execute(
+        """
+        INSERT INTO daily_sales(day, orders, revenue) VALUES(?, 1, ?)
+        ON CONFLICT(day) DO UPDATE SET orders = orders + 1, revenue = revenue + excluded.revenue
+        """,
+        (day, revenue),
+    )
+    conn.execute("INSERT OR IGNORE INTO daily_sales_customers(day, cid) VALUES(?,?)", (day, cid))
+    conn.executemany(
+        "INSERT OR IGNORE INTO daily_sales_products(day, pid) VALUES(?,?)",
+        [(day, pid) for pid, _, _ in lines],
+    )
+
+
+# Recomputes every rollup from the raw orders/orderlines tables
+def rebuild(conn):
+    conn.execute("DELETE FROM daily_sales")
+    conn.execute("DELETE FROM daily_sales_customers")
+    conn.execute("DELETE FROM daily_sales_products")
+    conn.execute(
+        """
+        INSERT INTO daily_sales(day, orders, revenue)
+        SELECT o.odate, COUNT(DISTINCT o.ono), COALESCE(SUM(ol.qty * ol.uprice), 0)
+        FROM orders o LEFT JOIN orderlines ol ON ol.ono = o.ono
+        GROUP BY o.odate
+        """
+    )
+    conn.execute(
+        "INSERT INTO daily_sales_customers(day, cid) SELECT DISTINCT odate, cid FROM orders"
+    )
+    conn.execute(
+        """
+        INSERT INTO daily_sales_products(day, pid)
+        SELECT DISTINCT o.odate, ol.pid FROM orders o JOIN orderlines ol ON ol.ono = o.ono
+        """
+    )
+    conn.commit()
+
+
+# summary() over the days in [?, ?)
+SUMMARY_TOTALS_SQL = "SELECT COALESCE(SUM(orders), 0), COALESCE(SUM(revenue), 0) FROM daily_sales WHERE day >= ? AND day < ?"
+SUMMARY_CUSTOMERS_SQL = "SELECT COUNT(DISTINCT cid) FROM daily_sales_customers WHERE day >= ? AND day < ?"
+SUMMARY_PRODUCTS_SQL = "SELECT COUNT(DISTINCT pid) FROM daily_sales_products WHERE day >= ? AND day < ?"
+
+
+# Sales totals for the days in [start, end) ("YYYY-MM-DD" strings; end=None
+# means no upper bound)
+def summary(conn, start, end=None):
+    end = end or "9999-12-31"
+    orders, revenue = conn.execute(SUMMARY_TOTALS_SQL, (start, end)).fetchone()
+    customers = conn.execute(SUMMARY_CUSTOMERS_SQL, (start, end)).fetchone()[0]
+    products = conn.execute(SUMMARY_PRODUCTS_SQL, (start, end)).fetchone()[0]
+    return {
+        "orders": orders,
+        "products": products,
+        "customers": customers,
+        "revenue": revenue,
+    }
+
+
+# Compares the rollups with the raw tables day by day.
+# Returns a list of (day, field, rollup value, raw value) for every difference.
+def check(conn):
+    raw = {}
+    for row in conn.execute(
+        """
+        SELECT o.odate, COUNT(DISTINCT o.ono), COALESCE(SUM(ol.qty * ol.uprice), 0),
+               COUNT(DISTINCT o.cid), COUNT(DISTINCT ol.pid)
+        FROM orders o LEFT JOIN orderlines ol ON ol.ono = o.ono
+        GROUP BY o.odate
+        """
+    ):
+        raw[row[0]] = tuple(row[1:])
+    rolled = {}
+    for row in conn.execute(
+        """
+        SELECT d.day, d.orders, d.revenue,
+               (SELECT COUNT(*) FROM daily_sales_customers c WHERE c.day = d.day),
+               (SELECT COUNT(*) FROM daily_sales_products p WHERE p.day = d.day)
+        FROM daily_sales d
+        """
+    ):
+        rolled[row[0]] = tuple(row[1:])
+    fields = ("orders", "revenue", "customers", "products")
+    diffs = []
+    for day in sorted(set(raw) | set(rolled)):
+        have = rolled.get(day, (0, 0.0, 0, 0))
+        want = raw.get(day, (0, 0.0, 0, 0))
+        for field, a, b in zip(fields, have, want):
+            # revenue is summed incrementally in floating point
+            if field == "revenue" and abs(a - b) < 0.005:
+                continue
+            if a != b:
+                diffs.append((day, field, a, b))
+    return diffs
+
+
+def main():
+    from db import connect_db
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ("rebuild", "check"):
+        print("usage: python3 rollups.py rebuild|check [db_path]")
+        sys.exit(2)
+    conn = connect_db(sys.argv[2] if len(sys.argv) > 2 else None)
+    if sys.argv[1] == "rebuild":
+        rebuild(conn)
+        days = conn.execute("SELECT COUNT(*) FROM daily_sales").fetchone()[0]
+        print(f"rebuilt rollups for {days} days")
+    else:
+        diffs = check(conn)
+        for day, field, have, want in diffs:
+            print(f"{day} {field}: rollup {have}, raw {want}")
+        print("rollups consistent" if not diffs else f"{len(diffs)} differences")
+        sys.exit(1 if diffs else 0)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
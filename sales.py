@@ -1,20 +1,68 @@
-from datetime import datetime, timedelta
+import sqlite3
+
+import catalog_io
+import instrument
+import product_cache
+import services
+import topk
+from analytics import recent_sales
+from db import db_file
+from pool import ConnectionPool
+
+
+# Reports run on a read-only connection of their own (reporting profile, see
+# pool.py), so a long report never holds the connection or a lock that a
+# customer's checkout waits for. In-memory databases just use conn.
+def open_report_pool(conn):
+    path = db_file(conn)
+    if not path:
+        return None
+    return ConnectionPool(path, readers=1, profile="reporting", writer=False)
+
+
+def run_report(conn, reports, report):
+    if reports is None:
+        return report(conn)
+    with reports.reader() as report_conn:
+        return report(report_conn)
 
 
 def sales_menu(conn):
+    reports = open_report_pool(conn)
+    try:
+        _sales_menu(conn, reports)
+    finally:
+        if reports is not None:
+            reports.close()
+
+
+def _sales_menu(conn, reports):
     while True:
         print("\n == Sales Menu Page ==")
         print("1) View or update product")
         print("2) Weekly sales report")
         print("3) Top products by order and view counts")
+        print("4) Product cache statistics")
+        print("5) Bulk price/stock update from a file")
+        print("6) Query timing statistics")
         print("0) Logout")
         choice = input("Make a selection: ").strip()
         if choice == "1":
-            sales_product_update(conn)
+            with instrument.operation("product_update", timed=False):
+                sales_product_update(conn)
         elif choice == "2":
-            weekly_sales_report(conn)
+            with instrument.operation("weekly_report"):
+                run_report(conn, reports, weekly_sales_report)
         elif choice == "3":
-            top_products(conn)
+            with instrument.operation("top_products"):
+                run_report(conn, reports, top_products)
+        elif choice == "4":
+            cache_stats()
+        elif choice == "5":
+            with instrument.operation("bulk_update", timed=False):
+                sales_bulk_update(conn)
+        elif choice == "6":
+            query_timings()
         elif choice == "0":
             break
         else:
@@ -29,10 +77,7 @@ def sales_product_update(conn):
         return
     
     pid=int(pid_s)
-    cur = conn.cursor()
-    product_id=(pid,)
-    cur.execute('SELECT pid, name, category, price, stock_count, descr FROM products WHERE pid=?;', product_id)
-    product = cur.fetchone()
+    product = product_cache.get_product(conn, pid)
     
     if product is None:
         print("This product does not exist")
@@ -57,12 +102,13 @@ def sales_product_update(conn):
             if price <= 0:
                 print("Price cannot be negative")
                 return
-            update_params=(price, pid)
-            conn.execute('UPDATE products SET price=? WHERE pid=?;', update_params)
-            conn.commit()
+            # writes the price and drops the product from the cache
+            services.update_price(conn, pid, price)
             print("Price has been updated")
         except ValueError:
             print("Invalid input")
+        except services.ServiceError as e:
+            print(e)
     elif sel == "2":
         val = input("New stock count: ").strip()
         if not val.isdigit():
@@ -70,112 +116,74 @@ def sales_product_update(conn):
             return
         
         stock = int(val)
-        stock_params=(stock, pid)
-        conn.execute('UPDATE products SET stock_count=? WHERE pid=?;', stock_params)
-        conn.commit()
+        try:
+            services.update_stock(conn, pid, stock)
+        except services.ServiceError as e:
+            print(e)
+            return
         print("Stock count has been updated")
 
 
+def sales_bulk_update(conn):
+    path = input("File with pid,price,stock_delta rows (.csv or .jsonl): ").strip()
+    if not path:
+        print("No file given")
+        return
+    try:
+        fmt = catalog_io.format_of(path)
+        with open(path, newline="", encoding="utf-8") as stream:
+            stats = catalog_io.update_products(conn, stream, fmt)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print("Bulk update failed:", e)
+        return
+    catalog_io.print_update_summary(stats)
+
+
 def weekly_sales_report(conn):
-    cutoff = (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
-    cur = conn.cursor()
-    
-    cutoff_param=(cutoff,)
-    cur.execute('SELECT COUNT(DISTINCT o.ono) FROM orders o WHERE o.odate>=?;', cutoff_param)
-    result = cur.fetchone()
-    num_orders = result[0]
-    
-    cutoff_param=(cutoff,)
-    cur.execute(
-        '''
-        SELECT COUNT(DISTINCT ol.pid)
-        FROM orderlines ol 
-        JOIN orders o ON ol.ono=o.ono
-        WHERE o.odate>=?;
-        ''',
-        cutoff_param
-    )
-    result = cur.fetchone()
-    num_products = result[0]
-    
-    cutoff_param=(cutoff,)
-    cur.execute('SELECT COUNT(DISTINCT o.cid) FROM orders o WHERE o.odate>=?;', cutoff_param)
-    result = cur.fetchone()
-    num_customers = result[0]
-    
-    cutoff_param=(cutoff,)
-    cur.execute(
-        '''
-        SELECT COALESCE(SUM(ol.qty * ol.uprice), 0)
-        FROM orderlines ol JOIN orders o ON ol.ono=o.ono
-        WHERE o.odate>=?;
-        ''',
-        cutoff_param
-    )
-    result = cur.fetchone()
-    
-    if result[0] is not None:
-        total_sales = result[0]
-    else:
-        total_sales = 0.0
-    
-    if num_customers > 0:
-        avg_per_customer = total_sales / num_customers
-    else:
-        avg_per_customer = 0.0
+    # the numbers come from analytics.py (daily rollups); this only prints them
+    summary = recent_sales(conn, days=7)
     
     print("\nLast week's sales report")
-    print(f"Distinct orders: {num_orders}")
-    print(f"Distinct products sold: {num_products}")
-    print(f"Distinct customers: {num_customers}")
-    print(f"Average dollar spent per customer: ${avg_per_customer:.2f}")
-    print(f"Total sales: ${total_sales:.2f}")
+    print(f"Distinct orders: {summary.orders}")
+    print(f"Distinct products sold: {summary.products}")
+    print(f"Distinct customers: {summary.customers}")
+    print(f"Average dollar spent per customer: ${summary.avg_per_customer:.2f}")
+    print(f"Total sales: ${summary.revenue:.2f}")
 
 
-def top_products(conn):
-    cur = conn.cursor()
-    
-    print("\n-- Top 3 products by order counts --")
-    cur.execute(
-        '''
-        SELECT ol.pid, p.name, COUNT(DISTINCT ol.ono) AS cnt
-        FROM orderlines ol 
-        JOIN products p ON ol.pid=p.pid
-        GROUP BY ol.pid
-        ORDER BY cnt DESC, ol.pid ASC;
-        '''
-    )
-    all_rows = cur.fetchall()
-    threshold = None
-    if len(all_rows) <= 3:
-        results = all_rows
-    else:
-        threshold = all_rows[2]['cnt']
-        results = [r for r in all_rows if r['cnt'] >= threshold]
-    print("\n{:<6} {:<30} {:<10}".format("PID", "Name", "Orders"))
-    print("-" * 50)
-    for row in results:
-        print("{:<6} {:<30} {:<10}".format(row['pid'], (row['name'] or '')[:30], row['cnt']))
-    
-    print("\n-- Top 3 products by view counts --")
-    cur.execute(
-        '''
-        SELECT v.pid, p.name, COUNT(*) AS cnt
-        FROM viewedProduct v 
-        JOIN products p ON v.pid=p.pid
-        GROUP BY v.pid
-        ORDER BY cnt DESC, v.pid ASC;
-        '''
-    )
-    all_rows = cur.fetchall()
-    if len(all_rows) <= 3:
-        results = all_rows
-    else:
-        threshold = all_rows[2]['cnt']
-        results = [r for r in all_rows if r['cnt'] >= threshold]
-    print("\n{:<6} {:<30} {:<10}".format("PID", "Name", "Views"))
-    print("-" * 50)
-    for row in results:
-        print("{:<6} {:<30} {:<10}".format(row['pid'], (row['name'] or '')[:30], row['cnt']))
+def top_products(conn, n=3, since=None):
+    # answered from the per-product counters (see topk.py), ties included
+    for metric, title, label in (("orders", "order counts", "Orders"), ("views", "view counts", "Views")):
+        print(f"\n-- Top {n} products by {title} --")
+        results = topk.top_products(conn, metric, n, since)
+        print("\n{:<6} {:<30} {:<10}".format("PID", "Name", label))
+        print("-" * 50)
+        for pid, name, cnt in results:
+            print("{:<6} {:<30} {:<10}".format(pid, (name or '')[:30], cnt))
 
 
+def cache_stats():
+    stats = product_cache.stats()
+    print("\nProduct cache")
+    print(f"Entries: {stats['entries']} / {stats['max_entries']}")
+    print(f"Hits: {stats['hits']}  Misses: {stats['misses']}  Hit rate: {stats['hit_rate']:.1%}")
+    print(f"Stale: {stats['stale']}  Evictions: {stats['evictions']}  Invalidations: {stats['invalidations']}")
+
+
+def query_timings(n=10):
+    if not instrument.enabled():
+        print("\nQuery timing is off. Start the app with COMMERCE_INSTRUMENT=1 to collect it.")
+        return
+    snapshot = instrument.snapshot()
+    print("\n-- Operations --")
+    print("{:<16} {:>8} {:>10} {:>10}".format("Operation", "Count", "p50 (ms)", "p99 (ms)"))
+    print("-" * 48)
+    for name, stat in sorted(snapshot["operations"].items()):
+        print("{:<16} {:>8} {:>10.2f} {:>10.2f}".format(name[:16], stat["count"], stat["p50_ms"], stat["p99_ms"]))
+    print(f"\n-- Top {n} statements by total time --")
+    print("{:<14} {:>7} {:>10} {:>9} {:>8}  {}".format("Operation", "Count", "Total (ms)", "Max (ms)", "Rows", "Statement"))
+    print("-" * 90)
+    for stat in snapshot["statements"][:n]:
+        print("{:<14} {:>7} {:>10.2f} {:>9.2f} {:>8}  {}".format(
+            stat["operation"][:14], stat["count"], stat["total_ms"], stat["max_ms"], stat["rows"], stat["statement"][:40]
+        ))
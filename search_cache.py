@@ -0,0 +1,175 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from search_index import keyword_filter
+
+# Cache of search results keyed by the normalized keyword set.
+# A few hundred keyword combinations make up most searches, so the matching
+# pids (ordered by pid) are kept per sorted, lower-cased keyword tuple and the
+# product rows of the page being shown are then read through the product
+# cache. Entries expire after a TTL, the least recently used ones are evicted
+# past a size bound, and every entry remembers the catalog version it was
+# computed at: the triggers below bump the version whenever a product is
+# added, removed or has its name/description changed (the only writes that
+# can change which pids match), from this process or any other. Price and
+# stock updates leave search results valid and do not bump it.
+#
+# Keyword sets matching more than max_pids products are not materialized;
+# the caller pages through those with the keyset pager instead.
+#
+#   COMMERCE_SEARCH_CACHE_SIZE   maximum number of cached keyword sets (0 = off)
+#   COMMERCE_SEARCH_CACHE_TTL    seconds an entry stays valid
+#   COMMERCE_SEARCH_CACHE_PIDS   largest result list that is cached
+
+DEFAULT_MAX_ENTRIES = int(os.environ.get("COMMERCE_SEARCH_CACHE_SIZE", "512"))
+DEFAULT_TTL = float(os.environ.get("COMMERCE_SEARCH_CACHE_TTL", "300"))
+DEFAULT_MAX_PIDS = int(os.environ.get("COMMERCE_SEARCH_CACHE_PIDS", "1000"))
+
+CATALOG_VERSION_SQL = [
+    """
+    create table if not exists catalog_version (
+        id		int,
+        version		int,
+        primary key (id)
+    )
+    """,
+    "INSERT OR IGNORE INTO catalog_version(id, version) VALUES (1, 0)",
+]
+
+BUMP_VERSION_SQL = "UPDATE catalog_version SET version = version + 1 WHERE id = 1"
+VERSION_SQL = "SELECT version FROM catalog_version WHERE id = 1"
+
+# matching pids of a keyword filter (search_index.keyword_filter)
+PIDS_SQL = "SELECT pid FROM products WHERE {} ORDER BY pid LIMIT ?"
+
+CATALOG_VERSION_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS products_catalog_ai AFTER INSERT ON products BEGIN
+        UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_catalog_ad AFTER DELETE ON products BEGIN
+        UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_catalog_au AFTER UPDATE OF pid, name, descr ON products BEGIN
+        UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+    END
+    """,
+]
+
+
+def create_catalog_version(conn):
+    for sql in CATALOG_VERSION_SQL + CATALOG_VERSION_TRIGGERS:
+        conn.execute(sql)
+    conn.commit()
+
+
+def catalog_version(conn):
+    row = conn.execute(VERSION_SQL).fetchone()
+    return row[0] if row is not None else 0
+
+
+# The cache key: AND semantics don't depend on order, case or repeats
+def normalize(keywords):
+    return tuple(sorted({kw.lower() for kw in keywords if kw}))
+
+
+class SearchCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, max_pids=DEFAULT_MAX_PIDS, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_pids = max_pids
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.stale = 0
+        self.evictions = 0
+        # key -> (catalog version, expiry time, pids or None if too many)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Returns the pids matching every keyword ordered by pid, or None when
+    # there are more than max_pids of them (page with the keyset pager).
+    def search_pids(self, conn, keywords):
+        key = normalize(keywords)
+        version = catalog_version(conn)
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_version, expires, pids = entry
+                if entry_version == version and now < expires:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return pids
+                if entry_version != version:
+                    self.stale += 1
+                else:
+                    self.expired += 1
+                del self._entries[key]
+            self.misses += 1
+        pids = self._query(conn, key)
+        with self._lock:
+            self._store(key, (version, now + self.ttl, pids))
+        return pids
+
+    def _query(self, conn, key):
+        where_sql, params = keyword_filter(conn, list(key))
+        rows = conn.execute(PIDS_SQL.format(where_sql), params + [self.max_pids + 1]).fetchall()
+        if len(rows) > self.max_pids:
+            return None
+        return [r[0] for r in rows]
+
+    def _store(self, key, entry):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "expired": self.expired,
+            "stale": self.stale,
+            "evictions": self.evictions,
+        }
+
+
+# Module-level cache used by customer_search
+_cache = SearchCache()
+
+
+def configure(max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, max_pids=DEFAULT_MAX_PIDS):
+    global _cache
+    _cache = SearchCache(max_entries, ttl, max_pids)
+    return _cache
+
+
+def get_cache():
+    return _cache
+
+
+def search_pids(conn, keywords):
+    return _cache.search_pids(conn, keywords)
+
+
+def stats():
+    return _cache.stats()
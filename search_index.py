@@ -0,0 +1,144 @@
+import sqlite3
+
+# Full-text index over products(name, descr).
+# The trigram tokenizer lets FTS5 answer substring matches (the same thing
+# the old "lower(name) LIKE '%kw%'" did) without scanning every product.
+# The index is an external-content table, so the text lives only in products
+# and the triggers below keep the index in step with inserts/updates/deletes.
+
+FTS_TABLE = "products_fts"
+
+# trigram only indexes 3-character sequences, shorter keywords fall back to LIKE
+MIN_FTS_KEYWORD = 3
+
+FTS_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, descr) VALUES (new.pid, new.name, new.descr);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, descr) VALUES ('delete', old.pid, old.name, old.descr);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF pid, name, descr ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, descr) VALUES ('delete', old.pid, old.name, old.descr);
+        INSERT INTO products_fts(rowid, name, descr) VALUES (new.pid, new.name, new.descr);
+    END
+    """,
+]
+
+
+# Returns True if the products_fts index exists in this database. The
+# answer is kept on the connection (connect_db's connections can hold it):
+# only migrations create the index, and they run when a process starts.
+def has_search_index(conn):
+    found = getattr(conn, "_has_search_index", None)
+    if found is None:
+        row = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+        ).fetchone()
+        found = row is not None
+        _remember(conn, "_has_search_index", found)
+    return found
+
+
+def _remember(conn, name, value):
+    try:
+        setattr(conn, name, value)
+    except AttributeError:
+        # a plain sqlite3.Connection takes no attributes: ask again next time
+        pass
+
+
+# Creates the FTS index and its sync triggers if they are missing.
+# Returns False when this SQLite build has no FTS5 (search then stays on LIKE).
+def ensure_search_index(conn):
+    if has_search_index(conn):
+        for trigger_sql in FTS_TRIGGERS:
+            conn.execute(trigger_sql)
+        conn.commit()
+        return True
+    try:
+        conn.execute(
+            """
+            CREATE VIRTUAL TABLE products_fts USING fts5(
+                name, descr,
+                content='products', content_rowid='pid',
+                tokenize='trigram'
+            )
+            """
+        )
+    except sqlite3.OperationalError:
+        # no fts5 module / no trigram tokenizer in this build
+        conn.rollback()
+        return False
+    for trigger_sql in FTS_TRIGGERS:
+        conn.execute(trigger_sql)
+    # index whatever is already in products
+    rebuild_search_index(conn)
+    _remember(conn, "_has_search_index", True)
+    return True
+
+
+REBUILD_SQL = "INSERT INTO products_fts(products_fts) VALUES ('rebuild')"
+
+
+# Re-reads every product into the index (used after creation or bulk loads)
+def rebuild_search_index(conn):
+    conn.execute(REBUILD_SQL)
+    conn.commit()
+
+
+# Quotes a keyword as an FTS5 string so user input is never parsed as query syntax
+def _fts_phrase(keyword):
+    return '"' + keyword.replace('"', '""') + '"'
+
+
+# SQLite's lower() and LIKE only fold A-Z, while the trigram index folds
+# every letter. Keywords with other letters are matched against this
+# Python-side lower() instead, so both paths find the same products.
+def _unicode_lower(text):
+    return text.lower() if isinstance(text, str) else text
+
+
+def _register_unicode_lower(conn):
+    if not getattr(conn, "_unicode_lower", False):
+        conn.create_function("unicode_lower", 1, _unicode_lower, deterministic=True)
+        _remember(conn, "_unicode_lower", True)
+
+
+# Builds a WHERE clause over the products table that matches every keyword
+# (AND across keywords) as a case-insensitive substring of name OR descr.
+# Returns (where_sql, params); the SQL shape only depends on keyword lengths
+# (and on whether they are ASCII), all user text is passed as bound
+# parameters.
+def keyword_filter(conn, keywords, use_index=True):
+    keywords = [kw.lower() for kw in keywords if kw]
+    parts = []
+    params = []
+    if use_index and has_search_index(conn):
+        indexed = [kw for kw in keywords if len(kw) >= MIN_FTS_KEYWORD]
+        scanned = [kw for kw in keywords if len(kw) < MIN_FTS_KEYWORD]
+    else:
+        indexed = []
+        scanned = keywords
+    if indexed:
+        # one MATCH for all long keywords: implicit AND between the phrases
+        match_expr = " AND ".join("{name descr} : " + _fts_phrase(kw) for kw in indexed)
+        parts.append("pid IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)")
+        params.append(match_expr)
+    for kw in scanned:
+        like_kw = f"%{kw}%"
+        if kw.isascii():
+            # the built-in lower() is much faster and folds the same for ASCII
+            parts.append("(lower(name) LIKE ? OR lower(descr) LIKE ?)")
+        else:
+            _register_unicode_lower(conn)
+            parts.append("(unicode_lower(name) LIKE ? OR unicode_lower(descr) LIKE ?)")
+        params.extend([like_kw, like_kw])
+    if not parts:
+        return "1", []
+    return " AND ".join(parts), params
@@ -0,0 +1,287 @@
+import argparse
+import asyncio
+import json
+import signal
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import activity
+import carts
+import instrument
+import passwords
+import services
+from db import init_db, PROFILES, DEFAULT_PROFILE
+from migrations import migrate
+from pool import ConnectionPool, PoolError
+
+# Network front-end: many concurrent customer/sales sessions in one process.
+#
+#   python3 server.py [db_path] [--host 127.0.0.1] [--port 8765] [--readers 4]
+#
+# Clients connect over TCP and speak the same JSONL protocol as
+# `app.py --script`: one command object per line, one response per line, in
+# order (see services.dispatch). Sessions are explicit in the commands
+# (cid, session_no), so any number of them can share one socket, and any
+# number of sockets are served by one asyncio event loop.
+#
+# SQLite calls block, so they run on threads, with connections from a
+# pool.ConnectionPool:
+#   - read operations run on a pool of threads, each borrowing one of the
+#     read-only connections (WAL lets them read while the writer writes);
+#   - every write goes through the pool's writer queue, drained by a single
+#     writer thread that runs the queued writes in order on the one writer
+#     connection. Writes never contend for the database lock with each
+#     other, and the writer never waits for a turn of the (busy) event loop
+#     between writes.
+# The activity events of reads (searches, product views) are handed to the
+# writer without waiting for them, and cart changes are held in memory and
+# written behind (carts.py; a timer task writes those of idle sessions). Password hashing (login, signup) runs on
+# the hashing threads of passwords.py, so a burst of logins doesn't hold up
+# the readers or the writer. {"op": "server_stats"} returns the
+# server's and the pool's counters, {"op": "metrics"} the statement timings
+# of instrument.py (as JSON, or {"format": "prometheus"} text; the server
+# must run with COMMERCE_INSTRUMENT=1 to collect them).
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_READERS = 4
+
+# longest accepted command line, in bytes
+MAX_LINE = 64 * 1024
+
+READ_OPS = {
+    "login", "search", "get_product", "get_cart", "list_orders", "get_order",
+    "sales_report", "top_products",
+}
+WRITE_OPS = {
+    "signup", "start_session", "end_session", "add_to_cart", "update_cart",
+    "remove_from_cart", "add_items_to_cart", "reorder", "checkout", "update_price",
+    "update_stock",
+}
+
+
+class StoreServer:
+    def __init__(self, db_path=None, readers=DEFAULT_READERS, profile=None):
+        self.db_path = db_path
+        self.profile = profile
+        self.readers = readers
+        self.clients = 0
+        self.requests = 0
+        self.pool = None
+        # one thread per reader connection, so reads never wait for a connection
+        self._reader_threads = ThreadPoolExecutor(readers, thread_name_prefix="reader")
+        self._server = None
+        self._cart_flusher = None
+
+    # Creates or upgrades the schema (and seeds an empty default database)
+    def _prepare_db(self, conn):
+        if self.db_path is None:
+            init_db(conn)
+        else:
+            migrate(conn)
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.pool = ConnectionPool(self.db_path, readers=self.readers, profile=self.profile)
+        await self.submit_write(self._prepare_db)
+        self._server = await asyncio.start_server(self.handle_client, host, port, limit=MAX_LINE)
+        self._cart_flusher = asyncio.create_task(self._flush_carts())
+        return self._server.sockets[0].getsockname()[:2]
+
+    # Writes cart changes that have waited max_delay (carts.py) even when
+    # their sessions are idle
+    async def _flush_carts(self):
+        while True:
+            await asyncio.sleep(max(carts.get_store().max_delay, 0.1))
+            try:
+                await self.submit_write(carts.flush_stale)
+            except (PoolError, sqlite3.Error):
+                pass  # closed, or retried on the next round
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    # Stops accepting clients, finishes queued writes and flushes buffered
+    # activity and cart changes
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._cart_flusher is not None:
+            self._cart_flusher.cancel()
+        if self.pool is not None and not self.pool.closed:
+            # queued after every pending write
+            await self.submit_write(lambda conn: carts.flush_stale(conn, everything=True))
+            await self.submit_write(activity.close)
+            await asyncio.get_running_loop().run_in_executor(None, self.pool.close)
+        self._reader_threads.shutdown()
+
+    # ---- writes ----
+
+    # Queues func(writer connection); returns an awaitable for its result, or
+    # None when nobody waits for it (wait=False)
+    def submit_write(self, func, wait=True):
+        future = self.pool.submit(func)
+        return asyncio.wrap_future(future) if wait else None
+
+    # ---- requests ----
+
+    def _read(self, command):
+        with self.pool.reader() as conn:
+            return services.dispatch(conn, command)
+
+    def stats(self):
+        return dict(self.pool.stats(), clients=self.clients, requests=self.requests, carts=carts.stats())
+
+    # Runs one command and returns its response
+    async def execute(self, command):
+        self.requests += 1
+        op = command.get("op") if isinstance(command, dict) else None
+        if op in ("server_stats", "metrics"):
+            if op == "server_stats":
+                result = self.stats()
+            elif command.get("format") == "prometheus":
+                result = instrument.to_prometheus()
+            else:
+                result = instrument.snapshot()
+            return services.ok_response(command, result)
+        if op == "login":
+            return await self._login(command)
+        if op == "signup":
+            return await self._signup(command)
+        if op in WRITE_OPS:
+            return await self.submit_write(lambda conn: services.dispatch(conn, command))
+        recorded = op in ("search", "get_product") and command.get("record", True)
+        if recorded:
+            # read without writing; the event goes to the writer
+            command = dict(command, record=False)
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(self._reader_threads, self._read, command)
+        if recorded and response.get("ok"):
+            if op == "search":
+                args = (command["cid"], command["session_no"], command["keywords"])
+                self.submit_write(lambda conn: services.record_search(conn, *args), wait=False)
+            else:
+                args = (command["cid"], command["session_no"], command["pid"])
+                self.submit_write(lambda conn: services.record_view(conn, *args), wait=False)
+        return response
+
+    def _find_account(self, user):
+        with self.pool.reader() as conn:
+            return services.find_account(conn, user)
+
+    # services.login in steps: the account is read on a reader thread, the
+    # password checked on a hashing thread, and an old-format hash replaced
+    # in the background
+    async def _login(self, command):
+        try:
+            _, args = services.bind(command)
+            services._check_password(args["password"])
+            loop = asyncio.get_running_loop()
+            account = await loop.run_in_executor(self._reader_threads, self._find_account, args["user"])
+            ok = await asyncio.wrap_future(passwords.verify_async(args["password"], account and account["pwd"]))
+            if not ok:
+                raise services.AuthError("Invalid login credentials.")
+        except (services.ServiceError, sqlite3.Error) as e:
+            return services.error_response(command, e)
+        if passwords.needs_rehash(account["pwd"]):
+            self._rehash(account["uid"], args["password"], account["pwd"])
+        return services.ok_response(command, {"uid": account["uid"], "role": account["role"]})
+
+    def _rehash(self, uid, password, old):
+        def store(future):
+            encoded = future.result()
+            try:
+                self.pool.submit(lambda conn: services.set_password_hash(conn, uid, encoded, old))
+            except PoolError:
+                pass  # shutting down; the next login tries again
+
+        passwords.hash_async(password).add_done_callback(store)
+
+    # services.signup with the password hashed on a hashing thread first, so
+    # the writer only inserts the rows
+    async def _signup(self, command):
+        try:
+            _, args = services.bind(command)
+            services._check_email(args["email"])
+            services._check_password(args["password"])
+        except services.ServiceError as e:
+            return services.error_response(command, e)
+        encoded = await asyncio.wrap_future(passwords.hash_async(args["password"]))
+        args = {"name": args["name"], "email": args["email"], "encoded": encoded}
+        return await self.submit_write(lambda conn: services.call(conn, command, services.create_customer, args))
+
+    async def handle_client(self, reader, writer):
+        self.clients += 1
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # longer than MAX_LINE: the stream can't be resynchronized
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    command = json.loads(line)
+                except ValueError as e:
+                    response = {"ok": False, "error": "ValidationError", "message": f"bad JSON: {e}"}
+                else:
+                    try:
+                        response = await self.execute(command)
+                    except Exception as e:
+                        response = {"ok": False, "error": "InternalError", "message": str(e)}
+                writer.write((json.dumps(response, default=str) + "\n").encode("utf-8"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients -= 1
+            writer.close()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Store server (JSONL over TCP)")
+    parser.add_argument("db_path", nargs="?", default=None, help="existing database file (default: local ecommerce.db)")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="0 picks a free port")
+    parser.add_argument("--readers", type=int, default=DEFAULT_READERS, help="reader connections")
+    parser.add_argument(
+        "--profile",
+        choices=sorted(PROFILES),
+        default=None,
+        help=f"connection profile (default: $COMMERCE_DB_PROFILE or {DEFAULT_PROFILE})",
+    )
+    return parser.parse_args(argv)
+
+
+async def serve(args):
+    server = StoreServer(args.db_path, args.readers, args.profile)
+    host, port = await server.start(args.host, args.port)
+    print(f"listening on {host}:{port}", flush=True)
+    # SIGTERM shuts down like Ctrl-C: queued writes and activity are flushed
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass
+    try:
+        await server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await server.close()
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
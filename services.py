@@ -0,0 +1,544 @@
+import bisect
+import inspect
+import math
+import sqlite3
+import string
+from datetime import datetime
+
+import activity
+import carts
+import instrument
+import passwords
+import product_cache
+import search_cache
+import topk
+from analytics import recent_sales
+from checkout import checkout as _checkout, CheckoutError
+from ids import next_id
+from search_index import keyword_filter
+from sessions import start_customer_session, end_customer_session
+
+# Service layer: the store's operations as plain functions.
+# Nothing here reads input or prints; every function takes an open
+# connection and explicit arguments, returns plain data (dicts, lists,
+# numbers) and reports failures by raising a ServiceError subclass (or one
+# of the checkout errors from checkout.py). The interactive screens in
+# customer.py, sales.py and auth.py, and the JSONL script mode of app.py
+# (see dispatch below) are built on top of it.
+
+# most lines accepted by one add_items_to_cart call
+MAX_CART_BATCH = 1000
+
+# statements of the hot operations (their plans are checked by query_plans.py)
+ACCOUNT_BY_UID_SQL = "SELECT uid, role, pwd FROM users WHERE uid = ?"
+ACCOUNT_BY_EMAIL_SQL = """
+    SELECT u.uid, u.role, u.pwd
+    FROM customers c
+    JOIN users u ON u.uid = c.cid
+    WHERE c.email_norm = ?
+    """
+EMAIL_TAKEN_SQL = "SELECT 1 FROM customers WHERE email_norm = ?"
+# search() past the cached results, over a keyword_filter WHERE clause
+SEARCH_PAGE_SQL = (
+    "SELECT pid, name, category, price, stock_count, descr FROM products WHERE ({}) AND pid > ? ORDER BY pid LIMIT ?"
+)
+ORDER_OWNER_SQL = "SELECT cid FROM orders WHERE ono = ?"
+ORDER_ITEMS_SQL = "SELECT pid, qty FROM orderlines WHERE ono = ? ORDER BY lineNo"
+# list_orders(), with "o.cid = ?" and optionally the (odate, ono) seek
+ORDERS_PAGE_SQL = """
+    SELECT o.ono, o.odate, o.shipping_address,
+           (SELECT COALESCE(SUM(ol.qty * ol.uprice), 0) FROM orderlines ol WHERE ol.ono = o.ono) AS total
+    FROM orders o
+    WHERE {}
+    ORDER BY o.odate DESC, o.ono DESC LIMIT ?
+    """
+ORDER_SQL = "SELECT ono, cid, odate, shipping_address FROM orders WHERE ono = ?"
+ORDER_LINES_SQL = """
+    SELECT ol.lineNo, ol.pid, p.name, p.category, ol.qty, ol.uprice, (ol.qty * ol.uprice) AS line_total
+    FROM orderlines ol JOIN products p ON ol.pid = p.pid
+    WHERE ol.ono = ?
+    ORDER BY ol.lineNo
+    """
+
+
+class ServiceError(Exception):
+    pass
+
+
+class ValidationError(ServiceError):
+    pass
+
+
+class NotFoundError(ServiceError):
+    pass
+
+
+class AuthError(ServiceError):
+    pass
+
+
+class DuplicateEmailError(ServiceError):
+    pass
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _product_dict(row):
+    return {
+        "pid": row["pid"],
+        "name": row["name"],
+        "category": row["category"],
+        "price": row["price"],
+        "stock_count": row["stock_count"],
+        "descr": row["descr"],
+    }
+
+
+# ---- accounts and sessions ----
+
+# A-Z only, like SQLite's lower(), so Python and the email_norm triggers
+# (migrations.py) agree
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+# The email_norm of an address: trimmed, A-Z lowercased
+def normalize_email(email):
+    email = email.strip()
+    # str.lower() is much faster than translate() and the same on ASCII
+    return email.lower() if email.isascii() else email.translate(_ASCII_LOWER)
+
+
+# Returns the account {"uid", "role", "pwd"} of a uid or an email address,
+# or None. Exactly one indexed statement: an all-digit identifier can't be
+# a valid email address, so it is only looked up as a uid, anything else
+# only by email_norm.
+def find_account(conn, user):
+    user = str(user).strip()
+    if user.isdigit():
+        row = conn.execute(ACCOUNT_BY_UID_SQL, (int(user),)).fetchone()
+    else:
+        row = conn.execute(ACCOUNT_BY_EMAIL_SQL, (normalize_email(user),)).fetchone()
+    if row is None:
+        return None
+    return {"uid": row["uid"], "role": row["role"], "pwd": row["pwd"]}
+
+
+# Replaces a password hash, unless it was changed since `old` was read
+def set_password_hash(conn, uid, encoded, old):
+    conn.execute("UPDATE users SET pwd = ? WHERE uid = ? AND pwd = ?", (encoded, uid, old))
+    conn.commit()
+
+
+# Returns {"uid": ..., "role": ...} for a uid or an email address and
+# password; raises AuthError. A hash in an old format (or cost) is replaced
+# by one in the current format (see passwords.py).
+def login(conn, user, password):
+    _check_password(password)
+    account = find_account(conn, user)
+    if not passwords.verify_password(password, account and account["pwd"]):
+        raise AuthError("Invalid login credentials.")
+    if passwords.needs_rehash(account["pwd"]):
+        set_password_hash(conn, account["uid"], passwords.hash_password(password), account["pwd"])
+    return {"uid": account["uid"], "role": account["role"]}
+
+
+def _check_password(password):
+    if not isinstance(password, str):
+        raise ValidationError("The password must be a string.")
+
+
+def _check_email(email):
+    email = (email or "").strip()
+    if not email:
+        raise ValidationError("Email address is required.")
+    if "@" not in email or "." not in email:
+        raise ValidationError("Invalid email format.")
+    return email
+
+
+# Registers a customer and returns the new uid
+def signup(conn, name, email, password):
+    _check_email(email)
+    _check_password(password)
+    return create_customer(conn, name, email, passwords.hash_password(password))
+
+
+# signup() with the password already hashed (by passwords.hash_async)
+def create_customer(conn, name, email, encoded):
+    email = _check_email(email)
+    email_norm = normalize_email(email)
+    if conn.execute(EMAIL_TAKEN_SQL, (email_norm,)).fetchone():
+        raise DuplicateEmailError("Email address already in use.")
+    uid = next_id(conn, "users")
+    try:
+        conn.execute("INSERT INTO users(uid, pwd, role) VALUES(?,?,?)", (uid, encoded, "customer"))
+        conn.execute(
+            "INSERT INTO customers(cid, name, email, email_norm) VALUES(?,?,?,?)",
+            (uid, (name or "").strip(), email, email_norm),
+        )
+        conn.commit()
+    except sqlite3.IntegrityError as e:
+        conn.rollback()
+        raise ValidationError(f"Registration failed: {e}")
+    return uid
+
+
+def start_session(conn, cid):
+    return start_customer_session(conn, cid)
+
+
+def end_session(conn, cid, session_no):
+    end_customer_session(conn, cid, session_no)
+
+
+# ---- catalog ----
+
+# Returns up to `limit` products matching every keyword with pid > after,
+# ordered by pid (pass the last pid of a page as `after` for the next one).
+# The search is recorded for the session unless record=False.
+def search(conn, cid, session_no, keywords, after=0, limit=5, record=True):
+    if isinstance(keywords, str):
+        keywords = keywords.split()
+    keywords = [kw.lower() for kw in keywords if kw]
+    if not keywords:
+        raise ValidationError("Empty keyword.")
+    if record:
+        record_search(conn, cid, session_no, keywords)
+    pids = search_cache.search_pids(conn, keywords)
+    if pids is not None:
+        start = bisect.bisect_right(pids, after)
+        page = pids[start:start + limit]
+        products = product_cache.get_products(conn, page)
+        return [_product_dict(products[pid]) for pid in page if pid in products]
+    where_sql, params = keyword_filter(conn, keywords)
+    rows = conn.execute(SEARCH_PAGE_SQL.format(where_sql), params + [after, limit]).fetchall()
+    return [_product_dict(r) for r in rows]
+
+
+# Returns one product; records the view for the session unless record=False
+def get_product(conn, cid, session_no, pid, record=True):
+    row = product_cache.get_product(conn, pid)
+    if row is None:
+        raise NotFoundError(f"Product {pid} not found.")
+    if record:
+        record_view(conn, cid, session_no, pid)
+    return _product_dict(row)
+
+
+# The activity events behind search and get_product, for callers that read
+# on one connection and write on another (the server)
+def record_search(conn, cid, session_no, keywords):
+    if not isinstance(keywords, str):
+        keywords = " ".join(keywords)
+    activity.record(conn, "search", (cid, session_no, _now(), keywords))
+
+
+def record_view(conn, cid, session_no, pid):
+    activity.record(conn, "viewedProduct", (cid, session_no, _now(), pid))
+
+
+# ---- cart and checkout ----
+
+# The session's cart is held in memory by carts.py and written to the cart
+# table behind the changes (see there).
+
+# Adds qty of pid to the session's cart and returns the new cart quantity
+def add_to_cart(conn, cid, session_no, pid, qty=1):
+    if qty <= 0:
+        raise ValidationError("Quantity must be positive.")
+    try:
+        return carts.add(conn, cid, session_no, pid, qty)
+    except carts.UnknownProductError as e:
+        raise NotFoundError(str(e))
+
+
+# Sets the cart quantity of a product already in the cart
+def update_cart(conn, cid, session_no, pid, qty):
+    if qty <= 0:
+        raise ValidationError("Quantity must be positive.")
+    try:
+        return carts.update(conn, cid, session_no, pid, qty)
+    except carts.CartError as e:
+        raise NotFoundError(str(e))
+
+
+# Adds many products to the cart at once. items is a list of {"pid", "qty"}
+# (or [pid, qty]); the stock of all of them is checked together and the
+# cart lines are written in one transaction. An unknown product or a line
+# beyond the stock raises NotFoundError / InsufficientStockError and adds
+# nothing, unless partial: then those lines are skipped. Returns
+# {"added": [{"pid", "qty" (new cart qty)}], "skipped": [{"pid", "error"}]}.
+def add_items_to_cart(conn, cid, session_no, items, partial=False):
+    lines = _cart_batch(items)
+    try:
+        added, skipped = carts.add_many(conn, cid, session_no, lines, partial)
+    except carts.UnknownProductError as e:
+        raise NotFoundError(str(e))
+    return {
+        "added": [{"pid": pid, "qty": qty} for pid, qty in added],
+        "skipped": [{"pid": e.pid, "error": str(e)} for e in skipped],
+    }
+
+
+def _cart_batch(items):
+    if not isinstance(items, list) or not items:
+        raise ValidationError("items must be a non-empty list.")
+    if len(items) > MAX_CART_BATCH:
+        raise ValidationError(f"At most {MAX_CART_BATCH} items at once.")
+    lines = []
+    for item in items:
+        if isinstance(item, dict):
+            pid, qty = item.get("pid"), item.get("qty", 1)
+        elif isinstance(item, (list, tuple)) and len(item) == 2:
+            pid, qty = item
+        else:
+            raise ValidationError(f"Bad cart item {item!r}, expected {{'pid': ..., 'qty': ...}}.")
+        if type(pid) is not int or type(qty) is not int:
+            raise ValidationError(f"Bad cart item {item!r}: pid and qty must be integers.")
+        if qty <= 0:
+            raise ValidationError("Quantity must be positive.")
+        lines.append((pid, qty))
+    return lines
+
+
+# Adds the lines of one of the customer's past orders to the cart (see
+# add_items_to_cart; by default lines that are no longer available are skipped)
+def reorder(conn, cid, session_no, ono, partial=True):
+    order = conn.execute(ORDER_OWNER_SQL, (ono,)).fetchone()
+    if order is None or order["cid"] != cid:
+        raise NotFoundError(f"Order {ono} not found.")
+    lines = conn.execute(ORDER_ITEMS_SQL, (ono,)).fetchall()
+    if not lines:
+        raise NotFoundError(f"Order {ono} has no lines.")
+    return add_items_to_cart(conn, cid, session_no, [[line["pid"], line["qty"]] for line in lines], partial)
+
+
+def remove_from_cart(conn, cid, session_no, pid):
+    try:
+        carts.remove(conn, cid, session_no, pid)
+    except carts.NotInCartError as e:
+        raise NotFoundError(str(e))
+
+
+# Returns the {"pid", "qty"} lines of a session's cart ordered by pid
+def cart_lines(conn, cid, session_no):
+    return [{"pid": pid, "qty": qty} for pid, qty in carts.lines(conn, cid, session_no)]
+
+
+# Joins cart lines with their products in memory: a dict per line with the
+# product fields plus the cart qty. The product columns come from the
+# product cache instead of a join.
+def cart_items(conn, lines):
+    products = product_cache.get_products(conn, [line["pid"] for line in lines])
+    items = []
+    for line in lines:
+        if line["pid"] in products:
+            item = _product_dict(products[line["pid"]])
+            item["qty"] = line["qty"]
+            items.append(item)
+    return items
+
+
+# Returns the session's cart ordered by pid (see cart_items)
+def get_cart(conn, cid, session_no):
+    return cart_items(conn, cart_lines(conn, cid, session_no))
+
+
+# Places an order for the whole cart; returns {"ono": ..., "total": ...}.
+# Raises ValidationError, or EmptyCartError / InsufficientStockError /
+# DatabaseBusyError from the checkout engine.
+def checkout(conn, cid, session_no, address):
+    address = (address or "").strip()
+    if not address:
+        raise ValidationError("Address required.")
+    # the checkout engine reads the cart table
+    carts.flush(conn, cid, session_no)
+    ono, total = _checkout(conn, cid, session_no, address)
+    carts.checked_out(cid, session_no)
+    return {"ono": ono, "total": total}
+
+
+# ---- orders ----
+
+# Returns up to `limit` of the customer's orders, newest first, with their
+# totals. Pass the (odate, ono) of the last order of a page as `before`
+# for the next page.
+def list_orders(conn, cid, before=None, limit=5):
+    where = "o.cid = ?"
+    params = [cid]
+    if before is not None:
+        where += " AND (o.odate, o.ono) < (?, ?)"
+        params.extend(before)
+    rows = conn.execute(ORDERS_PAGE_SQL.format(where), params + [limit]).fetchall()
+    return [dict(r) for r in rows]
+
+
+# Returns an order with its lines; cid=None skips the ownership check
+def get_order(conn, ono, cid=None):
+    order = conn.execute(ORDER_SQL, (ono,)).fetchone()
+    if order is None or (cid is not None and order["cid"] != cid):
+        raise NotFoundError(f"Order {ono} not found.")
+    lines = conn.execute(ORDER_LINES_SQL, (ono,)).fetchall()
+    result = dict(order)
+    result["lines"] = [dict(ln) for ln in lines]
+    result["total"] = sum(ln["line_total"] or 0 for ln in lines)
+    return result
+
+
+# ---- sales ----
+
+def update_price(conn, pid, price):
+    if not (math.isfinite(price) and price > 0):
+        raise ValidationError("Price must be positive.")
+    return _update_product(conn, pid, "price", price)
+
+
+def update_stock(conn, pid, stock):
+    if stock < 0:
+        raise ValidationError("Stock must be a non-negative integer.")
+    return _update_product(conn, pid, "stock_count", stock)
+
+
+def _update_product(conn, pid, column, value):
+    cur = conn.execute(f"UPDATE products SET {column} = ? WHERE pid = ?", (value, pid))
+    conn.commit()
+    if cur.rowcount == 0:
+        raise NotFoundError(f"Product {pid} does not exist.")
+    product_cache.invalidate([pid])
+    return value
+
+
+# The weekly report numbers (sales_report(conn) is the last 7 days)
+def sales_report(conn, days=7):
+    return recent_sales(conn, days).as_dict()
+
+
+def top_products(conn, metric="orders", n=3, since=None):
+    try:
+        rows = topk.top_products(conn, metric, n, since)
+    except ValueError as e:
+        raise ValidationError(str(e))
+    return [{"pid": pid, "name": name, "count": cnt} for pid, name, cnt in rows]
+
+
+# ---- scripted access ----
+
+# Operation name -> function, for dispatch(); every argument after conn is
+# passed by keyword from the command
+OPERATIONS = {
+    "login": login,
+    "signup": signup,
+    "start_session": start_session,
+    "end_session": end_session,
+    "search": search,
+    "get_product": get_product,
+    "add_to_cart": add_to_cart,
+    "update_cart": update_cart,
+    "remove_from_cart": remove_from_cart,
+    "add_items_to_cart": add_items_to_cart,
+    "reorder": reorder,
+    "get_cart": get_cart,
+    "checkout": checkout,
+    "list_orders": list_orders,
+    "get_order": get_order,
+    "update_price": update_price,
+    "update_stock": update_stock,
+    "sales_report": sales_report,
+    "top_products": top_products,
+}
+
+
+def _is_int(value):
+    return type(value) is int
+
+
+def _is_number(value):
+    return type(value) in (int, float) and math.isfinite(value)
+
+
+def _is_str(value):
+    return isinstance(value, str)
+
+
+# JSON type of every operation argument: name -> (check, what it must be).
+# Commands come from JSON, so "2" for an integer or [1] for a pid are
+# rejected here instead of failing inside the operation.
+ARG_TYPES = {
+    "user": (lambda v: _is_str(v) or _is_int(v), "a string or an integer"),
+    "password": (_is_str, "a string"),
+    "name": (_is_str, "a string"),
+    "email": (_is_str, "a string"),
+    "address": (_is_str, "a string"),
+    "metric": (_is_str, "a string"),
+    "since": (lambda v: v is None or _is_str(v), "a date string or null"),
+    "keywords": (lambda v: _is_str(v) or (isinstance(v, list) and all(_is_str(k) for k in v)),
+                 "a string or a list of strings"),
+    "record": (lambda v: type(v) is bool, "true or false"),
+    "partial": (lambda v: type(v) is bool, "true or false"),
+    "items": (lambda v: isinstance(v, list), "a list"),
+    "before": (lambda v: v is None or (isinstance(v, list) and len(v) == 2 and _is_str(v[0]) and _is_int(v[1])),
+               "null or [odate, ono]"),
+    "price": (_is_number, "a finite number"),
+}
+for _name in ("cid", "session_no", "pid", "qty", "ono", "after", "limit", "stock", "days", "n"):
+    ARG_TYPES[_name] = (_is_int, "an integer")
+
+
+# Checks a command {"op": name, ...arguments..., "id": optional} against
+# the operation's signature and ARG_TYPES; returns (func, args) or raises
+# ValidationError
+def bind(command, operations=OPERATIONS):
+    if not isinstance(command, dict) or "op" not in command:
+        raise ValidationError('a command is a JSON object with an "op" field')
+    func = operations.get(command["op"])
+    if func is None:
+        raise ValidationError(f"unknown op {command['op']!r}")
+    args = {k: v for k, v in command.items() if k not in ("op", "id")}
+    try:
+        inspect.signature(func).bind(None, **args)
+    except TypeError as e:
+        raise ValidationError(f"bad arguments for {command['op']}: {e}")
+    for name, value in args.items():
+        check, expected = ARG_TYPES.get(name, (None, None))
+        if check is not None and not check(value):
+            raise ValidationError(f"bad arguments for {command['op']}: {name} must be {expected}, not {value!r}")
+    return func, args
+
+
+def ok_response(command, result):
+    response = {"id": command["id"]} if isinstance(command, dict) and "id" in command else {}
+    response["ok"] = True
+    response["result"] = result
+    return response
+
+
+def error_response(command, error):
+    response = {"id": command["id"]} if isinstance(command, dict) and "id" in command else {}
+    response["ok"] = False
+    response["error"] = type(error).__name__
+    response["message"] = str(error)
+    return response
+
+
+# Runs func(conn, **args) for a bound command and returns its response
+def call(conn, command, func, args):
+    try:
+        with instrument.operation(command["op"]):
+            return ok_response(command, func(conn, **args))
+    except (ServiceError, CheckoutError, sqlite3.Error) as e:
+        if conn.in_transaction:
+            conn.rollback()
+        return error_response(command, e)
+
+
+# Runs one command and returns the response {"ok": true, "result": ...} or
+# {"ok": false, "error": type, "message": text}; the command's "id" is
+# echoed back. Never raises for a bad command or a failed operation.
+def dispatch(conn, command):
+    try:
+        func, args = bind(command)
+    except ValidationError as e:
+        return error_response(command, e)
+    return call(conn, command, func, args)
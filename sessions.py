@@ -1,24 +1,32 @@
 from datetime import datetime
 
+import activity
+import carts
+
+NEXT_SESSION_SQL = "SELECT COALESCE(MAX(sessionNo), 0) + 1 FROM sessions WHERE cid = ?"
+END_SESSION_SQL = "UPDATE sessions SET end_time = ? WHERE cid = ? AND sessionNo = ?"
+
 
 def start_customer_session(conn, cid):
     cur = conn.cursor()
-    cur.execute("SELECT COALESCE(MAX(sessionNo), 0) + 1 FROM sessions WHERE cid = ?", (cid,))
+    cur.execute(NEXT_SESSION_SQL, (cid,))
     session_no = cur.fetchone()[0]
     cur.execute(
-        "INSERT INTO sessions(cid, sessionNo, start_time) VALUES(?,?,?)",
-        (cid, session_no, datetime.now().strftime("%Y-%m-%d")),
+        "INSERT INTO sessions(cid, sessionNo, start_time, owner) VALUES(?,?,?,?)",
+        (cid, session_no, datetime.now().strftime("%Y-%m-%d"), carts.session_owner()),
     )
     conn.commit()
+    # the cart of a session that crashed before it ended carries over
+    carts.start(conn, cid, session_no)
     return session_no
 
 
 def end_customer_session(conn, cid, session_no):
+    # write out any searches/views still buffered for this session, and its cart
+    activity.flush(conn)
+    carts.close(conn, cid, session_no)
     cur = conn.cursor()
-    cur.execute(
-        "UPDATE sessions SET end_time = ? WHERE cid = ? AND sessionNo = ?",
-        (datetime.now().strftime("%Y-%m-%d"), cid, session_no),
-    )
+    cur.execute(END_SESSION_SQL, (datetime.now().strftime("%Y-%m-%d"), cid, session_no))
     conn.commit()
 
 
@@ -0,0 +1,55 @@
+import contextlib
+import io
+import multiprocessing
+
+from auth import generate_new_uid
+from customer import add_to_cart, place_order
+from db import connect_db, init_db
+from sessions import end_customer_session, start_customer_session
+
+WORKERS = 4
+ORDERS_PER_WORKER = 20
+
+
+# One customer process of benchmarks/bench_checkout.py
+def _worker(db_path, orders, results):
+    conn = connect_db(db_path)
+    cid = generate_new_uid(conn)
+    conn.execute("INSERT INTO users(uid, pwd, role) VALUES(?, '', 'customer')", (cid,))
+    conn.execute("INSERT INTO customers(cid, name, email) VALUES(?,?,?)", (cid, f"test {cid}", f"{cid}@example.com"))
+    conn.commit()
+    session_no = start_customer_session(conn, cid)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(orders):
+            add_to_cart(conn, cid, session_no, 1 + i % 6, 1)
+            place_order(conn, cid, session_no, f"{cid} test street")
+    end_customer_session(conn, cid, session_no)
+    conn.close()
+    results.put(cid)
+
+
+# Processes checking out at the same time must never share an order number
+def test_concurrent_checkouts_get_distinct_order_numbers(tmp_path):
+    db_path = str(tmp_path / "checkout.db")
+    conn = connect_db(db_path)
+    init_db(conn)
+    conn.execute("UPDATE products SET stock_count = 1000000")
+    conn.commit()
+
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=_worker, args=(db_path, ORDERS_PER_WORKER, results)) for _ in range(WORKERS)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert [p.exitcode for p in procs] == [0] * WORKERS
+    cids = [results.get() for _ in procs]
+
+    placed = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    distinct = conn.execute("SELECT COUNT(DISTINCT ono) FROM orders").fetchone()[0]
+    owners = conn.execute("SELECT COUNT(DISTINCT cid) FROM orders").fetchone()[0]
+    conn.close()
+    assert len(set(cids)) == WORKERS
+    assert placed == WORKERS * ORDERS_PER_WORKER
+    assert distinct == placed
+    assert owners == WORKERS
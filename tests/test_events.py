@@ -0,0 +1,43 @@
+import time
+from datetime import datetime
+
+from activity import write_events
+from db import connect_db, init_db
+
+# what benchmarks/bench_events.py asks of the activity writer
+TARGET_RATE = 100_000
+NUM_EVENTS = 200_000
+BATCH_SIZE = 10_000
+
+
+# Every event of a batch shares one timestamp (once a primary-key conflict):
+# all of them must be stored, at 100k events per second or more
+def test_write_events_rate_without_conflicts(tmp_path):
+    conn = connect_db(str(tmp_path / "events.db"))
+    init_db(conn)
+    conn.execute("INSERT INTO users(uid, pwd, role) VALUES(2, '', 'customer')")
+    conn.execute("INSERT INTO customers(cid, name, email) VALUES(2, 'bench', 'bench@example.com')")
+    conn.execute("INSERT INTO sessions(cid, sessionNo, start_time) VALUES(2, 1, '2024-01-01')")
+    conn.commit()
+
+    start = time.perf_counter()
+    dropped = 0
+    for _ in range(NUM_EVENTS // BATCH_SIZE):
+        ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        events = []
+        for i in range(BATCH_SIZE):
+            if i % 4:
+                events.append(("viewedProduct", (2, 1, ts, 1 + i % 6)))
+            else:
+                events.append(("search", (2, 1, ts, "widget")))
+        dropped += write_events(conn, events)
+    rate = NUM_EVENTS / (time.perf_counter() - start)
+
+    stored = conn.execute("SELECT COUNT(*) FROM viewedProduct").fetchone()[0]
+    stored += conn.execute("SELECT COUNT(*) FROM search").fetchone()[0]
+    views = conn.execute("SELECT SUM(views) FROM product_counts").fetchone()[0]
+    conn.close()
+    assert dropped == 0
+    assert stored == NUM_EVENTS
+    assert views == NUM_EVENTS * 3 // 4
+    assert rate >= TARGET_RATE, f"{rate:,.0f} events/s"
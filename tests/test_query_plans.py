@@ -0,0 +1,19 @@
+import pytest
+
+from db import connect_db, init_db
+from query_plans import _fill_sample, check_query_plans, hot_queries
+
+
+@pytest.fixture
+def conn():
+    conn = connect_db(":memory:")
+    init_db(conn)
+    _fill_sample(conn)
+    yield conn
+    conn.close()
+
+
+# Every hot query must be answered through an index, not a full table scan
+def test_hot_queries_use_an_index(conn):
+    assert hot_queries(conn)
+    assert check_query_plans(conn) == []
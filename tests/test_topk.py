@@ -0,0 +1,99 @@
+import random
+
+import pytest
+
+import activity
+import topk
+from db import connect_db, init_db
+
+# The report's GROUP BY queries that topk replaced
+ORIGINAL_SQL = {
+    "orders": """
+        SELECT ol.pid, p.name, COUNT(DISTINCT ol.ono) AS cnt
+        FROM orderlines ol JOIN products p ON ol.pid=p.pid
+        JOIN orders o ON o.ono = ol.ono
+        WHERE o.odate >= ?
+        GROUP BY ol.pid
+        ORDER BY cnt DESC, ol.pid ASC
+    """,
+    "views": """
+        SELECT v.pid, p.name, COUNT(*) AS cnt
+        FROM viewedProduct v JOIN products p ON v.pid=p.pid
+        WHERE substr(v.ts, 1, 10) >= ?
+        GROUP BY v.pid
+        ORDER BY cnt DESC, v.pid ASC
+    """,
+}
+
+
+# Everything tied with the n-th row, like topk.top_products
+def original_top(conn, metric, n, since):
+    rows = conn.execute(ORIGINAL_SQL[metric], (since or "",)).fetchall()
+    if len(rows) > n:
+        threshold = rows[n - 1]["cnt"]
+        rows = [r for r in rows if r["cnt"] >= threshold]
+    return [(r["pid"], r["name"], r["cnt"]) for r in rows]
+
+
+# Random orders (with repeated pids inside an order) and views over a small,
+# skewed pid range so there are plenty of ties; some pids are not in the
+# catalog, so the JOIN with products matters
+def fill(conn, rng, num_products, num_orders, num_views):
+    conn.execute("PRAGMA foreign_keys = OFF")
+    conn.executemany(
+        "INSERT OR IGNORE INTO products(pid, name, category, price, stock_count, descr) VALUES(?,?,?,?,?,?)",
+        [(pid, f"product {pid}", "misc", 1.0, 10, "") for pid in range(7, num_products + 1)],
+    )
+    conn.execute("INSERT INTO users(uid, pwd, role) VALUES(2, '', 'customer')")
+    conn.execute("INSERT INTO customers(cid, name, email) VALUES(2, 'x', 'x@example.com')")
+    conn.execute("INSERT INTO sessions(cid, sessionNo, start_time) VALUES(2, 1, '2024-01-01')")
+    pick = lambda: min(int(rng.paretovariate(1.2)), num_products + 5)
+    for ono in range(1, num_orders + 1):
+        day = f"2024-01-{rng.randint(1, 28):02d}"
+        conn.execute("INSERT INTO orders(ono, cid, sessionNo, odate, shipping_address) VALUES(?, 2, 1, ?, '')", (ono, day))
+        conn.executemany(
+            "INSERT INTO orderlines(ono, lineNo, pid, qty, uprice) VALUES(?,?,?,1,1.0)",
+            [(ono, line_no, pick()) for line_no in range(1, rng.randint(1, 5) + 1)],
+        )
+    conn.commit()
+    for _ in range(4):
+        activity.write_events(
+            conn,
+            [("viewedProduct", (2, 1, f"2024-01-{rng.randint(1, 28):02d} 12:00:00", pick())) for _ in range(num_views // 4)],
+        )
+    conn.execute("DELETE FROM products WHERE pid IN (3, 11)")
+    conn.commit()
+
+
+@pytest.fixture(params=range(5))
+def conn(request):
+    rng = random.Random(request.param)
+    conn = connect_db(":memory:")
+    init_db(conn)
+    fill(conn, rng, rng.randint(10, 60), rng.randint(50, 300), 4000)
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("metric", topk.METRICS)
+@pytest.mark.parametrize("since", [None, "2024-01-15", "2024-01-28", "2025-01-01"])
+def test_top_products_matches_group_by(conn, metric, since):
+    for n in (1, 2, 3, 5, 10):
+        assert topk.top_products(conn, metric, n, since) == original_top(conn, metric, n, since)
+
+
+def test_top_products_keeps_ties(conn):
+    for metric in topk.METRICS:
+        top = topk.top_products(conn, metric, 1)
+        counts = [cnt for _, _, cnt in original_top(conn, metric, 10 ** 6, None)]
+        assert len(top) == counts.count(counts[0])
+
+
+# The counters kept by the trigger and the activity writer are what
+# rebuild() computes from the raw rows
+def test_counters_match_rebuild(conn):
+    before = [tuple(r) for r in conn.execute("SELECT * FROM product_daily_counts ORDER BY day, pid")]
+    totals = [tuple(r) for r in conn.execute("SELECT * FROM product_counts ORDER BY pid")]
+    topk.rebuild(conn)
+    assert [tuple(r) for r in conn.execute("SELECT * FROM product_daily_counts ORDER BY day, pid")] == before
+    assert [tuple(r) for r in conn.execute("SELECT * FROM product_counts ORDER BY pid")] == totals
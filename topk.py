@@ -0,0 +1,167 @@
+import heapq
+from collections import Counter
+
+# Top-K products by order count and view count, with ties.
+# Per-product counters are kept as orderlines and viewedProduct rows are
+# inserted, both all-time (product_counts) and per day (product_daily_counts)
+# for time-windowed reports: order counts by a trigger (whoever inserts the
+# lines), view counts by the activity writer with add_views(), one upsert per
+# product and day for a whole batch (a per-row trigger halved the event
+# rate). Bulk loads of either table finish with rebuild(). An all-time top-N is then a walk down an index
+# on the counter instead of a GROUP BY over every order line and view event.
+#
+# "orders" counts distinct orders containing the product, like
+# COUNT(DISTINCT ol.ono); "views" counts viewedProduct rows.
+
+METRICS = ("orders", "views")
+
+COUNTER_TABLES = [
+    """
+    create table if not exists product_counts (
+        pid		int,
+        orders		int default 0,
+        views		int default 0,
+        primary key (pid)
+    )
+    """,
+    """
+    create table if not exists product_daily_counts (
+        day		date,
+        pid		int,
+        orders		int default 0,
+        views		int default 0,
+        primary key (day, pid)
+    )
+    """,
+    "create index if not exists idx_product_counts_orders on product_counts(orders desc, pid)",
+    "create index if not exists idx_product_counts_views on product_counts(views desc, pid)",
+]
+
+# A product counts once per order, so only the first line of an order for a
+# given pid bumps the counter.
+COUNTER_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS orderlines_counts_ai AFTER INSERT ON orderlines
+    WHEN NOT EXISTS (SELECT 1 FROM orderlines WHERE ono = new.ono AND pid = new.pid AND lineNo <> new.lineNo)
+    BEGIN
+        INSERT INTO product_counts(pid, orders, views) VALUES (new.pid, 1, 0)
+            ON CONFLICT(pid) DO UPDATE SET orders = orders + 1;
+        INSERT INTO product_daily_counts(day, pid, orders, views)
+            VALUES (COALESCE((SELECT odate FROM orders WHERE ono = new.ono), ''), new.pid, 1, 0)
+            ON CONFLICT(day, pid) DO UPDATE SET orders = orders + 1;
+    END
+    """,
+]
+
+VIEW_COUNTS_SQL = """
+    INSERT INTO product_counts(pid, orders, views) VALUES (?, 0, ?)
+    ON CONFLICT(pid) DO UPDATE SET views = views + excluded.views
+    """
+DAILY_VIEW_COUNTS_SQL = """
+    INSERT INTO product_daily_counts(day, pid, orders, views) VALUES (?, ?, 0, ?)
+    ON CONFLICT(day, pid) DO UPDATE SET views = views + excluded.views
+    """
+
+
+def create_counters(conn):
+    for sql in COUNTER_TABLES + COUNTER_TRIGGERS:
+        conn.execute(sql)
+    conn.commit()
+
+
+# Counts inserted viewedProduct rows (cid, sessionNo, ts, pid) in the
+# counters. Does not commit: call it in the transaction that inserted them.
+def add_views(conn, rows):
+    daily = Counter((str(row[2])[:10], row[3]) for row in rows)
+    totals = Counter()
+    for (day, pid), count in daily.items():
+        totals[pid] += count
+    conn.executemany(DAILY_VIEW_COUNTS_SQL, [(day, pid, count) for (day, pid), count in daily.items()])
+    conn.executemany(VIEW_COUNTS_SQL, list(totals.items()))
+
+
+# Views used to be counted by a per-row trigger
+def drop_view_trigger(conn):
+    conn.execute("DROP TRIGGER IF EXISTS viewedproduct_counts_ai")
+    conn.commit()
+
+
+# Recomputes every counter from orderlines and viewedProduct
+def rebuild(conn):
+    conn.execute("DELETE FROM product_counts")
+    conn.execute("DELETE FROM product_daily_counts")
+    conn.execute(
+        """
+        INSERT INTO product_daily_counts(day, pid, orders, views)
+        SELECT day, pid, SUM(orders), SUM(views) FROM (
+            SELECT COALESCE(o.odate, '') AS day, ol.pid AS pid, COUNT(DISTINCT ol.ono) AS orders, 0 AS views
+            FROM orderlines ol LEFT JOIN orders o ON o.ono = ol.ono
+            GROUP BY 1, 2
+            UNION ALL
+            SELECT substr(ts, 1, 10), pid, 0, COUNT(*)
+            FROM viewedProduct
+            GROUP BY 1, 2
+        )
+        GROUP BY day, pid
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO product_counts(pid, orders, views)
+        SELECT pid, SUM(orders), SUM(views) FROM product_daily_counts GROUP BY pid
+        """
+    )
+    conn.commit()
+
+
+# Returns [(pid, name, count)] for the top n products by `metric`, plus every
+# product tied with the n-th one, ordered by count desc then pid.
+# since=None means all time; otherwise only activity on or after that day
+# ("YYYY-MM-DD", compared like odate and the date part of ts).
+def top_products(conn, metric="orders", n=3, since=None):
+    if metric not in METRICS:
+        raise ValueError(f"unknown metric {metric!r}, expected one of {METRICS}")
+    if n <= 0:
+        return []
+    if since is None:
+        return _top_all_time(conn, metric, n)
+    return _top_since(conn, metric, n, since)
+
+
+# all-time top-N for a metric: the n-th highest count (read by walking the
+# counter index), then every product with at least that count
+NTH_COUNT_SQL = """
+    SELECT c.{metric} FROM product_counts c JOIN products p ON p.pid = c.pid
+    WHERE c.{metric} > 0
+    ORDER BY c.{metric} DESC LIMIT 1 OFFSET ?
+    """
+TOP_SQL = """
+    SELECT c.pid, p.name, c.{metric} AS cnt FROM product_counts c JOIN products p ON p.pid = c.pid
+    WHERE c.{metric} >= ?
+    ORDER BY c.{metric} DESC, c.pid ASC
+    """
+
+
+def _top_all_time(conn, metric, n):
+    row = conn.execute(NTH_COUNT_SQL.format(metric=metric), (n - 1,)).fetchone()
+    threshold = row[0] if row is not None else 1
+    rows = conn.execute(TOP_SQL.format(metric=metric), (threshold,)).fetchall()
+    return [(r["pid"], r["name"], r["cnt"]) for r in rows]
+
+
+def _top_since(conn, metric, n, since):
+    counts = conn.execute(
+        f"""
+        SELECT d.pid, p.name, SUM(d.{metric}) AS cnt
+        FROM product_daily_counts d JOIN products p ON p.pid = d.pid
+        WHERE d.day >= ?
+        GROUP BY d.pid
+        HAVING cnt > 0
+        """,
+        (since,),
+    ).fetchall()
+    if len(counts) > n:
+        threshold = heapq.nlargest(n, (r["cnt"] for r in counts))[-1]
+        counts = [r for r in counts if r["cnt"] >= threshold]
+    counts.sort(key=lambda r: (-r["cnt"], r["pid"]))
+    return [(r["pid"], r["name"], r["cnt"]) for r in counts]